@@ -0,0 +1,81 @@
+# Copyright 2021, Guillermo Adrián Molina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Serial vs pooled unmount/mount of many datasets against tests/fake_zfs.py
+#
+#   python -m benchmarks.executor --count 50 --delay 0.05
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from zcm import zcm_config
+from zcm.lib.executor import get_executor
+from zcm.lib.zfs import zfs_create, zfs_many, zfs_mount, zfs_unmount
+
+FAKE_ZFS = str(Path(__file__).parents[1].joinpath('tests', 'fake_zfs.py'))
+
+
+def measure(title, function):
+    executor = get_executor()
+    executor.stats.reset()
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - start
+    stats = executor.stats.to_dictionary()
+    print('%-8s %8.3fs  spawns=%d  average=%.4fs  max=%.4fs' % (
+        title, elapsed, stats['spawns'], stats['average_time'], stats['max_time']))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--count', type=int, default=50)
+    parser.add_argument('-d', '--delay', type=float, default=0.0,
+                        help='simulated latency of every zfs call')
+    parser.add_argument('-w', '--workers', type=int,
+                        default=zcm_config['max_workers'])
+    options = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='zcm-bench-')
+    os.environ['FAKE_ZFS_ROOT'] = root
+    zcm_config['zfs_command'] = FAKE_ZFS
+    zcm_config['max_workers'] = options.workers
+    try:
+        zfs_create('rpool/bench')
+        names = ['rpool/bench/%08x' % i for i in range(options.count)]
+        zfs_many([('create', [name]) for name in names])
+        os.environ['FAKE_ZFS_DELAY'] = str(options.delay)
+
+        def serial():
+            for name in names:
+                zfs_unmount(name)
+            for name in names:
+                zfs_mount(name)
+
+        def pooled():
+            zfs_many([('unmount', [name]) for name in names])
+            zfs_many([('mount', [name]) for name in names])
+
+        measure('serial', serial)
+        measure('pooled', pooled)
+    finally:
+        get_executor().shutdown()
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
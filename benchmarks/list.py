@@ -0,0 +1,123 @@
+# Copyright 2021, Guillermo Adrián Molina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Time and peak memory to parse a synthetic zfs list -Hp output, the
+# buffered parser with the value_convert() if chain used before vs
+# zfs_list() and the streaming zfs_list_iter() with the converter table.
+# The fixture is printed by a script standing in for zfs, through a pipe.
+#
+#   python -m benchmarks.list --count 1000000
+
+import argparse
+import os
+import pathlib
+import stat
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+from zcm import zcm_config
+from zcm.lib.zfs import zfs_list, zfs_list_iter
+
+PROPERTIES = ['name', 'used', 'avail', 'refer', 'mountpoint', 'creation']
+
+
+def legacy_value_convert(property_name, value):
+    if value == 'on':
+        return True
+    if value == 'off':
+        return False
+    if value == '-':
+        return None
+    if property_name in ['mountpoint', 'zfs_clone_manager:path']:
+        return pathlib.Path(value)
+    if property_name in ['creation', 'st_ctim', 'mtime', 'atime', 'crtime']:
+        try:
+            return datetime.fromtimestamp(float(value))
+        except ValueError:
+            pass
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def legacy_zfs_list(properties):
+    cmd = [zcm_config['zfs_command'], 'list', '-Hp', '-o', ','.join(properties)]
+    output = subprocess.check_output(cmd).decode('utf-8')
+    filesystems = []
+    for line in output.split('\n')[:-1]:
+        filesystem = {}
+        for property_name, value in zip(properties, line.split('\t')):
+            filesystem[property_name] = legacy_value_convert(
+                property_name, value)
+        filesystems.append(filesystem)
+    return filesystems
+
+
+def buffered(properties):
+    return zfs_list(properties=properties)
+
+
+def streamed(properties):
+    count = 0
+    for filesystem in zfs_list_iter(properties=properties):
+        count += 1
+    return count
+
+
+def write_fixture(path, count):
+    creation = str(int(time.time()))
+    with open(path, 'w') as fixture:
+        for i in range(count):
+            id = format(i, '08x')
+            mountpoint = '-' if i % 2 else '/zones/%s' % id
+            fixture.write('rpool/bench/%s\t%d\t%d\t%d\t%s\t%s\n' % (
+                id, i * 512, 10**12, i * 256, mountpoint, creation))
+
+
+def measure(title, function):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function(PROPERTIES)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    count = result if isinstance(result, int) else len(result)
+    print('%-16s %8d datasets  %7.3fs  peak=%.1fMB' % (
+        title, count, elapsed, peak / 2**20))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--count', type=int, default=1000000)
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        fixture = os.path.join(directory, 'zfs_list.txt')
+        write_fixture(fixture, options.count)
+        command = os.path.join(directory, 'zfs')
+        with open(command, 'w') as script:
+            script.write('#!/bin/sh\nexec cat %s\n' % fixture)
+        os.chmod(command, stat.S_IRWXU)
+        zcm_config['zfs_command'] = command
+        measure('legacy', legacy_zfs_list)
+        measure('zfs_list', buffered)
+        measure('zfs_list_iter', streamed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+# Copyright 2021, Guillermo Adrián Molina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Clone lookups on a synthetic manager (no zfs involved), indexed vs the
+# linear scans Manager used before
+#
+#   python -m benchmarks.lookup --count 10000
+
+import argparse
+import tempfile
+import time
+
+from zcm.api.manager import Manager
+
+
+def synthetic_zfs_list(zfs, path, count):
+    # raw zfs list -Hp output of a chain where every clone was cloned from
+    # the previous one
+    creation = str(int(time.time()))
+    zfs_list_output = [{
+        'name': zfs,
+        'zfs_clone_manager:path': path,
+        'origin': '-',
+        'mountpoint': path + '/.clones',
+        'creation': creation,
+        'used': '0'
+    }]
+    for i in range(count):
+        id = format(i, '08x')
+        zfs_list_output.append({
+            'name': '%s/%s' % (zfs, id),
+            'zfs_clone_manager:path': path,
+            'origin': '%s/%s@%s' % (zfs, format(i - 1, '08x'), id) if i else '-',
+            'mountpoint': path if i == count // 2 else '%s/.clones/%s' % (path, id),
+            'creation': creation,
+            'used': '0'
+        })
+    return zfs_list_output
+
+
+def linear_get_clone(manager, id):
+    for clone in manager.clones:
+        if clone.id == id:
+            return clone
+
+
+def linear_find_clones_with_origin(manager, id):
+    return [clone for clone in manager.clones if clone.origin_id == id]
+
+
+def linear_count_older_newer(manager, next_active):
+    older_count = newer_count = 0
+    has_reach_active = False
+    for clone in manager.clones:
+        if clone == next_active:
+            has_reach_active = True
+        elif has_reach_active:
+            newer_count += 1
+        else:
+            older_count += 1
+    return older_count, newer_count
+
+
+def measure(title, function, ids):
+    start = time.perf_counter()
+    for id in ids:
+        function(id)
+    elapsed = time.perf_counter() - start
+    print('%-32s %10.6fs  %8.2fus/op' % (title, elapsed, elapsed * 10**6 / len(ids)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--count', type=int, default=10000)
+    parser.add_argument('-s', '--samples', type=int, default=1000)
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        zfs_list_output = synthetic_zfs_list('rpool/bench', path, options.count)
+        start = time.perf_counter()
+        manager = Manager('rpool/bench', zfs_list_output=zfs_list_output)
+        print('%-32s %10.6fs' % ('load', time.perf_counter() - start))
+        step = max(1, options.count // options.samples)
+        ids = [clone.id for clone in manager.clones[::step]]
+
+        measure('get_clone (linear)', lambda id: linear_get_clone(manager, id), ids)
+        measure('get_clone (indexed)', manager.get_clone, ids)
+        measure('find_clones_with_origin (linear)',
+                lambda id: linear_find_clones_with_origin(manager, id), ids)
+        measure('find_clones_with_origin (index)',
+                manager.find_clones_with_origin, ids)
+        measure('count_older_newer (linear)',
+                lambda id: linear_count_older_newer(manager, manager.get_clone(id)), ids)
+        measure('count_older_newer (indexed)',
+                lambda id: manager.count_older_newer(manager.get_clone(id)), ids)
+
+
+if __name__ == '__main__':
+    main()
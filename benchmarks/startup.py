@@ -0,0 +1,76 @@
+# Copyright 2021, Guillermo Adrián Molina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Startup of zcm with python -X importtime, the total import time and wall
+# time of a few command lines vs importing every command module up front,
+# like zcm did before the commands were loaded lazily
+#
+#   python -m benchmarks.startup --runs 20
+
+import argparse
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from zcm.cli.main import CLI
+
+ROOT = str(Path(__file__).parents[1])
+
+EAGER = 'import zcm.daemon.client, %s' % ', '.join(
+    command.module for command in CLI.commands)
+
+COMMAND_LINES = [
+    ('eager imports', ['-c', EAGER]),
+    ('zcm --version', ['-m', 'zcm', '--version']),
+    ('zcm --help', ['-m', 'zcm', '--help']),
+    ('zcm ls --help', ['-m', 'zcm', 'ls', '--help']),
+    ('zcm send --help', ['-m', 'zcm', 'send', '--help'])
+]
+
+
+def import_time(stderr):
+    # microseconds, the sum of the cumulative time of the top level imports
+    total = 0
+    for line in stderr.splitlines():
+        if line.startswith('import time:') and not line.endswith('imported package'):
+            fields = line.split('|')
+            if not fields[2].startswith('  '):
+                total += int(fields[1])
+    return total
+
+
+def measure(title, arguments, runs):
+    imports = 0
+    start = time.perf_counter()
+    for i in range(runs):
+        process = subprocess.run([sys.executable, '-X', 'importtime'] + arguments,
+                                 cwd=ROOT, capture_output=True, text=True)
+        imports += import_time(process.stderr)
+    elapsed = (time.perf_counter() - start) / runs
+    print('%-16s imports=%6.1fms  wall=%6.1fms' % (
+        title, imports / runs / 1000, elapsed * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--runs', type=int, default=20)
+    options = parser.parse_args()
+
+    for title, arguments in COMMAND_LINES:
+        measure(title, arguments, options.runs)
+
+
+if __name__ == '__main__':
+    main()
@@ -82,7 +82,8 @@ if __name__ == "__main__":
         install_requires=INSTALL_REQUIRES,
         entry_points={
             'console_scripts': [
-                'zcm = zcm.cli.main:main'
+                'zcm = zcm.cli.main:main',
+                'zcmd = zcm.daemon.main:main'
             ]
         },
         classifiers=[
@@ -0,0 +1,940 @@
+#!/usr/bin/env python3
+# Copyright 2021, Guillermo Adrián Molina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Stand-in for /usr/sbin/zfs, used to run the tests and benchmarks without a
+# real pool. Point zcm to it with ZCM_ZFS_COMMAND=/path/to/fake_zfs.py
+#
+# Environment:
+#   FAKE_ZFS_ROOT   directory holding the pool state (default /tmp/fake_zfs)
+#   FAKE_ZFS_POOLS  comma separated pool names (default rpool)
+#   FAKE_ZFS_DELAY  seconds to sleep on every call, to simulate a slow zfs
+#   FAKE_ZFS_LOG    file where every invocation is appended
+#
+# Datasets are kept in $FAKE_ZFS_ROOT/state.json. The content of every
+# filesystem lives in $FAKE_ZFS_ROOT/data/<guid> while it is unmounted and is
+# moved to its mountpoint when mounted, snapshots are copies kept in
+# $FAKE_ZFS_ROOT/snapshots/<guid>.
+#
+# Send streams are a JSON header line followed by a tar archive with one
+# directory per snapshot. Received datasets get new guids and remember the
+# guid they were sent with, which is what incremental and clone streams
+# are matched against.
+
+import fcntl
+import filecmp
+import getopt
+import json
+import os
+import random
+import shutil
+import stat
+import sys
+import tarfile
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.environ.get('FAKE_ZFS_ROOT', '/tmp/fake_zfs'))
+POOLS = os.environ.get('FAKE_ZFS_POOLS', 'rpool').split(',')
+DELAY = float(os.environ.get('FAKE_ZFS_DELAY', '0'))
+LOG = os.environ.get('FAKE_ZFS_LOG')
+AVAILABLE = 2**40
+
+INHERITABLE = {
+    'compression': 'off',
+    'readonly': 'off',
+    'atime': 'on',
+    'canmount': 'on'
+}
+NATIVE = ['name', 'type', 'creation', 'createtxg', 'guid', 'used', 'available',
+          'avail', 'referenced', 'refer', 'mountpoint', 'mounted', 'origin'] + \
+    list(INHERITABLE)
+
+
+class FakeZFSError(Exception):
+    def __init__(self, message, code=1):
+        super().__init__()
+        self.message = message
+        self.code = code
+
+
+class State:
+    def __init__(self, root):
+        self.root = root
+        self.file = os.path.join(root, 'state.json')
+        if os.path.exists(self.file):
+            with open(self.file) as f:
+                data = json.load(f)
+            self.txg = data['txg']
+            self.datasets = data['datasets']
+        else:
+            self.txg = 0
+            self.datasets = {}
+            for pool in POOLS:
+                record = self.new_record(pool, 'filesystem')
+                record['properties']['mountpoint'] = os.path.join(
+                    root, 'mnt', pool)
+                os.makedirs(self.data_dir(record), exist_ok=True)
+                self.mount(pool)
+
+    def save(self):
+        temp_file = self.file + '.tmp'
+        with open(temp_file, 'w') as f:
+            json.dump({'txg': self.txg, 'datasets': self.datasets}, f)
+        os.replace(temp_file, self.file)
+
+    def new_record(self, name, type, origin=None):
+        self.txg += 1
+        record = {
+            'name': name,
+            'type': type,
+            'guid': str(random.getrandbits(63)),
+            'creation': int(time.time()),
+            'createtxg': self.txg,
+            'origin': origin,
+            'mounted': False,
+            'properties': {}
+        }
+        self.datasets[name] = record
+        return record
+
+    def data_dir(self, record):
+        folder = 'data' if record['type'] == 'filesystem' else 'snapshots'
+        return os.path.join(self.root, folder, record['guid'])
+
+    def get(self, name):
+        if name.startswith('/'):
+            return self.get(self.find_by_path(name))
+        record = self.datasets.get(name)
+        if record is None:
+            raise FakeZFSError(
+                "cannot open '%s': dataset does not exist" % name)
+        return record
+
+    def find_by_path(self, path):
+        path = os.path.normpath(path)
+        found = None
+        for name, record in self.datasets.items():
+            if not record['mounted']:
+                continue
+            mountpoint = self.mountpoint(name)
+            if path == mountpoint or path.startswith(mountpoint + '/'):
+                if found is None or len(mountpoint) > len(self.mountpoint(found)):
+                    found = name
+        if found is None:
+            raise FakeZFSError(
+                "cannot open '%s': dataset does not exist" % path)
+        return found
+
+    def parent(self, name):
+        if '@' in name:
+            return name.split('@')[0]
+        if '/' in name:
+            return name.rsplit('/', 1)[0]
+        return None
+
+    def descendants(self, name):
+        return [other for other in self.datasets
+                if other.startswith(name + '/') or other.startswith(name + '@')]
+
+    def snapshots(self, name):
+        snapshots = [self.datasets[other] for other in self.datasets
+                     if other.startswith(name + '@')]
+        return sorted(snapshots, key=lambda record: record['createtxg'])
+
+    def clones_of(self, snapshot):
+        return [name for name, record in self.datasets.items()
+                if record['origin'] == snapshot]
+
+    def sort_key(self, name):
+        record = self.datasets[name]
+        return (name.split('@')[0].split('/'),
+                0 if record['type'] == 'filesystem' else 1,
+                record['createtxg'])
+
+    def property(self, name, property_name):
+        # returns (value, source)
+        record = self.get(name)
+        if property_name == 'name':
+            return name, '-'
+        if property_name in ['type', 'guid', 'creation', 'createtxg']:
+            return str(record[property_name]), '-'
+        if property_name == 'origin':
+            return record['origin'] or '-', '-'
+        if property_name in ['available', 'avail']:
+            return str(AVAILABLE), '-'
+        if property_name in ['referenced', 'refer']:
+            return str(self.referenced(name)), '-'
+        if property_name == 'used':
+            return str(self.used(name)), '-'
+        if property_name == 'mounted':
+            if record['type'] != 'filesystem':
+                return '-', '-'
+            return 'yes' if record['mounted'] else 'no', '-'
+        if property_name == 'mountpoint':
+            if record['type'] != 'filesystem':
+                return '-', '-'
+            return self.mountpoint_source(name)
+        if property_name in INHERITABLE or ':' in property_name:
+            current = name.split('@')[0] if ':' in property_name else name
+            if record['type'] != 'filesystem' and ':' not in property_name:
+                return '-', '-'
+            while current is not None:
+                properties = self.datasets[current]['properties']
+                if property_name in properties:
+                    source = 'local' if current == name else 'inherited from ' + current
+                    return properties[property_name], source
+                current = self.parent(current)
+            return INHERITABLE.get(property_name, '-'), 'default' if property_name in INHERITABLE else '-'
+        raise FakeZFSError("bad property list: invalid property '%s'" %
+                           property_name, 2)
+
+    def mountpoint_source(self, name):
+        properties = self.datasets[name]['properties']
+        if 'mountpoint' in properties:
+            return properties['mountpoint'], 'local'
+        parent = self.parent(name)
+        value, source = self.mountpoint_source(parent)
+        if value in ['none', 'legacy']:
+            return value, 'inherited from ' + parent
+        if source == 'local':
+            source = 'inherited from ' + parent
+        return os.path.join(value, name.rsplit('/', 1)[1]), source
+
+    def mountpoint(self, name):
+        return self.mountpoint_source(name)[0]
+
+    def content_dir(self, name):
+        record = self.datasets[name]
+        if record['mounted']:
+            return self.mountpoint(name)
+        return self.data_dir(record)
+
+    def nested_mountpoints(self, name):
+        # mountpoints of other filesystems that sit inside this one
+        mountpoint = self.mountpoint(name)
+        return set(self.mountpoint(other)
+                   for other, record in self.datasets.items()
+                   if other != name and record['mounted'] and
+                   self.mountpoint(other).startswith(mountpoint + '/'))
+
+    def referenced(self, name):
+        record = self.datasets[name]
+        if record['type'] == 'filesystem':
+            return tree_size(self.content_dir(name), self.nested_mountpoints(name))
+        return tree_size(self.data_dir(record), set())
+
+    def used(self, name):
+        record = self.datasets[name]
+        if record['type'] != 'filesystem':
+            return self.referenced(name)
+        total = self.referenced(name)
+        for other in self.descendants(name):
+            if self.parent(other) == name:
+                total += self.used(other)
+        return total
+
+    def mount(self, name, overlay=False):
+        record = self.get(name)
+        if record['type'] != 'filesystem':
+            raise FakeZFSError("cannot mount '%s': not a filesystem" % name)
+        if record['mounted']:
+            raise FakeZFSError(
+                "cannot mount '%s': filesystem already mounted" % name)
+        mountpoint = self.mountpoint(name)
+        if mountpoint in ['none', 'legacy']:
+            raise FakeZFSError(
+                "cannot mount '%s': no mountpoint set" % name)
+        os.makedirs(mountpoint, exist_ok=True)
+        if os.listdir(mountpoint) and not overlay:
+            raise FakeZFSError(
+                "cannot mount '%s': directory is not empty" % mountpoint)
+        move_entries(self.data_dir(record), mountpoint)
+        record['mounted'] = True
+
+    def unmount(self, name):
+        record = self.get(name)
+        if not record['mounted']:
+            raise FakeZFSError(
+                "cannot unmount '%s': not currently mounted" % name)
+        if self.nested_mountpoints(name):
+            raise FakeZFSError("cannot unmount '%s': Device busy" %
+                               self.mountpoint(name))
+        move_entries(self.mountpoint(name), self.data_dir(record))
+        record['mounted'] = False
+
+    def unmount_tree(self, names):
+        # unmount the deepest mountpoints first
+        mounted = [name for name in names
+                   if self.datasets[name]['type'] == 'filesystem' and
+                   self.datasets[name]['mounted']]
+        mounted.sort(key=lambda name: self.mountpoint(name), reverse=True)
+        for name in mounted:
+            self.unmount(name)
+        return mounted
+
+    def mount_tree(self, names):
+        for name in sorted(names, key=lambda name: self.mountpoint(name)):
+            if self.mountpoint(name) not in ['none', 'legacy']:
+                self.mount(name)
+
+    def create(self, name, properties, parents=False, origin=None):
+        if name in self.datasets:
+            raise FakeZFSError(
+                "cannot create '%s': dataset already exists" % name)
+        parent = self.parent(name)
+        if parent is None:
+            raise FakeZFSError(
+                "cannot create '%s': missing dataset name" % name, 2)
+        if parent not in self.datasets:
+            if not parents:
+                raise FakeZFSError(
+                    "cannot create '%s': parent does not exist" % name)
+            self.create(parent, {}, parents=True)
+        record = self.new_record(name, 'filesystem', origin)
+        record['properties'].update(properties)
+        os.makedirs(self.data_dir(record))
+        if origin is not None:
+            copy_tree(self.data_dir(self.datasets[origin]),
+                      self.data_dir(record), set())
+        if self.mountpoint(name) not in ['none', 'legacy'] and \
+                self.property(name, 'canmount')[0] == 'on':
+            self.mount(name)
+        return record
+
+    def snapshot(self, name):
+        filesystem, snapshot_name = name.split('@')
+        if name in self.datasets:
+            raise FakeZFSError(
+                "cannot create snapshot '%s': dataset already exists" % name)
+        self.get(filesystem)
+        record = self.new_record(name, 'snapshot')
+        copy_tree(self.content_dir(filesystem), self.data_dir(record),
+                  self.nested_mountpoints(filesystem)
+                  if self.datasets[filesystem]['mounted'] else set())
+        return record
+
+    def destroy(self, name):
+        record = self.datasets[name]
+        if record['type'] == 'filesystem':
+            if record['mounted']:
+                self.unmount(name)
+            if 'mountpoint' not in record['properties']:
+                mountpoint = self.mountpoint(name)
+                if os.path.isdir(mountpoint) and not os.listdir(mountpoint):
+                    os.rmdir(mountpoint)
+        shutil.rmtree(self.data_dir(record), ignore_errors=True)
+        del self.datasets[name]
+
+    def rename(self, old_name, new_name):
+        renamed = [old_name] + self.descendants(old_name)
+        mounted = self.unmount_tree(renamed)
+        for name in renamed:
+            new = new_name + name[len(old_name):]
+            record = self.datasets.pop(name)
+            record['name'] = new
+            self.datasets[new] = record
+            for other in self.datasets.values():
+                if other['origin'] == name:
+                    other['origin'] = new
+        self.mount_tree([new_name + name[len(old_name):] for name in mounted])
+
+    def remount(self, name, change):
+        # apply change() with the affected filesystems unmounted
+        affected = [name] + [other for other in self.descendants(name)
+                             if '@' not in other]
+        mounted = self.unmount_tree(affected)
+        change()
+        self.mount_tree(mounted)
+
+
+def tree_size(directory, skip):
+    total = 0
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = [d for d in dirs if os.path.join(root, d) not in skip]
+        for file in files:
+            try:
+                total += os.lstat(os.path.join(root, file)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def move_entries(source, target):
+    os.makedirs(source, exist_ok=True)
+    os.makedirs(target, exist_ok=True)
+    for entry in os.listdir(source):
+        os.rename(os.path.join(source, entry), os.path.join(target, entry))
+
+
+def copy_tree(source, target, skip):
+    # nested mountpoints are copied as empty directories
+    os.makedirs(target, exist_ok=True)
+    for entry in os.listdir(source):
+        source_entry = os.path.join(source, entry)
+        target_entry = os.path.join(target, entry)
+        if source_entry in skip:
+            os.mkdir(target_entry)
+        elif os.path.isdir(source_entry) and not os.path.islink(source_entry):
+            copy_tree(source_entry, target_entry, skip)
+            shutil.copystat(source_entry, target_entry)
+        else:
+            shutil.copy2(source_entry, target_entry, follow_symlinks=False)
+
+
+def walk_tree(directory, skip):
+    # returns {relative path: (file type, absolute path)}
+    entries = {}
+    if directory is None or not os.path.isdir(directory):
+        return entries
+    for root, dirs, files in os.walk(directory):
+        for name in dirs + files:
+            path = os.path.join(root, name)
+            entries[os.path.relpath(path, directory)] = (file_type(path), path)
+        dirs[:] = [d for d in dirs if os.path.join(root, d) not in skip]
+    return entries
+
+
+def file_type(path):
+    mode = os.lstat(path).st_mode
+    if stat.S_ISDIR(mode):
+        return '/'
+    if stat.S_ISLNK(mode):
+        return '@'
+    if stat.S_ISFIFO(mode):
+        return '|'
+    if stat.S_ISSOCK(mode):
+        return '='
+    if stat.S_ISBLK(mode) or stat.S_ISCHR(mode):
+        return 'B'
+    return 'F'
+
+
+def parse_options(arguments, short_options):
+    try:
+        return getopt.getopt(arguments, short_options)
+    except getopt.GetoptError as e:
+        raise FakeZFSError(str(e), 2)
+
+
+def parse_properties(values):
+    properties = {}
+    for value in values:
+        if '=' not in value:
+            raise FakeZFSError("missing '=' for property: %s" % value, 2)
+        key, value = value.split('=', 1)
+        properties[key] = value
+    return properties
+
+
+def command_list(state, arguments):
+    options, names = parse_options(arguments, 'Hprd:t:o:s:S:')
+    options = dict(options)
+    properties = options.get('-o', 'name,used,avail,refer,mountpoint').split(',')
+    types = options.get('-t', 'filesystem,volume').split(',')
+    if 'all' in types:
+        types = ['filesystem', 'volume', 'snapshot']
+    recursive = '-r' in options or '-d' in options or not names
+    selected = []
+    failed = False
+    for name in names or sorted(n for n in state.datasets if '/' not in n and '@' not in n):
+        try:
+            name = state.get(name)['name']
+        except FakeZFSError as e:
+            print(e.message, file=sys.stderr)
+            failed = True
+            continue
+        if not names or state.datasets[name]['type'] in types:
+            selected.append(name)
+        if recursive:
+            selected += [other for other in state.descendants(name)
+                         if state.datasets[other]['type'] in types]
+    if '-H' not in options:
+        print('\t'.join(property_name.upper() for property_name in properties))
+    for name in sorted(set(selected), key=state.sort_key):
+        print('\t'.join(state.property(name, property_name)[0]
+                        for property_name in properties))
+    return 1 if failed else 0
+
+
+def command_get(state, arguments):
+    options, arguments = parse_options(arguments, 'Hprd:o:s:t:')
+    options = dict(options)
+    if not arguments:
+        raise FakeZFSError('missing property argument', 2)
+    fields = options.get('-o', 'name,property,value,source').split(',')
+    properties = arguments[0].split(',')
+    if properties == ['all']:
+        properties = NATIVE + sorted(set(
+            key for record in state.datasets.values()
+            for key in record['properties'] if ':' in key))
+    names = arguments[1:]
+    if not names:
+        names = sorted(state.datasets, key=state.sort_key)
+    failed = False
+    if '-H' not in options:
+        print('\t'.join(field.upper() for field in fields))
+    for name in names:
+        try:
+            name = state.get(name)['name']
+        except FakeZFSError as e:
+            print(e.message, file=sys.stderr)
+            failed = True
+            continue
+        selected = [name]
+        if '-r' in options:
+            selected += sorted(state.descendants(name), key=state.sort_key)
+        for dataset in selected:
+            for property_name in properties:
+                value, source = state.property(dataset, property_name)
+                row = {'name': dataset, 'property': property_name,
+                       'value': value, 'source': source}
+                print('\t'.join(row[field] for field in fields))
+    return 1 if failed else 0
+
+
+def command_create(state, arguments):
+    options, names = parse_options(arguments, 'po:')
+    if len(names) != 1:
+        raise FakeZFSError('usage: create [-p] [-o property=value] ... <filesystem>', 2)
+    properties = parse_properties(
+        value for option, value in options if option == '-o')
+    parents = any(option == '-p' for option, value in options)
+    state.create(names[0], properties, parents=parents)
+    return 0
+
+
+def command_clone(state, arguments):
+    options, names = parse_options(arguments, 'po:')
+    if len(names) != 2:
+        raise FakeZFSError('usage: clone [-p] [-o property=value] ... <snapshot> <filesystem|volume>', 2)
+    snapshot, name = names
+    if state.get(snapshot)['type'] != 'snapshot':
+        raise FakeZFSError("cannot open '%s': not a snapshot" % snapshot)
+    properties = parse_properties(
+        value for option, value in options if option == '-o')
+    parents = any(option == '-p' for option, value in options)
+    state.create(name, properties, parents=parents, origin=snapshot)
+    return 0
+
+
+def command_snapshot(state, arguments):
+    options, names = parse_options(arguments, 'ro:')
+    recursive = any(option == '-r' for option, value in options)
+    if not names:
+        raise FakeZFSError('missing snapshot argument', 2)
+    snapshots = []
+    for name in names:
+        if '@' not in name:
+            raise FakeZFSError("cannot create snapshot '%s': a '@' character must delimit the snapshot name" % name, 2)
+        filesystem, snapshot_name = name.split('@')
+        state.get(filesystem)
+        snapshots.append(name)
+        if recursive:
+            snapshots += [other + '@' + snapshot_name
+                          for other in state.descendants(filesystem) if '@' not in other]
+    pools = set(name.split('/')[0].split('@')[0] for name in snapshots)
+    if len(pools) > 1:
+        raise FakeZFSError('cannot create snapshots : snapshots must be in the same pool')
+    for name in snapshots:
+        if name in state.datasets:
+            raise FakeZFSError(
+                "cannot create snapshot '%s': dataset already exists" % name)
+    for name in snapshots:
+        state.snapshot(name)
+    return 0
+
+
+def command_destroy(state, arguments):
+    options, names = parse_options(arguments, 'dfnprRsv')
+    options = dict(options)
+    if len(names) != 1:
+        raise FakeZFSError('usage: destroy [-fnpRrv] <filesystem|volume|snapshot>', 2)
+    name = state.get(names[0])['name']
+    targets = [name]
+    descendants = state.descendants(name)
+    if '@' in name and '-r' in options:
+        # every snapshot with the same name in the filesystem's descendants
+        filesystem, snapshot_name = name.split('@')
+        descendants = [other + '@' + snapshot_name
+                       for other in state.descendants(filesystem)
+                       if '@' not in other and
+                       other + '@' + snapshot_name in state.datasets]
+    if descendants:
+        if '-r' not in options and '-R' not in options:
+            raise FakeZFSError("cannot destroy '%s': filesystem has children\n"
+                               "use '-r' to destroy the following datasets:\n%s" %
+                               (name, '\n'.join(descendants)))
+        targets += descendants
+    for target in targets:
+        for clone in state.clones_of(target):
+            if clone not in targets:
+                if '-R' in options:
+                    targets += [clone] + state.descendants(clone)
+                else:
+                    raise FakeZFSError("cannot destroy '%s': snapshot has dependent clones\n"
+                                       "use '-R' to destroy the following datasets:\n%s" %
+                                       (target, clone))
+    state.unmount_tree(targets)
+    # snapshots first, then the deepest filesystems
+    for target in sorted(targets, key=lambda n: ('@' not in n, -len(n.split('/')))):
+        state.destroy(target)
+    return 0
+
+
+def command_promote(state, arguments):
+    if len(arguments) != 1:
+        raise FakeZFSError('usage: promote <clone-filesystem>', 2)
+    name = state.get(arguments[0])['name']
+    record = state.datasets[name]
+    if record['origin'] is None:
+        raise FakeZFSError("cannot promote '%s': not a cloned filesystem" % name)
+    origin = state.datasets[record['origin']]
+    origin_filesystem = record['origin'].split('@')[0]
+    moved = [snapshot for snapshot in state.snapshots(origin_filesystem)
+             if snapshot['createtxg'] <= origin['createtxg']]
+    for snapshot in moved:
+        new_name = name + '@' + snapshot['name'].split('@')[1]
+        if new_name in state.datasets:
+            raise FakeZFSError("cannot promote '%s': snapshot name '%s' from origin conflicts with '%s' from target" %
+                               (name, new_name.split('@')[1], new_name))
+    record['origin'] = state.datasets[origin_filesystem]['origin']
+    for snapshot in moved:
+        old_name = snapshot['name']
+        new_name = name + '@' + old_name.split('@')[1]
+        del state.datasets[old_name]
+        snapshot['name'] = new_name
+        state.datasets[new_name] = snapshot
+        for other in state.datasets.values():
+            if other['origin'] == old_name:
+                other['origin'] = new_name
+    state.datasets[origin_filesystem]['origin'] = origin['name']
+    return 0
+
+
+def command_rename(state, arguments):
+    options, names = parse_options(arguments, 'fpru')
+    if len(names) != 2:
+        raise FakeZFSError('usage: rename <filesystem|volume|snapshot> <filesystem|volume|snapshot>', 2)
+    old_name, new_name = names
+    if new_name.startswith('@'):
+        new_name = old_name.split('@')[0] + new_name
+    state.get(old_name)
+    if new_name in state.datasets:
+        raise FakeZFSError(
+            "cannot rename to '%s': dataset already exists" % new_name)
+    if state.parent(new_name) not in state.datasets:
+        raise FakeZFSError(
+            "cannot rename to '%s': parent does not exist" % new_name)
+    state.rename(old_name, new_name)
+    return 0
+
+
+def command_set(state, arguments):
+    properties = parse_properties(a for a in arguments if '=' in a)
+    names = [a for a in arguments if '=' not in a]
+    if not properties or not names:
+        raise FakeZFSError('usage: set <property=value> ... <filesystem|volume|snapshot> ...', 2)
+    for name in names:
+        name = state.get(name)['name']
+        for key in properties:
+            if key not in NATIVE and ':' not in key:
+                raise FakeZFSError("cannot set property for '%s': invalid property '%s'" % (name, key))
+
+        def change():
+            state.datasets[name]['properties'].update(properties)
+        if 'mountpoint' in properties:
+            state.remount(name, change)
+        else:
+            change()
+    return 0
+
+
+def command_inherit(state, arguments):
+    options, arguments = parse_options(arguments, 'rS')
+    if len(arguments) < 2:
+        raise FakeZFSError('usage: inherit [-rS] <property> <filesystem|volume|snapshot> ...', 2)
+    property_name = arguments[0]
+    for name in arguments[1:]:
+        name = state.get(name)['name']
+
+        def change():
+            state.datasets[name]['properties'].pop(property_name, None)
+        if property_name == 'mountpoint':
+            state.remount(name, change)
+        else:
+            change()
+    return 0
+
+
+def command_mount(state, arguments):
+    options, names = parse_options(arguments, 'aOvo:')
+    options = dict(options)
+    if not names and '-a' not in options:
+        for name in sorted(state.datasets, key=state.sort_key):
+            if state.datasets[name]['mounted']:
+                print('%s\t%s' % (name, state.mountpoint(name)))
+        return 0
+    if '-a' in options:
+        names = [name for name, record in state.datasets.items()
+                 if record['type'] == 'filesystem' and not record['mounted']]
+        state.mount_tree(names)
+        return 0
+    for name in names:
+        state.mount(state.get(name)['name'], overlay='-O' in options)
+    return 0
+
+
+def command_unmount(state, arguments):
+    options, names = parse_options(arguments, 'af')
+    options = dict(options)
+    if '-a' in options:
+        state.unmount_tree(list(state.datasets))
+        return 0
+    if not names:
+        raise FakeZFSError('usage: unmount [-f] <-a | filesystem|mountpoint>', 2)
+    for name in names:
+        state.unmount(state.get(name)['name'])
+    return 0
+
+
+def command_diff(state, arguments):
+    options, names = parse_options(arguments, 'EFHrt')
+    options = dict(options)
+    if not names or len(names) > 2:
+        raise FakeZFSError('usage: diff [-FHt] <snapshot> [snapshot|filesystem]', 2)
+    if '-E' in options:
+        old_entries = {}
+        new_name = state.get(names[-1])['name']
+    else:
+        old_name = state.get(names[0])['name']
+        if state.datasets[old_name]['type'] != 'snapshot':
+            raise FakeZFSError("Badly formed snapshot name %s" % old_name, 2)
+        new_name = state.get(names[1])['name'] if len(names) == 2 \
+            else old_name.split('@')[0]
+        old_entries = walk_tree(state.data_dir(state.datasets[old_name]), set())
+    new_record = state.datasets[new_name]
+    filesystem = new_name.split('@')[0]
+    if new_record['type'] == 'snapshot':
+        new_entries = walk_tree(state.data_dir(new_record), set())
+        prefix = os.path.join(state.mountpoint(filesystem), '.zfs',
+                              'snapshot', new_name.split('@')[1])
+    else:
+        skip = state.nested_mountpoints(new_name) if new_record['mounted'] else set()
+        new_entries = walk_tree(state.content_dir(new_name), skip)
+        prefix = state.mountpoint(filesystem)
+
+    changes = []
+    for path in sorted(set(old_entries) | set(new_entries)):
+        old = old_entries.get(path)
+        new = new_entries.get(path)
+        if old is None:
+            changes.append(('+', new, path))
+        elif new is None:
+            changes.append(('-', old, path))
+        elif old[0] != new[0]:
+            changes.append(('-', old, path))
+            changes.append(('+', new, path))
+        elif new[0] == 'F' and not filecmp.cmp(old[1], new[1], shallow=False):
+            changes.append(('M', new, path))
+        elif new[0] == '@' and os.readlink(old[1]) != os.readlink(new[1]):
+            changes.append(('M', new, path))
+    modified = set(os.path.dirname(path) for change, entry, path in changes
+                   if change != 'M') - {''}
+    for path in sorted(modified):
+        if path in old_entries and path in new_entries and \
+                old_entries[path][0] == new_entries[path][0] == '/':
+            changes.append(('M', new_entries[path], path))
+    for change, entry, path in changes:
+        file_stat = os.lstat(entry[1])
+        record = []
+        if '-t' in options:
+            record.append('%d.%09d' % (int(file_stat.st_ctime),
+                                       file_stat.st_ctime_ns % 10**9))
+        record.append(change)
+        if '-F' in options:
+            record.append(entry[0])
+        record.append(os.path.join(prefix, path))
+        print('\t'.join(record))
+    return 0
+
+
+def find_by_guid(state, guid, name):
+    # snapshot of the pool of name (or of the filesystem name if it exists)
+    # sent with guid, received copies first
+    pool = name.split('/')[0]
+    found = []
+    for other, record in state.datasets.items():
+        if record['type'] != 'snapshot' or other.split('/')[0].split('@')[0] != pool:
+            continue
+        if name in state.datasets and other.split('@')[0] != name:
+            continue
+        if record.get('received_guid') == guid:
+            return other
+        if record['guid'] == guid:
+            found.append(other)
+    return found[0] if found else None
+
+
+def command_send(state, arguments):
+    options, names = parse_options(arguments, 'cDLpPvei:I:R')
+    options = dict(options)
+    if len(names) != 1:
+        raise FakeZFSError('usage: send [-cpv] [-[iI] snapshot] <snapshot>', 2)
+    if '-R' in options:
+        raise FakeZFSError('fake zfs does not support send -R', 2)
+    name = state.get(names[0])['name']
+    record = state.datasets[name]
+    if record['type'] != 'snapshot':
+        raise FakeZFSError("cannot send '%s': not a snapshot" % name)
+    filesystem = name.split('@')[0]
+    first = options.get('-I', options.get('-i'))
+    snapshots = [record]
+    header = {'from': None, 'from_guid': None}
+    if first is not None:
+        if first.startswith('@'):
+            first = filesystem + first
+        first_record = state.get(first)
+        if first_record['type'] != 'snapshot' or \
+                first_record['createtxg'] >= record['createtxg']:
+            raise FakeZFSError("cannot send '%s': incremental source must be an earlier snapshot" % name)
+        header['from'] = first
+        header['from_guid'] = first_record.get('received_guid') or first_record['guid']
+        if '-I' in options:
+            snapshots = [snapshot for snapshot in state.snapshots(filesystem)
+                         if first_record['createtxg'] < snapshot['createtxg'] <= record['createtxg']]
+    header['snapshots'] = [{'name': snapshot['name'].split('@')[1],
+                            'guid': snapshot.get('received_guid') or snapshot['guid']}
+                           for snapshot in snapshots]
+    # written once the state is unlocked, so zfs send | zfs receive works
+    output = tempfile.NamedTemporaryFile(dir=state.root, delete=False)
+    with output:
+        output.write((json.dumps(header) + '\n').encode('utf-8'))
+        with tarfile.open(fileobj=output, mode='w|') as archive:
+            for index, snapshot in enumerate(snapshots):
+                archive.add(state.data_dir(snapshot), arcname=str(index))
+    state.output_file = output.name
+    return 0
+
+
+def command_receive(state, arguments):
+    options, names = parse_options(arguments, 'Fnuvdeo:')
+    options = dict(options)
+    if len(names) != 1:
+        raise FakeZFSError('usage: receive [-Fnuv] <filesystem|volume|snapshot>', 2)
+    name = names[0].split('@')[0]
+    with open(state.input_file, 'rb') as stream:
+        header = json.loads(stream.readline().decode('utf-8'))
+        origin = None
+        if header['from'] is None:
+            if name in state.datasets:
+                raise FakeZFSError("cannot receive new filesystem stream: destination '%s' exists" % name)
+        elif name in state.datasets:
+            if find_by_guid(state, header['from_guid'], name) is None:
+                raise FakeZFSError("cannot receive incremental stream: most recent snapshot of %s does not match incremental source" % name)
+        else:
+            origin = find_by_guid(state, header['from_guid'], name)
+            if origin is None:
+                raise FakeZFSError("cannot receive: local origin for clone %s does not exist" % name)
+        if name not in state.datasets:
+            record = state.create(name, {'canmount': 'noauto'} if '-u' in options else {},
+                                  origin=origin)
+            record['properties'].pop('canmount', None)
+        for snapshot in header['snapshots']:
+            if '%s@%s' % (name, snapshot['name']) in state.datasets:
+                raise FakeZFSError("cannot receive: destination %s@%s exists" %
+                                   (name, snapshot['name']))
+        directory = tempfile.mkdtemp(dir=state.root)
+        try:
+            with tarfile.open(fileobj=stream, mode='r|') as archive:
+                archive.extractall(directory)
+            content = state.content_dir(name)
+            for index, snapshot in enumerate(header['snapshots']):
+                shutil.rmtree(content)
+                os.makedirs(content)
+                copy_tree(os.path.join(directory, str(index)), content, set())
+                record = state.snapshot('%s@%s' % (name, snapshot['name']))
+                record['received_guid'] = snapshot['guid']
+        finally:
+            shutil.rmtree(directory)
+    return 0
+
+
+COMMANDS = {
+    'list': command_list,
+    'get': command_get,
+    'create': command_create,
+    'clone': command_clone,
+    'snapshot': command_snapshot,
+    'snap': command_snapshot,
+    'destroy': command_destroy,
+    'promote': command_promote,
+    'rename': command_rename,
+    'set': command_set,
+    'inherit': command_inherit,
+    'mount': command_mount,
+    'unmount': command_unmount,
+    'umount': command_unmount,
+    'diff': command_diff,
+    'send': command_send,
+    'receive': command_receive,
+    'recv': command_receive
+}
+
+
+def main(arguments):
+    if LOG:
+        with open(LOG, 'a') as log:
+            log.write(' '.join(arguments) + '\n')
+    if DELAY:
+        time.sleep(DELAY)
+    if not arguments or arguments[0] not in COMMANDS:
+        print('usage: zfs command args ...', file=sys.stderr)
+        return 2
+    os.makedirs(ROOT, exist_ok=True)
+    input_file = None
+    if arguments[0] in ['receive', 'recv']:
+        # read before locking the state, the sender may still hold it
+        with tempfile.NamedTemporaryFile(dir=ROOT, delete=False) as input:
+            shutil.copyfileobj(sys.stdin.buffer, input)
+        input_file = input.name
+    try:
+        with open(os.path.join(ROOT, 'lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            state = State(ROOT)
+            state.input_file = input_file
+            state.output_file = None
+            try:
+                code = COMMANDS[arguments[0]](state, arguments[1:])
+            except FakeZFSError as e:
+                print(e.message, file=sys.stderr)
+                code = e.code
+            finally:
+                state.save()
+    finally:
+        if input_file is not None:
+            os.unlink(input_file)
+    if state.output_file is not None:
+        try:
+            with open(state.output_file, 'rb') as output:
+                shutil.copyfileobj(output, sys.stdout.buffer)
+        except BrokenPipeError:
+            code = 1
+        finally:
+            os.unlink(state.output_file)
+    return code
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,59 @@
+# Copyright 2021, Guillermo Adrián Molina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from zcm import zcm_config
+from zcm.lib.executor import Executor, set_executor
+from zcm.lib.zfs import zfs_cache
+
+FAKE_ZFS = str(Path(__file__).with_name('fake_zfs.py'))
+
+
+class FakeZFSTestCase(unittest.TestCase):
+    # Runs every zfs command against tests/fake_zfs.py in a private directory
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp(prefix='zcm-'))
+        self.pool_path = Path(self.root, 'mnt', 'rpool')
+        self.previous_root = os.environ.get('FAKE_ZFS_ROOT')
+        os.environ['FAKE_ZFS_ROOT'] = str(self.root)
+        self.previous_command = zcm_config['zfs_command']
+        zcm_config['zfs_command'] = FAKE_ZFS
+        self.previous_cache_directory = zcm_config['diff_cache_directory']
+        zcm_config['diff_cache_directory'] = str(Path(self.root, 'cache'))
+        self.previous_zfs_cache = (zcm_config['zfs_cache_ttl'], zcm_config['zfs_cache_size'])
+        self.previous_socket = zcm_config['daemon_socket']
+        zcm_config['daemon_socket'] = str(Path(self.root, 'zcmd.sock'))
+        self.executor = Executor()
+        self.previous_executor = set_executor(self.executor)
+        return super().setUp()
+
+    def tearDown(self):
+        set_executor(self.previous_executor)
+        self.executor.shutdown()
+        zcm_config['zfs_command'] = self.previous_command
+        zcm_config['diff_cache_directory'] = self.previous_cache_directory
+        zcm_config['zfs_cache_ttl'], zcm_config['zfs_cache_size'] = self.previous_zfs_cache
+        zcm_config['daemon_socket'] = self.previous_socket
+        zfs_cache.clear()
+        if self.previous_root is None:
+            del os.environ['FAKE_ZFS_ROOT']
+        else:
+            os.environ['FAKE_ZFS_ROOT'] = self.previous_root
+        shutil.rmtree(self.root, ignore_errors=True)
+        return super().tearDown()
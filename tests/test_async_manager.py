@@ -0,0 +1,163 @@
+# Copyright 2021, Guillermo Adrián Molina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import os
+import subprocess
+import unittest
+from pathlib import Path
+
+from zcm.api.async_manager import AsyncManager
+from zcm.api.manager import Manager
+from zcm.exceptions import ZCMError
+from zcm.lib.async_zfs import AsyncExecutor, set_async_executor
+from zcm.lib.zfs import zfs_get, zfs_list
+
+from tests.helpers import FakeZFSTestCase
+
+
+class FailingAsyncExecutor(AsyncExecutor):
+    # fails once the zfs command given as [command, arguments...]
+    def __init__(self, failing_command):
+        super().__init__()
+        self.failing_command = failing_command
+
+    async def run(self, cmd):
+        if cmd[1:] == self.failing_command:
+            self.failing_command = None
+            return subprocess.CompletedProcess(cmd, 1, '', 'failed\n')
+        return await super().run(cmd)
+
+
+class HangingAsyncExecutor(AsyncExecutor):
+    # the zfs command given as [command, arguments...] never finishes, once
+    def __init__(self, hanging_command):
+        super().__init__()
+        self.hanging_command = hanging_command
+        self.hanging = asyncio.Event()
+
+    async def run(self, cmd):
+        if cmd[1:] == self.hanging_command:
+            self.hanging_command = None
+            self.hanging.set()
+            await asyncio.Event().wait()
+        return await super().run(cmd)
+
+
+class TestAsyncManager(FakeZFSTestCase):
+    def setUp(self):
+        super().setUp()
+        self.async_executor = AsyncExecutor()
+        self.previous_async_executor = set_async_executor(self.async_executor)
+        self.directories = [Path(self.root, 'directory%d' % i) for i in range(3)]
+        for i, directory in enumerate(self.directories):
+            Manager.initialize_manager('rpool/manager%d' % i, str(directory))
+
+    def tearDown(self):
+        set_async_executor(self.previous_async_executor)
+        os.environ.pop('FAKE_ZFS_DELAY', None)
+        return super().tearDown()
+
+    def test_operations(self):
+        async def operate(directory):
+            manager = await AsyncManager.open(str(directory))
+            await manager.clone()
+            await manager.clone()
+            await manager.activate('00000002')
+            await manager.remove('00000001')
+            await manager.clone(max_total=2, auto_remove=True)
+            return manager
+
+        async def operate_all():
+            return await asyncio.gather(*[operate(directory)
+                                          for directory in self.directories])
+
+        self.executor.stats.reset()
+        managers = asyncio.run(operate_all())
+        # nothing ran through the blocking executor
+        self.assertEqual(self.executor.stats.spawns, 0)
+        for manager, directory in zip(managers, self.directories):
+            loaded = Manager(str(directory))
+            self.assertEqual(manager.to_dictionary(), loaded.to_dictionary())
+            self.assertEqual([clone.id for clone in manager.clones], ['00000002', '00000003'])
+            self.assertEqual(manager.active_clone.mountpoint, directory)
+            self.assertIsNotNone(manager.activation_timing)
+        self.assertEqual(self.async_executor.stats.failures, 0)
+        self.assertEqual([manager.zfs for manager in asyncio.run(AsyncManager.get_managers())],
+                         ['rpool/manager0', 'rpool/manager1', 'rpool/manager2'])
+
+        asyncio.run(managers[0].destroy())
+        self.assertEqual(zfs_list('rpool/manager0'), [])
+        self.assertFalse(self.directories[0].exists())
+        with self.assertRaises(ZCMError):
+            asyncio.run(AsyncManager.open('rpool/manager0'))
+
+    def test_activation_failure(self):
+        # the steps of Manager.activate() restore the manager like there
+        manager = asyncio.run(AsyncManager.open(str(self.directories[0])))
+        asyncio.run(manager.clone())
+        set_async_executor(FailingAsyncExecutor(
+            ['inherit', 'mountpoint', 'rpool/manager0/00000000']))
+        with self.assertRaises(ZCMError):
+            asyncio.run(manager.activate('00000001'))
+        set_async_executor(self.async_executor)
+        self.assertEqual(manager.active_clone.id, '00000000')
+        self.assertEqual(manager.to_dictionary(),
+                         Manager(str(self.directories[0])).to_dictionary())
+        self.assertTrue(manager.manager.verify())
+
+    def test_activation_cancelled(self):
+        # cancelled between the unmount and the mount of the swap
+        manager = asyncio.run(AsyncManager.open(str(self.directories[0])))
+        asyncio.run(manager.clone())
+        executor = HangingAsyncExecutor(['mount', 'rpool/manager0/00000001'])
+        set_async_executor(executor)
+
+        async def cancel():
+            task = asyncio.ensure_future(manager.activate('00000001'))
+            await executor.hanging.wait()
+            task.cancel()
+            await task
+
+        with self.assertRaises(asyncio.CancelledError):
+            asyncio.run(cancel())
+        set_async_executor(self.async_executor)
+        self.assertEqual(manager.active_clone.id, '00000000')
+        self.assertEqual(zfs_get('rpool/manager0/00000000', 'mountpoint'), self.directories[0])
+        for zfs in ['rpool/manager0', 'rpool/manager0/00000000', 'rpool/manager0/00000001']:
+            self.assertEqual(zfs_get(zfs, 'mounted'), 'yes')
+        self.assertEqual(manager.to_dictionary(),
+                         Manager(str(self.directories[0])).to_dictionary())
+        self.assertTrue(manager.manager.verify())
+
+    def test_timeout(self):
+        manager = asyncio.run(AsyncManager.open(str(self.directories[0])))
+        os.environ['FAKE_ZFS_DELAY'] = '2'
+        self.async_executor.timeout = 0.2
+        with self.assertRaises(ZCMError) as context:
+            asyncio.run(manager.clone())
+        self.assertIn('timed out', context.exception.message)
+
+        self.async_executor.timeout = None
+
+        async def cancel():
+            await asyncio.wait_for(manager.load(), 0.2)
+
+        with self.assertRaises(asyncio.TimeoutError):
+            asyncio.run(cancel())
+        self.assertEqual(self.async_executor.stats.failures, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,215 @@
+# Copyright 2021, Guillermo Adrián Molina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import contextlib
+import io
+import json
+import subprocess
+import sys
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from zcm.api.manager import Manager
+from zcm.cli import CLI
+from zcm.lib.print import print_table
+
+from tests.helpers import FakeZFSTestCase
+
+
+class TestCLI(FakeZFSTestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = Path(self.root, 'directory')
+        Manager.initialize_manager('rpool/manager', str(self.directory))
+        Manager(str(self.directory)).clone()
+        Manager.initialize_manager('rpool/other', str(Path(self.root, 'other')))
+
+    def zcm(self, *arguments):
+        output = io.StringIO()
+        with mock.patch('sys.argv', ['zcm'] + list(arguments)), \
+                contextlib.redirect_stdout(output):
+            CLI()
+        return output.getvalue()
+
+    def test_list_json(self):
+        clones = [clone.to_dictionary()
+                  for manager in Manager.get_managers()
+                  for clone in manager.clones]
+        self.assertEqual(len(clones), 3)
+        self.assertEqual(self.zcm('list', '--json'),
+                         json.dumps(clones, indent=4) + '\n')
+        lines = self.zcm('list', '--json-lines').splitlines()
+        self.assertEqual([json.loads(line) for line in lines], clones)
+
+    def test_list_table(self):
+        lines = self.zcm('list', '-P', '0').splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[0].startswith('MANAGER'))
+        lines = self.zcm('list', '-H', str(self.directory)).splitlines()
+        self.assertEqual(len(lines), 2)
+
+    def test_info_many(self):
+        missing = str(Path(self.root, 'missing'))
+        output = io.StringIO()
+        with self.assertRaises(SystemExit), contextlib.redirect_stdout(output), \
+                mock.patch('sys.argv', ['zcm', 'info', '-t', str(self.directory),
+                                        missing, 'rpool/other']):
+            CLI()
+        lines = output.getvalue().splitlines()
+        self.assertEqual([line.split()[1] for line in lines[1:3]],
+                         ['rpool/manager', 'rpool/other'])
+        self.assertEqual(lines[3], 'There is no ZCM manager at ' + missing)
+
+    def test_clone_all(self):
+        self.assertEqual(self.zcm('clone', '--all').splitlines(),
+                         ['Created clone 00000002 at path %s' %
+                          Path(self.directory, '.clones', '00000002'),
+                          'Created clone 00000001 at path %s' %
+                          Path(self.root, 'other', '.clones', '00000001')])
+        clones = json.loads(self.zcm('clone', '-j', str(self.directory),
+                                     str(Path(self.root, 'other'))))
+        self.assertEqual([clone['id'] for clone in clones], ['00000003', '00000002'])
+        with self.assertRaises(SystemExit):
+            self.zcm('clone')
+
+    def test_table_alignment(self):
+        # without pagination the widths are computed over the whole table
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            print_table(({'n': str(i), 'x': 'x'} for i in range(1001)),
+                        page_size=0)
+        lines = output.getvalue().splitlines()
+        self.assertEqual(len(lines), 1002)
+        self.assertEqual(set(line.index('x') for line in lines[1:]), {6})
+
+    def test_diff(self):
+        Path(self.directory, 'added').write_text('added')
+        lines = self.zcm('diff', '-P', '0', str(self.directory)).splitlines()
+        self.assertIn(['added', 'file'], [line.split()[-2:] for line in lines])
+        self.assertEqual(self.zcm('diff', '-P', '0', '-w', '2',
+                                  str(self.directory)).splitlines(), lines)
+
+    def test_diff_summary(self):
+        Path(self.directory, 'added').write_text('added')
+        lines = self.zcm('diff', '--summary', str(self.directory)).splitlines()
+        self.assertEqual(lines[0], 'Total changes: 2')
+        self.assertIn('Added: 2', lines)
+        self.assertIn('File type file: 1', lines)
+        self.assertEqual(lines[-1].split(), ['.', '2'])
+
+    def test_remove_many(self):
+        for i in range(4):
+            self.zcm('clone', str(self.directory))
+        self.assertEqual(self.zcm('rm', '-n', str(self.directory), '00000001-00000003')
+                         .splitlines()[0], 'Remove 3 clones: 00000001 00000002 00000003')
+        with mock.patch('builtins.input', return_value='yes') as answer:
+            self.assertEqual(self.zcm('rm', str(self.directory), '0000000[2-4]',
+                                      '00000001').splitlines()[-4:],
+                             ['Removed clone 00000001', 'Removed clone 00000002',
+                              'Removed clone 00000003', 'Removed clone 00000004'])
+        answer.assert_called_once()
+        self.assertEqual([clone.id for clone in Manager(str(self.directory)).clones],
+                         ['00000000', '00000005'])
+        # the active clone is skipped by globs and ranges
+        with self.assertRaises(SystemExit):
+            self.zcm('rm', '-F', str(self.directory), '00000000')
+        self.assertEqual(self.zcm('rm', '-F', str(self.directory), '0*'),
+                         'Removed clone 00000005\n')
+        with self.assertRaises(SystemExit):
+            self.zcm('rm', '-F', str(self.directory), '0*')
+
+    def test_destroy(self):
+        with contextlib.redirect_stderr(io.StringIO()) as progress:
+            self.assertEqual(self.zcm('destroy', '-F', '-p', str(self.directory)),
+                             'Destroyed ZCM rpool/manager\n')
+        lines = progress.getvalue().splitlines()
+        self.assertEqual(lines[0], 'rpool/manager: unmount 1/3')
+        self.assertEqual(lines[-2], 'rpool/manager: destroy 3/3')
+        self.assertTrue(lines[-1].startswith('rpool/manager: unmount '))
+        self.assertFalse(self.directory.exists())
+
+    def test_prune(self):
+        for i in range(2):
+            self.zcm('clone', str(self.directory))
+        self.assertEqual(self.zcm('prune', '-n', '-t', '2', str(self.directory)),
+                         'Remove 2 clones: 00000001 00000002\n'
+                         'Destroy rpool/manager/00000001 rpool/manager/00000002\n'
+                         'Destroy rpool/manager/00000000@00000001 rpool/manager/00000000@00000002\n')
+        self.assertEqual(len(Manager(str(self.directory)).clones), 4)
+        self.assertEqual(self.zcm('prune', '-F', '-t', '2', str(self.directory)),
+                         'Removed clones 00000001 00000002\n')
+        self.assertEqual(self.zcm('prune', '-t', '2', str(self.directory)),
+                         'There are no clones to remove\n')
+        self.assertEqual([clone.id for clone in Manager(str(self.directory)).clones],
+                         ['00000000', '00000003'])
+        self.assertEqual(self.zcm('prune', '-n', '-k', '1', str(self.directory)),
+                         'There are no clones to remove\n')
+        Path(self.directory, '.clones', '00000003', 'data').write_bytes(b'0' * 4096)
+        self.assertEqual(self.zcm('prune', '-n', '--max-used', '1K', str(self.directory)),
+                         'Remove 1 clones: 00000003\n'
+                         'Destroy rpool/manager/00000003\n'
+                         'Destroy rpool/manager/00000000@00000003\n')
+
+    def test_send_receive(self):
+        stream = str(Path(self.root, 'stream'))
+        self.assertEqual(self.zcm('send', '-c', 'xz', '-o', stream,
+                                  str(self.directory)), '')
+        path = Path(self.root, 'received')
+        self.assertEqual(self.zcm('receive', '-i', stream, 'rpool/received',
+                                  str(path)),
+                         'ZCM received ZFS rpool/received at path %s with 2 clones\n' % path)
+        self.assertEqual(len(Manager(str(path)).clones), 2)
+        self.zcm('clone', str(self.directory))
+        self.assertEqual(self.zcm('sync', '-o', stream, str(self.directory)), '')
+        self.zcm('receive', '-i', stream, 'rpool/received', str(path))
+        self.assertEqual(len(Manager(str(path)).clones), 3)
+
+
+def imported_modules(*arguments):
+    # the modules python -X importtime reports for zcm arguments
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-m', 'zcm'] + list(arguments),
+                             cwd=str(Path(__file__).parents[1]), capture_output=True, text=True)
+    return set(line.split('|')[-1].strip() for line in process.stderr.splitlines()
+               if line.startswith('import time:'))
+
+
+class TestCommands(unittest.TestCase):
+    def test_registry(self):
+        # the metadata of every command matches its implementation
+        for command in CLI.commands:
+            implementation = command.load()
+            self.assertEqual([command.name, command.aliases],
+                             [implementation.name, implementation.aliases])
+            subparsers = argparse.ArgumentParser().add_subparsers()
+            implementation.init_parser(subparsers)
+            self.assertEqual(subparsers._choices_actions[0].help, command.help)
+
+    def test_lazy_import(self):
+        modules = imported_modules('--help')
+        self.assertIn('zcm.cli.main', modules)
+        self.assertEqual([module for module in modules
+                          if module.startswith(('zcm.api', 'zcm.lib', 'zcm.daemon')) or
+                          module.startswith('zcm.cli.') and module != 'zcm.cli.main'], [])
+        modules = imported_modules('-l', 'info', 'ls', '--help')
+        self.assertIn('zcm.cli.list', modules)
+        self.assertNotIn('zcm.cli.information', modules)
+        self.assertNotIn('zcm.cli.clone', modules)
+        self.assertNotIn('gzip', modules)
+        self.assertNotIn('concurrent.futures.process', modules)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+# Copyright 2021, Guillermo Adrián Molina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from datetime import datetime
+from pathlib import Path
+
+from zcm.api.clone import Clone
+
+
+class TestClone(unittest.TestCase):
+    def test_lazy_values(self):
+        clone = Clone('00000001', 'rpool/zcm/00000001', 'rpool/zcm/00000000@00000001',
+                      '00000000', '/zcm/.clones/00000001', '1614038211', '18432')
+        self.assertFalse(hasattr(clone, '__dict__'))
+        self.assertEqual(clone.to_dictionary(), {
+            'id': '00000001',
+            'zfs': 'rpool/zcm/00000001',
+            'origin': 'rpool/zcm/00000000@00000001',
+            'origin_id': '00000000',
+            'mountpoint': '/zcm/.clones/00000001',
+            'creation': str(datetime.fromtimestamp(1614038211)),
+            'size': 18432
+        })
+        self.assertEqual(clone.mountpoint, Path('/zcm/.clones/00000001'))
+        self.assertIs(clone.mountpoint, clone.mountpoint)
+        self.assertEqual(clone.creation, datetime.fromtimestamp(1614038211))
+        self.assertEqual(clone.size, 18432)
+        clone.mountpoint = Path('/zcm')
+        self.assertEqual(clone.to_dictionary()['mountpoint'], '/zcm')
+
+    def test_converted_values(self):
+        creation = datetime.now()
+        clone = Clone('00000000', 'rpool/zcm/00000000', None, None,
+                      Path('/zcm'), creation, 1024)
+        self.assertEqual(clone.mountpoint, Path('/zcm'))
+        self.assertIs(clone.creation, creation)
+        self.assertEqual(clone.size, 1024)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+# Copyright 2021, Guillermo Adrián Molina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import io
+import json
+import os
+import socket
+from pathlib import Path
+from unittest import mock
+
+from zcm import __version__, zcm_config
+from zcm.api.manager import Manager
+from zcm.cli import CLI
+from zcm.daemon import Client, connect
+from zcm.daemon.server import Daemon
+from zcm.exceptions import ZCMError
+
+from tests.helpers import FakeZFSTestCase
+
+
+class TestDaemon(FakeZFSTestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = Path(self.root, 'directory')
+        Manager.initialize_manager('rpool/manager', str(self.directory))
+        Manager(str(self.directory)).clone()
+        Manager.initialize_manager('rpool/other', str(Path(self.root, 'other')))
+        self.daemon = Daemon(refresh_interval=3600)
+        self.daemon.start()
+        self.client = Client()
+
+    def tearDown(self):
+        self.client.close()
+        self.daemon.stop()
+        return super().tearDown()
+
+    def zcm(self, *arguments):
+        output = io.StringIO()
+        with mock.patch('sys.argv', ['zcm'] + list(arguments)), \
+                contextlib.redirect_stdout(output):
+            CLI()
+        return output.getvalue()
+
+    def test_managers(self):
+        self.assertEqual(self.client.request('ping'), __version__)
+        managers = self.client.managers()
+        self.assertEqual([manager.zfs for manager in managers],
+                         ['rpool/manager', 'rpool/other'])
+        manager = self.client.managers([str(self.directory)])[0]
+        local = Manager(str(self.directory))
+        self.assertEqual(manager.to_dictionary(), local.to_dictionary())
+        self.assertEqual([clone.to_dictionary() for clone in manager.clones],
+                         [clone.to_dictionary() for clone in local.clones])
+
+    def test_clone_activate(self):
+        clone = self.client.request('clone', path=str(self.directory))
+        self.assertEqual(clone['id'], '00000002')
+        self.assertEqual(self.client.request('activate', path='rpool/manager',
+                                             id='00000002'), '00000002')
+        local = Manager(str(self.directory))
+        self.assertEqual(local.active_clone.id, '00000002')
+        self.assertEqual(self.client.managers(['rpool/manager'])[0].to_dictionary(),
+                         local.to_dictionary())
+        with self.assertRaises(ZCMError):
+            self.client.request('activate', path='rpool/manager', id='00000009')
+        with self.assertRaises(ZCMError):
+            self.client.request('managers', paths=[str(Path(self.root, 'none'))])
+        with self.assertRaises(ZCMError):
+            self.client.request('unknown')
+
+    def test_relative_path(self):
+        # zcmd does not run in the directory of the client
+        previous_directory = os.getcwd()
+        os.chdir(self.root)
+        try:
+            self.assertEqual(self.client.managers(['directory'])[0].zfs, 'rpool/manager')
+            self.assertEqual(self.zcm('info', 'directory'),
+                             self.zcm('-N', 'info', 'directory'))
+            self.assertEqual(self.client.request('clone', path='directory')['id'], '00000002')
+        finally:
+            os.chdir(previous_directory)
+
+    def test_changes_without_daemon(self):
+        Manager(str(self.directory)).activate('00000001')
+        Manager(str(self.directory)).clone()
+        self.assertEqual(self.client.request('activate', path='rpool/manager',
+                                             id='00000000'), '00000000')
+        self.assertEqual(self.client.request('clone', path='rpool/manager')['id'], '00000003')
+        local = Manager(str(self.directory))
+        self.assertEqual(local.active_clone.id, '00000000')
+        self.assertEqual(self.client.managers(['rpool/manager'])[0].to_dictionary(),
+                         local.to_dictionary())
+
+    def test_invalid_requests(self):
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(self.daemon.socket_path)
+        file = connection.makefile('rwb')
+        try:
+            for request in [b'[1]', b'"managers"', b'{"command": "managers", "paths": [1]}',
+                            b'not json']:
+                file.write(request + b'\n')
+                file.flush()
+                self.assertTrue(json.loads(file.readline())['fatal'])
+        finally:
+            file.close()
+            connection.close()
+        self.assertEqual(self.client.request('ping'), __version__)
+
+    def test_cli(self):
+        through_daemon = [self.zcm('ls', '-P', '0'),
+                          self.zcm('info', str(self.directory))]
+        self.assertEqual(through_daemon, [self.zcm('-N', 'ls', '-P', '0'),
+                                          self.zcm('-N', 'info', str(self.directory))])
+        self.assertEqual(self.zcm('clone', str(self.directory)),
+                         'Created clone 00000002 at path %s\n' %
+                         Path(self.directory, '.clones', '00000002'))
+        # zcmd reloads its managers after the commands it does not serve
+        self.zcm('rm', '-F', str(self.directory), '00000001')
+        self.assertEqual([clone.id for clone in self.client.managers(['rpool/manager'])[0].clones],
+                         ['00000000', '00000002'])
+
+    def test_connect(self):
+        client = connect()
+        self.assertIsInstance(client, Client)
+        client.close()
+        self.assertIsNone(connect(str(Path(self.root, 'none.sock'))))
+        self.assertEqual(zcm_config['daemon_socket'], self.daemon.socket_path)
@@ -0,0 +1,72 @@
+# Copyright 2021, Guillermo Adrián Molina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from zcm.lib.executor import Executor, get_executor, set_executor
+from zcm.lib.zfs import (ZFSError, zfs_create, zfs_get, zfs_list, zfs_many,
+                         zfs_unmount)
+
+from tests.helpers import FakeZFSTestCase
+
+
+class TestExecutor(FakeZFSTestCase):
+    def test_stats(self):
+        zfs_create('rpool/executor')
+        self.assertEqual(zfs_get('rpool/executor', 'type'), 'filesystem')
+        stats = self.executor.stats.to_dictionary()
+        self.assertEqual(stats['spawns'], 2)
+        self.assertEqual(stats['failures'], 0)
+        self.assertEqual(stats['commands'], {'create': 1, 'get': 1})
+        self.assertGreater(stats['total_time'], 0)
+        self.assertGreaterEqual(stats['max_time'], stats['average_time'])
+
+        with self.assertRaises(ZFSError):
+            zfs_get('rpool/does_not_exist', 'type')
+        self.assertEqual(self.executor.stats.failures, 1)
+
+        self.executor.stats.reset()
+        self.assertEqual(self.executor.stats.spawns, 0)
+        self.assertEqual(self.executor.stats.average_time, 0.0)
+
+    def test_many(self):
+        names = ['rpool/executor%d' % i for i in range(5)]
+        zfs_many([('create', [name]) for name in names])
+        self.assertEqual(self.executor.stats.spawns, 5)
+        self.assertEqual([zfs['name'] for zfs in zfs_list('rpool', recursive=True,
+                                                          properties=['name'])][1:], names)
+
+        zfs_unmount(names[0])
+        with self.assertRaises(ZFSError) as context:
+            zfs_many([('unmount', [name]) for name in names])
+        self.assertIn('not currently mounted', context.exception.message)
+        mounted = [zfs_get(name, 'mounted') for name in names]
+        self.assertEqual(mounted, ['no'] * 5)
+
+    def test_set_executor(self):
+        executor = Executor(max_workers=2)
+        previous = set_executor(executor)
+        try:
+            self.assertIs(previous, self.executor)
+            self.assertIs(get_executor(), executor)
+            zfs_list('rpool')
+            self.assertEqual(executor.stats.spawns, 1)
+            self.assertEqual(self.executor.stats.spawns, 0)
+        finally:
+            set_executor(previous)
+            executor.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,474 @@
+# Copyright 2021, Guillermo Adrián Molina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import os
+import subprocess
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from zcm.api.manager import Manager
+from zcm.exceptions import ZCMError, ZCMException
+from zcm.lib.executor import Executor, set_executor
+from zcm.lib.stream import StreamReader
+from zcm.lib.zfs import (mount_waves, zfs_exists, zfs_get, zfs_list,
+                         zfs_unmount)
+
+from tests.helpers import FakeZFSTestCase
+
+zfs = 'rpool/manager'
+
+
+class FailingExecutor(Executor):
+    # fails once the zfs command given as [command, arguments...]
+    def __init__(self, failing_command):
+        super().__init__()
+        self.failing_command = failing_command
+
+    def run(self, cmd):
+        if cmd[1:] == self.failing_command:
+            self.failing_command = None
+            return subprocess.CompletedProcess(cmd, 1, '', 'failed\n')
+        return super().run(cmd)
+
+
+class TestManager(FakeZFSTestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = Path(self.root, 'directory')
+        Manager.initialize_manager(zfs, str(self.directory))
+
+    def test_incremental_state(self):
+        manager = Manager(str(self.directory))
+        manager.clone()
+        manager.clone()
+        manager.activate('00000002')
+        manager.clone()
+        self.assertEqual(manager.clones[1].mountpoint,
+                         Path(self.directory, '.clones', '00000001'))
+        self.assertEqual(manager.active_clone.mountpoint, self.directory)
+
+        self.executor.stats.reset()
+        manager.remove('00000000')
+        manager.remove('00000003')
+        self.assertNotIn('list', self.executor.stats.commands)
+        self.assertEqual([clone.id for clone in manager.clones],
+                         ['00000001', '00000002'])
+        self.assertEqual([clone.id for clone in manager.older_clones],
+                         ['00000001'])
+        self.assertEqual(manager.newer_clones, [])
+        self.assertEqual(manager.next_id, '00000003')
+        self.assertTrue(manager.verify())
+
+    def test_remove_with_origin_and_children(self):
+        manager = Manager(str(self.directory), verify=True)
+        manager.clone()
+        manager.activate('00000001')
+        manager.clone()
+        manager.activate('00000002')
+        manager.remove('00000001')
+        self.assertEqual(manager.get_clone('00000002').origin,
+                         zfs + '/00000000@00000001')
+        self.assertEqual(manager.get_clone('00000002').origin_id, '00000000')
+        self.assertTrue(manager.verify())
+
+    def test_retention(self):
+        # a chain of clones, every one activated after it is created, with
+        # a branch from 00000002
+        manager = Manager(str(self.directory))
+        for i in range(8):
+            manager.clone()
+            manager.activate(manager.clones[-1].id)
+            Path(self.directory, 'file').write_text(manager.active_clone.id)
+            if i == 1:
+                manager.clone()
+        self.assertEqual(manager.get_clone('00000003').origin_id, '00000002')
+        plan = manager.plan_retention(max_older=2)
+        self.assertEqual(plan.ids, ['00000000', '00000001', '00000002', '00000003',
+                                    '00000004', '00000005', '00000006'])
+        # one promote for every removed clone with a kept clone below it,
+        # the branch 00000003 needs none and everything goes in one wave
+        self.assertEqual(plan.promotes, [zfs + '/' + id for id in [
+            '00000001', '00000002', '00000004', '00000005', '00000006', '00000007']])
+        self.assertEqual(len(plan.waves), 1)
+        self.executor.stats.reset()
+        manager.auto_remove(max_older=2)
+        self.assertEqual(self.executor.stats.commands['promote'], 6)
+        self.assertNotIn('list', self.executor.stats.commands)
+        self.assertEqual([clone.id for clone in manager.clones],
+                         ['00000007', '00000008', '00000009'])
+        self.assertEqual(manager.get_clone('00000007').origin, None)
+        self.assertTrue(manager.verify())
+        self.assertEqual(Path(self.directory, '.clones', '00000008', 'file').read_text(),
+                         '00000008')
+        with self.assertRaises(ZCMError):
+            manager.plan_removal(['00000009'])
+        with self.assertRaises(ZCMError):
+            manager.plan_retention(max_total=0)
+
+    def test_verify(self):
+        manager = Manager(str(self.directory))
+        other = Manager(str(self.directory))
+        other.clone()
+        self.assertFalse(manager.verify())
+        self.assertEqual(len(manager.clones), 2)
+        self.assertTrue(manager.verify())
+
+    def test_get_managers(self):
+        other_directory = Path(self.root, 'other')
+        Manager.initialize_manager('rpool/other/manager', str(other_directory))
+        Manager(str(other_directory)).clone()
+        self.executor.stats.reset()
+        managers = Manager.get_managers()
+        self.assertEqual(self.executor.stats.spawns, 1)
+        self.assertEqual([manager.zfs for manager in managers],
+                         [zfs, 'rpool/other/manager'])
+        for manager in managers:
+            expected = Manager(manager.zfs)
+            self.assertEqual(manager.to_dictionary(), expected.to_dictionary())
+            self.assertEqual([clone.to_dictionary() for clone in manager.clones],
+                             [clone.to_dictionary() for clone in expected.clones])
+
+    def test_iter_managers(self):
+        other_directory = Path(self.root, 'other')
+        Manager.initialize_manager('rpool/other', str(other_directory))
+        self.executor.stats.reset()
+        managers = Manager.iter_managers()
+        manager = next(managers)
+        self.assertEqual(manager.zfs, zfs)
+        self.assertEqual(self.executor.stats.spawns, 1)
+        self.assertEqual([manager.zfs for manager in managers],
+                         ['rpool/other'])
+
+    def test_load_many(self):
+        other_directory = Path(self.root, 'other')
+        Manager.initialize_manager('rpool/other', str(other_directory))
+        paths = [str(other_directory), str(Path(self.root, 'missing')), zfs,
+                 str(self.directory)]
+        managers = Manager.load_many(paths, max_workers=2)
+        self.assertEqual([manager.zfs for manager in managers[:1] + managers[2:]],
+                         ['rpool/other', zfs, zfs])
+        self.assertIsInstance(managers[1], ZCMError)
+        self.assertEqual(Manager.load_many([]), [])
+
+    def test_clone_many(self):
+        paths = [str(self.directory)]
+        for name in ['other', 'third']:
+            paths.append(str(Path(self.root, name)))
+            Manager.initialize_manager('rpool/' + name, paths[-1])
+        managers = Manager.load_many(paths)
+        managers[1].clone()
+        self.executor.stats.reset()
+        clones = Manager.clone_many(managers)
+        self.assertEqual(self.executor.stats.commands,
+                         {'snapshot': 1, 'clone': 3, 'list': 1})
+        self.assertEqual([clone.zfs for clone in clones],
+                         [zfs + '/00000001', 'rpool/other/00000002', 'rpool/third/00000001'])
+        for manager, path in zip(managers, paths):
+            expected = Manager(path)
+            self.assertEqual(manager.to_dictionary(), expected.to_dictionary())
+        with self.assertRaises(ZCMException):
+            Manager.clone_many(managers, max_total=2)
+        with self.assertRaises(ZCMError):
+            Manager.clone_many([managers[0], managers[0]])
+        clones = Manager.clone_many(managers, max_total=2, auto_remove=True)
+        self.assertEqual([len(manager.clones) for manager in managers], [2, 2, 2])
+
+    def test_clone_many_failure(self):
+        # a failed snapshot on the second pool destroys those of the first
+        pools = Path(self.root, 'pools')
+        with mock.patch.dict(os.environ, {'FAKE_ZFS_ROOT': str(pools),
+                                          'FAKE_ZFS_POOLS': 'rpool,tank'}):
+            paths = [str(Path(self.root, name)) for name in ['first', 'second']]
+            Manager.initialize_manager('rpool/first', paths[0])
+            Manager.initialize_manager('tank/second', paths[1])
+            managers = Manager.load_many(paths)
+            set_executor(FailingExecutor(['snapshot', 'tank/second/00000000@00000001']))
+            with self.assertRaises(ZCMError):
+                Manager.clone_many(managers)
+            set_executor(self.executor)
+            for manager, path in zip(managers, paths):
+                self.assertEqual(zfs_list(manager.zfs, zfs_type='snapshot', recursive=True), [])
+                self.assertEqual(len(manager.clones), 1)
+                self.assertEqual(manager.to_dictionary(), Manager(path).to_dictionary())
+            clones = Manager.clone_many(managers)
+            self.assertEqual([clone.zfs for clone in clones],
+                             ['rpool/first/00000001', 'tank/second/00000001'])
+
+    def test_parallel_activate(self):
+        manager = Manager(str(self.directory))
+        for i in range(5):
+            manager.clone()
+        self.executor.stats.reset()
+        manager.activate('00000003')
+        self.assertEqual(self.executor.stats.commands['unmount'], 7)
+        self.assertEqual(self.executor.stats.commands['mount'], 7)
+        for clone in manager.clones:
+            self.assertEqual(zfs_get(clone.zfs, 'mounted'), 'yes')
+            self.assertEqual(zfs_get(clone.zfs, 'mountpoint'), clone.mountpoint)
+        self.assertEqual(zfs_get(manager.active_clone.zfs, 'mountpoint'),
+                         self.directory)
+
+    def test_unmount_rollback(self):
+        manager = Manager(str(self.directory))
+        for i in range(3):
+            manager.clone()
+        zfs_unmount(manager.clones[2].zfs)
+        with self.assertRaises(ZCMError):
+            manager.activate('00000001')
+        self.assertEqual(manager.active_clone.id, '00000000')
+        mounted = [zfs_get(clone.zfs, 'mounted') for clone in manager.clones]
+        self.assertEqual(mounted, ['yes', 'yes', 'no', 'yes'])
+        self.assertEqual(zfs_get(zfs, 'mounted'), 'yes')
+
+    def test_activation_timing(self):
+        manager = Manager(str(self.directory))
+        manager.clone()
+        manager.clone()
+        self.assertIsNone(manager.activation_timing)
+        manager.activate('00000001')
+        timing = manager.activation_timing
+        self.assertEqual(list(timing), ['unmount', 'downtime', 'mount'])
+        self.assertTrue(all(value > 0 for value in timing.values()))
+
+    def test_activation_failure(self):
+        # every step of activate() that fails leaves the manager as it was
+        manager = Manager(str(self.directory))
+        manager.clone()
+        manager.clone()
+        for command in [['unmount', zfs + '/00000000'],
+                        ['mount', zfs + '/00000001'],
+                        ['inherit', 'mountpoint', zfs + '/00000000'],
+                        ['mount', zfs + '/00000002']]:
+            with self.subTest(command=command):
+                set_executor(FailingExecutor(command))
+                with self.assertRaises(ZCMError):
+                    manager.activate('00000001')
+                set_executor(self.executor)
+                self.assertEqual(manager.active_clone.id, '00000000')
+                self.assertEqual(zfs_get(zfs, 'mounted'), 'yes')
+                for clone in manager.clones:
+                    self.assertEqual(zfs_get(clone.zfs, 'mounted'), 'yes')
+                self.assertEqual(zfs_get(zfs + '/00000000', 'mountpoint'), self.directory)
+                self.assertEqual(zfs_get(zfs + '/00000001', 'mountpoint'),
+                                 Path(self.directory, '.clones', '00000001'))
+                self.assertTrue(manager.verify())
+        manager.activate('00000001')
+        self.assertTrue(manager.verify())
+
+    def test_indexes(self):
+        manager = Manager(str(self.directory))
+        for i in range(4):
+            manager.clone()
+        manager.activate('00000002')
+        manager.clone()
+        self.assertIndexed(manager)
+        self.assertEqual(manager.count_older_newer(manager.get_clone('00000001')),
+                         (1, 4))
+        self.assertEqual(manager.active_position, 2)
+        manager.remove('00000000')
+        self.assertIndexed(manager)
+        self.assertEqual(manager.active_position, 1)
+        self.assertEqual([clone.id for clone in manager.find_clones_with_origin('00000002')],
+                         ['00000005'])
+        self.assertEqual(manager.find_clones_with_origin('00000005'), [])
+        with self.assertRaises(ZCMError):
+            manager.get_clone('00000000')
+
+    def assertIndexed(self, manager):
+        for position, clone in enumerate(manager.clones):
+            self.assertIs(manager.get_clone(clone.id), clone)
+            self.assertEqual(manager.clone_positions[clone.id], position)
+            self.assertEqual(manager.find_clones_with_origin(clone.id),
+                             [other for other in manager.clones
+                              if other.origin_id == clone.id])
+        self.assertEqual(len(manager.clone_index), len(manager.clones))
+
+    def test_destroy_resume(self):
+        manager = Manager(str(self.directory))
+        for i in range(4):
+            manager.clone()
+        manager.activate('00000002')
+        set_executor(FailingExecutor(['destroy', '-r', '-s', zfs + '/00000003']))
+        reports = []
+        with self.assertRaises(ZCMError):
+            manager.destroy(lambda *report: reports.append(report))
+        set_executor(self.executor)
+        self.assertEqual(reports[:3], [('unmount', 4, 6), ('unmount', 5, 6), ('unmount', 6, 6)])
+        self.assertEqual(reports[-1][0], 'destroy')
+        # nothing was remounted, destroying again resumes
+        manager = Manager(str(self.directory))
+        self.assertEqual(zfs_get(zfs, 'mounted'), 'no')
+        reports = []
+        manager.destroy(lambda *report: reports.append(report))
+        self.assertNotIn('unmount', [report[0] for report in reports])
+        self.assertEqual(reports[-1], ('destroy', 3, 3))
+        self.assertEqual(list(manager.destroy_timing), ['unmount', 'destroy', 'path'])
+        self.assertFalse(zfs_exists(zfs))
+        self.assertFalse(self.directory.exists())
+
+    def test_mount_waves(self):
+        self.assertEqual(mount_waves({
+            'c': '/a/b/c',
+            'a': '/a',
+            'd': '/a/b/d',
+            'b': '/a/b',
+            'e': '/e'
+        }), [['a', 'e'], ['b'], ['c', 'd']])
+
+    def test_diff(self):
+        manager = Manager(str(self.directory))
+        first = manager.clone()
+        Path(self.directory, 'added').write_text('added')
+        second = manager.clone()
+        self.assertEqual(list(manager.diff(second.id)), [])
+        self.assertEqual(list(manager.diff(second.id,
+                                           origin=manager.active_clone.id)), [])
+        changes = [(record['change'], record['file'])
+                   for record in manager.diff(second.id, origin=first.origin)]
+        self.assertEqual(changes, [('Added', Path('added'))])
+        summary = manager.diff_summary(second.origin, origin=first.origin, cache=False)
+        self.assertEqual(summary['total'], 1)
+        self.assertEqual(summary['directories'], [('.', 1)])
+        for cache in [True, True, False]:
+            changes = [(record['change'], record['file'], record['mountpoint'])
+                       for record in manager.diff(second.origin, origin=first.origin,
+                                                  cache=cache)]
+            self.assertEqual(changes, [('Added', Path('added'), self.directory)])
+        with self.assertRaises(ZCMError):
+            list(manager.diff(second.id, origin=second.id))
+        with self.assertRaises(ZCMError):
+            list(manager.diff(second.origin))
+        with self.assertRaises(ZCMError):
+            list(manager.diff(second.id, origin='rpool/other@snapshot'))
+
+    def test_send_receive(self):
+        manager = Manager(str(self.directory))
+        Path(self.directory, 'first').write_text('first')
+        manager.clone()
+        Path(self.directory, 'second').write_text('second')
+        manager.clone()
+        manager.activate('00000002')
+        Path(self.directory, 'third').write_text('third')
+        manager.clone()
+        manager.remove('00000000')
+        for compression in [None, 'gzip']:
+            stream = io.BytesIO()
+            manager.send(stream, compression)
+            stream.seek(0)
+            zfs_name = 'rpool/backup/%s' % compression
+            path = Path(self.root, 'received-%s' % compression)
+            received = Manager.receive(zfs_name, str(path),
+                                       io.BufferedReader(stream))
+            self.assertEqual([(clone.id, clone.origin_id) for clone in received.clones],
+                             [(clone.id, clone.origin_id) for clone in manager.clones])
+            self.assertEqual(received.active_clone.id, '00000002')
+            self.assertEqual(sorted(entry.name for entry in path.iterdir()),
+                             ['.clones', 'first', 'second', 'third'])
+            self.assertEqual(Path(path, '.clones', '00000001', 'first').read_text(),
+                             'first')
+        snapshots = [zfs['name'] for zfs in zfs_list(
+            'rpool', zfs_type='snapshot', properties=['name'], recursive=True)]
+        # the snapshots sent of every dataset are kept for send(incremental=True)
+        self.assertEqual(sorted(set(name.split('@')[0] for name in snapshots
+                                    if 'zcm_send_' in name and name.startswith(zfs))),
+                         [zfs, zfs + '/00000001', zfs + '/00000002', zfs + '/00000003'])
+        self.assertEqual(len(manager.send_snapshot_names()), 2)
+        with self.assertRaises(ZCMError):
+            Manager.receive('rpool/backup/again', str(path),
+                            io.BufferedReader(io.BytesIO(b'')))
+
+    def test_sync(self):
+        manager = Manager(str(self.directory))
+        Path(self.directory, 'first').write_bytes(b'first' * 1000)
+        manager.clone()
+        manager.clone()
+        manager.activate('00000001')
+        path = Path(self.root, 'received')
+        stream = io.BytesIO()
+        manager.send(stream)
+        stream.seek(0)
+        Manager.receive('rpool/backup', str(path), io.BufferedReader(stream))
+
+        Path(self.directory, 'second').write_text('second')
+        manager.clone()
+        manager.activate('00000003')
+        manager.remove('00000001')
+        stream = io.BytesIO()
+        manager.send(stream, incremental=True)
+        stream.seek(0)
+        reader = StreamReader(io.BufferedReader(io.BytesIO(stream.getvalue())))
+        datasets = {header['name']: header['from']
+                    for header in iter(reader.read_header, None)
+                    if header['type'] == 'dataset'}
+        self.assertEqual(sorted(datasets), ['', '/00000000', '/00000002', '/00000003'])
+        # only the new clone is sent whole, from its origin
+        self.assertEqual(datasets['/00000003'], '/00000000@00000001')
+        self.assertTrue(all(datasets[name].startswith(name + '@zcm_send_')
+                            for name in ['', '/00000000', '/00000002']))
+        received = Manager.receive('rpool/backup', str(path),
+                                   io.BufferedReader(stream))
+        self.assertEqual([(clone.id, clone.origin_id) for clone in received.clones],
+                         [(clone.id, clone.origin_id) for clone in manager.clones])
+        self.assertEqual(received.active_clone.id, '00000003')
+        self.assertEqual(Path(path, 'second').read_text(), 'second')
+        self.assertTrue(received.verify())
+
+        # nothing changed, only the new snapshots are sent
+        stream = io.BytesIO()
+        manager.send(stream, incremental=True)
+        stream.seek(0)
+        received = Manager.receive('rpool/backup', str(path), io.BufferedReader(stream))
+        # the sender keeps the last streams, the receiver only the last one
+        self.assertEqual(len(manager.send_snapshot_names()), 3)
+        self.assertEqual(received.send_snapshot_names(), manager.send_snapshot_names()[-1:])
+        with self.assertRaises(ZCMError):
+            Manager.receive('rpool/backup', str(Path(self.root, 'other')),
+                            io.BufferedReader(io.BytesIO(b'')))
+
+    def test_sync_lost_stream(self):
+        manager = Manager(str(self.directory))
+        manager.clone()
+        path = Path(self.root, 'received')
+
+        def send(**options):
+            stream = io.BytesIO()
+            manager.send(stream, **options)
+            stream.seek(0)
+            return io.BufferedReader(stream)
+
+        Manager.receive('rpool/backup', str(path), send())
+        since = Manager('rpool/backup').received_snapshot()
+        Path(self.directory, 'lost').write_text('lost')
+        send(incremental=True)
+        Path(self.directory, 'next').write_text('next')
+        with self.assertRaises(ZCMError) as context:
+            Manager.receive('rpool/backup', str(path), send(incremental=True))
+        self.assertIn('zcm sync --since ' + since, context.exception.message)
+        # nothing was changed by the stream that could not be applied
+        received = Manager('rpool/backup')
+        self.assertTrue(received.verify())
+        self.assertFalse(Path(path, 'lost').exists())
+        received = Manager.receive('rpool/backup', str(path), send(since=since))
+        self.assertEqual(Path(path, 'next').read_text(), 'next')
+        self.assertEqual(received.received_snapshot(), manager.send_snapshot_names()[-1])
+        received = Manager.receive('rpool/backup', str(path), send(incremental=True))
+        self.assertTrue(received.verify())
+        with self.assertRaises(ZCMError):
+            send(since='zcm_send_missing')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+# Copyright 2021, Guillermo Adrián Molina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from datetime import datetime, timedelta
+
+from zcm.api.clone import Clone
+from zcm.api.retention import RetentionPolicy, plan_removal
+
+NOW = datetime(2021, 3, 10, 12, 0)
+
+
+def make_clones(hours, size=100):
+    # a clone every hours[i] hours before NOW, the oldest first
+    clones = []
+    for position, hours_ago in enumerate(hours):
+        id = format(position, '08x')
+        origin = None if position == 0 else 'rpool/zcm/00000000@' + id
+        clones.append(Clone(id, 'rpool/zcm/' + id, origin,
+                            None if origin is None else '00000000', '-',
+                            NOW - timedelta(hours=hours_ago), size))
+    return clones
+
+
+class TestRetention(unittest.TestCase):
+    def test_keep_rules(self):
+        clones = make_clones([24 * 15, 24 * 8, 24 * 7 + 1, 49, 48, 25, 3, 2.5, 1])
+        active = clones[0]
+
+        def removed(**rules):
+            return RetentionPolicy(**rules).select(clones, active, NOW)
+
+        self.assertEqual(removed(), [])
+        self.assertEqual(removed(keep_last=2),
+                         [clone.id for clone in clones[1:-2]])
+        self.assertEqual(removed(keep_within=timedelta(hours=24)),
+                         [clone.id for clone in clones[1:6]])
+        # the last hours with clones, 3 hours ago is in the same hour as 2.5
+        self.assertEqual(removed(keep_hourly=3),
+                         ['00000001', '00000002', '00000003', '00000004', '00000006'])
+        self.assertEqual(removed(keep_daily=3),
+                         ['00000001', '00000002', '00000003', '00000006', '00000007'])
+        self.assertEqual(removed(keep_weekly=3),
+                         ['00000001', '00000003', '00000004', '00000005', '00000006',
+                          '00000007'])
+        self.assertEqual(removed(keep_weekly=1, keep_last=2),
+                         [clone.id for clone in clones[1:-2]])
+
+    def test_max_used(self):
+        clones = make_clones([5, 4, 3, 2, 1])
+        clones[3].size = 1000
+        self.assertEqual(RetentionPolicy(max_used=1200).select(clones, clones[4], NOW),
+                         ['00000000', '00000001'])
+        # the active clone is never removed, even over the budget
+        self.assertEqual(RetentionPolicy(max_used=50).select(clones, clones[1], NOW),
+                         ['00000000', '00000002', '00000003', '00000004'])
+        self.assertEqual(RetentionPolicy(keep_last=1, max_used=1000).select(
+            clones, None, NOW), ['00000000', '00000001', '00000002', '00000003'])
+
+    def test_plan_removal(self):
+        # 00000001 <- 00000002 <- 00000003, 00000004 from 00000000
+        clones = make_clones([4, 3, 2, 1, 0])
+        clones[2].origin = 'rpool/zcm/00000001@00000002'
+        clones[3].origin = 'rpool/zcm/00000002@00000003'
+        plan = plan_removal(clones, {'00000001', '00000002'})
+        self.assertEqual(plan.promotes, ['rpool/zcm/00000002', 'rpool/zcm/00000003'])
+        self.assertEqual(plan.waves, [['rpool/zcm/00000001', 'rpool/zcm/00000002']])
+        self.assertEqual(plan.snapshots, ['rpool/zcm/00000003@00000002',
+                                          'rpool/zcm/00000003@00000003'])
+        self.assertEqual(plan.origins, {'rpool/zcm/00000003': 'rpool/zcm/00000000@00000001'})
+        # removed with its clones, no promote
+        plan = plan_removal(clones, {'00000001', '00000002', '00000003'})
+        self.assertEqual(plan.promotes, [])
+        self.assertEqual(plan.waves, [['rpool/zcm/00000003'], ['rpool/zcm/00000002'],
+                                      ['rpool/zcm/00000001']])
+        self.assertEqual(plan.snapshots, ['rpool/zcm/00000000@00000001'])
+
+
+if __name__ == '__main__':
+    unittest.main()
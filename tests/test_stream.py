@@ -0,0 +1,72 @@
+# Copyright 2021, Guillermo Adrián Molina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import unittest
+
+from zcm.lib.stream import (COMPRESSIONS, Progress, StreamError, StreamReader,
+                            StreamWriter, copy_stream)
+
+
+class TestStream(unittest.TestCase):
+    def write_stream(self, compression=None, progress=None):
+        output = io.BytesIO()
+        writer = StreamWriter(output, compression, progress)
+        writer.begin({'type': 'manager'})
+        writer.end()
+        writer.begin({'name': '/a'})
+        copy_stream(io.BytesIO(b'a' * 1000), writer, buffer_size=300)
+        writer.end()
+        writer.begin({'name': '/b'})
+        writer.end()
+        writer.close()
+        return output.getvalue()
+
+    def test_round_trip(self):
+        for compression in [None] + list(COMPRESSIONS):
+            progress = Progress()
+            reader = StreamReader(io.BufferedReader(io.BytesIO(
+                self.write_stream(compression))), progress)
+            self.assertEqual(reader.read_header(), {'type': 'manager'})
+            self.assertEqual(reader.read_header(), {'name': '/a'})
+            self.assertEqual(reader.read(10), b'a' * 10)
+            self.assertEqual(reader.read(), b'a' * 290)
+            self.assertEqual(reader.read_header(), {'name': '/b'})
+            self.assertEqual(reader.read(), b'')
+            self.assertIsNone(reader.read_header())
+            self.assertEqual([(name, size) for name, size, elapsed in progress.datasets],
+                             [('/a', 1000), ('/b', 0)])
+
+    def test_progress(self):
+        reports = []
+        progress = Progress(lambda progress: reports.append(
+            (progress.name, progress.bytes, progress.finished)), interval=0)
+        self.write_stream(progress=progress)
+        self.assertEqual(reports[-2:], [('/a', 1000, True), ('/b', 0, True)])
+        self.assertEqual(len(reports), 6)
+        self.assertEqual(progress.total, 1000)
+
+    def test_errors(self):
+        with self.assertRaises(StreamError):
+            StreamReader(io.BufferedReader(io.BytesIO(b'not a stream')))
+        reader = StreamReader(io.BufferedReader(io.BytesIO(self.write_stream()[:-20])))
+        with self.assertRaises(StreamError):
+            while reader.read_header() is not None:
+                pass
+        with self.assertRaises(StreamError):
+            StreamWriter(io.BytesIO(), 'zip')
+
+
+if __name__ == '__main__':
+    unittest.main()
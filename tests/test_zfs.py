@@ -0,0 +1,270 @@
+# Copyright 2021, Guillermo Adrián Molina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import time
+import unittest
+from datetime import datetime
+from pathlib import Path
+
+from zcm import zcm_config
+from zcm.lib.zfs import (ZFSError, zfs_cache, zfs_create, zfs_diff,
+                         zfs_diff_parse, zfs_diff_summary, zfs_exists, zfs_get,
+                         zfs_get_many, zfs_is_filesystem, zfs_is_snapshot,
+                         zfs_list, zfs_list_iter, zfs_list_parse, zfs_set,
+                         zfs_snapshot, zfs_unmount)
+
+from tests.helpers import FakeZFSTestCase
+
+
+class TestZFS(FakeZFSTestCase):
+    def test_get_many(self):
+        zfs_create('rpool/a', zcm_path='/some/path')
+        zfs_create('rpool/b')
+        self.executor.stats.reset()
+        values = zfs_get_many(['rpool/a', 'rpool/b'],
+                              ['type', 'mountpoint', 'mounted', 'creation',
+                               'zfs_clone_manager:path'])
+        self.assertEqual(self.executor.stats.spawns, 1)
+        self.assertEqual(list(values), ['rpool/a', 'rpool/b'])
+        self.assertEqual(values['rpool/a']['type'], 'filesystem')
+        self.assertEqual(values['rpool/a']['mountpoint'],
+                         Path(self.pool_path, 'a'))
+        self.assertIsInstance(values['rpool/b']['creation'], datetime)
+        self.assertEqual(values['rpool/a']['zfs_clone_manager:path'],
+                         Path('/some/path'))
+        self.assertIsNone(values['rpool/b']['zfs_clone_manager:path'])
+
+        with self.assertRaises(ZFSError):
+            zfs_get_many(['rpool/a', 'rpool/missing'], ['type'])
+        values = zfs_get_many(['rpool/a', 'rpool/missing'], ['type'],
+                              ignore_missing=True)
+        self.assertEqual(values, {'rpool/a': {'type': 'filesystem'}})
+        with self.assertRaises(ZFSError):
+            zfs_get_many(['rpool/a'], ['not_a_property'], ignore_missing=True)
+
+    def test_cache(self):
+        zfs_create('rpool/a')
+        zcm_config['zfs_cache_ttl'] = 60
+        zfs_cache.clear()
+        hits, misses = zfs_cache.hits, zfs_cache.misses
+        self.executor.stats.reset()
+        for i in range(3):
+            self.assertEqual(zfs_get('rpool/a', 'mounted'), 'yes')
+            self.assertEqual(len(zfs_list('rpool', recursive=True)), 2)
+        self.assertFalse(zfs_exists('rpool/b'))
+        self.assertEqual(self.executor.stats.commands['get'], 1)
+        self.assertEqual(self.executor.stats.commands['list'], 2)
+        self.assertFalse(zfs_exists('rpool/b'))
+        self.assertEqual((zfs_cache.hits - hits, zfs_cache.misses - misses), (5, 3))
+        # mutating commands clear it
+        zfs_create('rpool/b')
+        zfs_unmount('rpool/a')
+        self.assertTrue(zfs_exists('rpool/b'))
+        self.assertEqual(zfs_get('rpool/a', 'mounted'), 'no')
+        self.assertEqual(len(zfs_list('rpool', recursive=True)), 3)
+        # least recently used first out, then by age
+        zcm_config['zfs_cache_size'] = 2
+        zfs_exists('rpool/a')
+        self.assertEqual(len(zfs_cache.entries), 2)
+        self.assertNotIn(('get',), [key[:1] for key in zfs_cache.entries])
+        zcm_config['zfs_cache_ttl'] = 0.01
+        time.sleep(0.02)
+        self.executor.stats.reset()
+        zfs_exists('rpool/a')
+        self.assertEqual(self.executor.stats.commands['list'], 1)
+        zcm_config['zfs_cache_ttl'] = 0
+        zfs_exists('rpool/a')
+        self.assertEqual(self.executor.stats.commands['list'], 2)
+
+    def test_list_iter(self):
+        zfs_create('rpool/a')
+        zfs_create('rpool/b')
+        self.assertEqual(list(zfs_list_iter('rpool', recursive=True)),
+                         zfs_list('rpool', recursive=True))
+        self.assertEqual(list(zfs_list_iter('rpool/a', properties=['name'],
+                                            raw=True)),
+                         [{'name': 'rpool/a'}])
+        datasets = zfs_list_iter('rpool', recursive=True)
+        self.assertEqual(next(datasets)['name'], 'rpool')
+        datasets.close()
+        with self.assertRaises(ZFSError):
+            list(zfs_list_iter('rpool/missing'))
+
+    def test_list_errors(self):
+        zfs_create('rpool/a')
+        self.assertEqual(zfs_list('rpool/missing'), [])
+        with self.assertRaises(ZFSError):
+            zfs_list('rpool/a', properties=['name', 'not_a_property'])
+        with self.assertRaises(ZFSError):
+            list(zfs_list_iter('rpool/a', properties=['not_a_property']))
+
+    def test_list_parse(self):
+        properties = ['name', 'used', 'mountpoint', 'creation', 'readonly']
+        lines = ['rpool/a\t512\t/a\t1614556800\toff\n', '\n',
+                 'rpool/b\t-\t-\t-\ton\n']
+        a, b = zfs_list_parse(lines, properties)
+        self.assertEqual(a['used'], 512)
+        self.assertEqual(a['mountpoint'], Path('/a'))
+        self.assertEqual(a['creation'], datetime.fromtimestamp(1614556800))
+        self.assertFalse(a['readonly'])
+        self.assertEqual(b, {'name': 'rpool/b', 'used': None,
+                             'mountpoint': None, 'creation': None,
+                             'readonly': True})
+        self.assertEqual(next(zfs_list_parse(lines, properties, raw=True))['used'],
+                         '512')
+
+    def test_diff(self):
+        zfs_create('rpool/a')
+        mountpoint = Path(self.pool_path, 'a')
+        Path(mountpoint, 'kept').write_text('kept')
+        Path(mountpoint, 'changed').write_text('before')
+        snapshot = zfs_snapshot('snap', 'rpool/a')
+        Path(mountpoint, 'changed').write_text('after')
+        Path(mountpoint, 'directory').mkdir()
+        Path(mountpoint, 'directory', 'added').write_text('added')
+
+        records = list(zfs_diff('rpool/a', snapshot, include_file_types=True))
+        self.assertEqual([(record['change'], record['file_type'], record['file'])
+                          for record in records],
+                         [('Modified', 'file', Path('changed')),
+                          ('Added', 'directory', Path('directory')),
+                          ('Added', 'file', Path('directory/added'))])
+        self.assertEqual(records[0]['mountpoint'], mountpoint)
+        self.assertIsInstance(records[0]['date'], datetime)
+
+        compact = list(zfs_diff('rpool/a', snapshot, include_file_types=True,
+                                compact=True, chunk_size=1))
+        self.assertEqual([record[1:] for record in compact],
+                         [('Modified', 'file', 'changed'),
+                          ('Added', 'directory', 'directory'),
+                          ('Added', 'file', 'directory/added')])
+        self.assertEqual(list(zfs_diff('rpool/a', snapshot, include_file_types=True,
+                                       compact=True, workers=2, chunk_size=1)),
+                         compact)
+
+    def test_diff_cache(self):
+        zfs_create('rpool/a')
+        mountpoint = Path(self.pool_path, 'a')
+        first = zfs_snapshot('first', 'rpool/a')
+        Path(mountpoint, 'added').write_text('added')
+        second = zfs_snapshot('second', 'rpool/a')
+        cache_directory = Path(self.root, 'cache')
+        records = list(zfs_diff(second, first, cache_directory=cache_directory))
+        self.assertEqual(len(records), 1)
+        self.assertEqual(len(list(cache_directory.iterdir())), 1)
+
+        self.executor.stats.reset()
+        self.assertEqual(list(zfs_diff(second, first,
+                                       cache_directory=cache_directory)),
+                         records)
+        self.assertEqual(self.executor.stats.commands, {'get': 1})
+        list(zfs_diff(second, first, include_file_types=True,
+                      cache_directory=cache_directory))
+        self.assertEqual(len(list(cache_directory.iterdir())), 2)
+
+        with self.assertRaises(ZFSError):
+            list(zfs_diff(second, 'rpool/a@missing',
+                          cache_directory=cache_directory))
+
+        # the paths are relative, the cache is still used when the
+        # filesystem is mounted somewhere else
+        moved = Path(self.root, 'moved')
+        zfs_set('rpool/a', mountpoint=moved)
+        self.executor.stats.reset()
+        self.assertEqual([(str(record['file']), record['mountpoint']) for record in
+                          zfs_diff(second, first, cache_directory=cache_directory)],
+                         [('added', moved)])
+        self.assertEqual(self.executor.stats.commands, {'get': 1})
+        self.assertEqual([str(record['file']) for record in zfs_diff(second, first)],
+                         ['added'])
+
+    def test_diff_cache_size(self):
+        zfs_create('rpool/a')
+        mountpoint = Path(self.pool_path, 'a')
+        snapshots = [zfs_snapshot('0', 'rpool/a')]
+        for i in range(1, 4):
+            Path(mountpoint, str(i)).write_text('added')
+            snapshots.append(zfs_snapshot(str(i), 'rpool/a'))
+        cache_directory = Path(self.root, 'cache')
+        list(zfs_diff(snapshots[1], snapshots[0], cache_directory=cache_directory))
+        [first] = cache_directory.iterdir()
+        zcm_config['diff_cache_size'] = 2 * first.stat().st_size
+        self.addCleanup(zcm_config.__setitem__, 'diff_cache_size', 2**30)
+        list(zfs_diff(snapshots[2], snapshots[1], cache_directory=cache_directory))
+        [second] = set(cache_directory.iterdir()) - {first}
+
+        # reading a cached diff makes it the most recently used
+        os.utime(first, (0, 0))
+        list(zfs_diff(snapshots[1], snapshots[0], cache_directory=cache_directory))
+        self.assertGreater(first.stat().st_mtime, 0)
+        list(zfs_diff(snapshots[3], snapshots[2], cache_directory=cache_directory))
+        self.assertEqual(len(list(cache_directory.iterdir())), 2)
+        self.assertTrue(first.exists())
+        self.assertFalse(second.exists())
+
+    def test_diff_summary(self):
+        zfs_create('rpool/a')
+        mountpoint = Path(self.pool_path, 'a')
+        Path(mountpoint, 'changed').write_text('before')
+        snapshot = zfs_snapshot('snap', 'rpool/a')
+        Path(mountpoint, 'changed').write_text('after')
+        for directory in ['one', 'two']:
+            Path(mountpoint, directory).mkdir()
+        for i in range(4):
+            Path(mountpoint, 'one', str(i)).write_text('added')
+        Path(mountpoint, 'two', 'added').write_text('added')
+
+        summary = zfs_diff_summary('rpool/a', snapshot, top=2)
+        self.assertEqual(summary['total'], 8)
+        self.assertEqual(summary['changes'], {'Added': 7, 'Modified': 1})
+        self.assertEqual(summary['file_types'], {'file': 6, 'directory': 2})
+        self.assertEqual(summary['directories'], [('one', 4), ('.', 3)])
+        with self.assertRaises(ZFSError):
+            zfs_diff_summary('rpool/a', 'rpool/a@missing', mountpoint=mountpoint)
+
+    def test_diff_parse(self):
+        lines = ['1614556800.000000001\tR\tF\t/a/old\t/a/new\n',
+                 '1614556800.000000002\t-\t@\t/a/b/link\n']
+        self.assertEqual(zfs_diff_parse(lines, '/a/', include_file_types=True),
+                         [('1614556800.000000001', 'Renamed', 'file', 'new'),
+                          ('1614556800.000000002', 'Removed', 'link', 'b/link')])
+        self.assertEqual(zfs_diff_parse(lines[1:]),
+                         [('1614556800.000000002', 'Removed', None, '/a/b/link')])
+        with self.assertRaises(ValueError):
+            zfs_diff_parse(lines, '/b')
+
+    def test_get(self):
+        zfs_create('rpool/a')
+        snapshot = zfs_snapshot('snap', 'rpool/a')
+        self.assertEqual(zfs_get('rpool/a', 'used'), 0)
+        self.assertEqual(zfs_get('rpool/a', 'all')['type'], 'filesystem')
+        self.assertTrue(zfs_is_filesystem('rpool/a'))
+        self.assertFalse(zfs_is_filesystem(snapshot))
+        self.assertTrue(zfs_is_snapshot(snapshot))
+        self.assertFalse(zfs_is_snapshot('rpool/missing'))
+        with self.assertRaises(ZFSError):
+            zfs_get('rpool/missing', 'type')
+
+    def test_create_recursive(self):
+        self.executor.stats.reset()
+        self.assertEqual(zfs_create('rpool/a/b/c/d', recursive=True),
+                         'rpool/a/b/c/d')
+        self.assertEqual(self.executor.stats.commands,
+                         {'get': 1, 'create': 4})
+        self.assertIsNone(zfs_create('nopool/a/b', recursive=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -12,9 +12,24 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+
 from .version import __version__
 from .exceptions import ZCMException, ZCMError
 
 zcm_config = {
-    'max_column_length': 50
-}
\ No newline at end of file
+    'max_column_length': 50,
+    'zfs_command': os.environ.get('ZCM_ZFS_COMMAND', '/usr/sbin/zfs'),
+    'max_workers': 8,
+    'diff_chunk_size': 10000,
+    'stream_buffer_size': 2**20,
+    'send_snapshots': 3,
+    'zfs_cache_ttl': float(os.environ.get('ZCM_ZFS_CACHE_TTL', '0')),
+    'zfs_cache_size': 256,
+    'daemon_socket': os.environ.get('ZCM_SOCKET', '/var/run/zcmd.sock'),
+    'daemon_refresh_interval': 10.0,
+    'diff_cache_directory': os.environ.get('ZCM_DIFF_CACHE', os.path.join(
+        os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+        'zcm', 'diff')),
+    'diff_cache_size': 2**30
+}
@@ -0,0 +1,189 @@
+# Copyright 2021, Guillermo Adrián Molina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# asyncio variant of Manager over zcm.lib.async_zfs, to load and operate
+# many managers concurrently from one event loop:
+#
+#   manager = await AsyncManager.open('/directory')
+#   clone = await asyncio.wait_for(manager.clone(), timeout=60)
+#
+# The in memory state is a Manager loaded from the zfs list output, its
+# methods that run no zfs command (get_clone(), match_ids(), plan_removal(),
+# to_dictionary(), ...) are used through AsyncManager.manager, and its
+# operations are run from the same steps (see zcm.lib.zfs.run_steps()). A
+# cancelled operation is undone like a failed one before the cancellation
+# propagates.
+
+import logging
+import time
+from pathlib import Path
+
+from zcm.api.manager import MANAGER_PROPERTIES, Manager
+from zcm.exceptions import ZCMError
+from zcm.lib.async_zfs import run_steps, zfs_list
+from zcm.lib.zfs import ZFSError
+
+log = logging.getLogger(__name__)
+
+
+async def get_zcm_for_path(path_str):
+    # see zcm.api.manager.get_zcm_for_path()
+    path = Path(path_str).absolute()
+    if not path.is_dir():
+        return None
+    absolute_path_str = str(path)
+    try:
+        zfs_list_output = await zfs_list(absolute_path_str, zfs_type='filesystem', properties=[
+                                         'name', 'zfs_clone_manager:path', 'mountpoint'], raw=True)
+        if len(zfs_list_output) == 1 and \
+                zfs_list_output[0]['zfs_clone_manager:path'] == absolute_path_str and \
+                zfs_list_output[0]['mountpoint'] == absolute_path_str:
+            name, id = zfs_list_output[0]['name'].rsplit('/', 1)
+            try:
+                int(id, base=16)
+            except ValueError:
+                return None
+            return name
+        # the active clone is not mounted
+        for zfs in await zfs_list(zfs_type='filesystem',
+                                  properties=['name', 'zfs_clone_manager:path'], raw=True):
+            if zfs['zfs_clone_manager:path'] == absolute_path_str:
+                return zfs['name']
+    except ZFSError as e:
+        raise ZCMError(e.message)
+    return None
+
+
+class AsyncManager:
+    def __init__(self, zfs, manager=None):
+        # zfs -> manager ZFS, use open() to find it by path and load it
+        self.zfs = zfs
+        self.manager = manager
+        self.activation_timing = None
+        self.destroy_timing = None
+
+    @staticmethod
+    async def open(zfs_or_path):
+        zfs = await get_zcm_for_path(zfs_or_path)
+        manager = AsyncManager(zfs_or_path if zfs is None else zfs)
+        await manager.load()
+        return manager
+
+    @staticmethod
+    async def get_managers():
+        # every manager, from a single zfs list
+        try:
+            zfs_list_output = await zfs_list(zfs_type='filesystem',
+                                             properties=MANAGER_PROPERTIES, raw=True)
+        except ZFSError as e:
+            raise ZCMError(e.message)
+        return [AsyncManager(manager.zfs, manager)
+                for manager in Manager.split_managers(zfs_list_output)]
+
+    @property
+    def path(self):
+        return self.manager.path
+
+    @property
+    def clones(self):
+        return self.manager.clones
+
+    @property
+    def active_clone(self):
+        return self.manager.active_clone
+
+    async def load(self):
+        try:
+            zfs_list_output = await zfs_list(self.zfs, zfs_type='filesystem',
+                                             properties=MANAGER_PROPERTIES, recursive=True,
+                                             raw=True)
+        except ZFSError as e:
+            raise ZCMError(e.message)
+        self.manager = Manager(self.zfs, zfs_list_output=zfs_list_output)
+        self.zfs = self.manager.zfs
+
+    async def load_clone(self, zfs_name):
+        try:
+            zfs_list_output = await zfs_list(zfs_name, zfs_type='filesystem',
+                                             properties=MANAGER_PROPERTIES, raw=True)
+        except ZFSError as e:
+            raise ZCMError(e.message)
+        if len(zfs_list_output) != 1:
+            raise ZCMError('There is no ZCM clone at %s' % zfs_name)
+        return Manager.make_clone(zfs_list_output[0])
+
+    async def clone(self, max_newer=None, max_total=None, auto_remove=False):
+        manager = self.manager
+        id = manager.check_clone(max_newer, max_total, auto_remove)
+        clone = await self.load_clone(await run_steps(manager.clone_steps(id)))
+        manager.added(clone)
+        await self.auto_remove(max_newer=max_newer, max_total=max_total)
+        return clone
+
+    async def auto_remove(self, max_newer=None, max_older=None, max_total=None):
+        plan = self.manager.plan_retention(max_newer, max_older, max_total)
+        if plan:
+            await self.execute_removal(plan)
+
+    async def execute_removal(self, plan):
+        try:
+            await run_steps(self.manager.removal_steps(plan))
+        except ZFSError as e:
+            # part of the plan was done
+            await self.load()
+            raise ZCMError(e.message)
+        self.manager.removed(plan)
+
+    async def remove(self, id):
+        await self.execute_removal(self.manager.plan_removal([id]))
+
+    async def remove_many(self, ids):
+        plan = self.manager.plan_removal(ids)
+        await self.execute_removal(plan)
+        return plan
+
+    async def unmount(self, include_active=True):
+        await run_steps(self.manager.unmount_steps(include_active))
+
+    async def mount(self, include_active=True):
+        await run_steps(self.manager.mount_steps(include_active))
+
+    async def activate(self, id, max_newer=None, max_older=None, max_total=None,
+                       auto_remove=False):
+        manager = self.manager
+        next_active = manager.check_activation(id, max_newer, max_older, auto_remove)
+        await run_steps(manager.activate_steps(next_active))
+        self.activation_timing = manager.activation_timing
+        log.info('Activated clone %s, %s was unavailable for %.3f seconds' %
+                 (id, manager.path, self.activation_timing['downtime']))
+        manager.changed()
+        await self.auto_remove(max_newer=max_newer,
+                               max_older=max_older, max_total=max_total)
+        return next_active
+
+    async def destroy(self, report=None):
+        # see Manager.destroy()
+        start = time.perf_counter()
+        try:
+            zfs_list_output = await zfs_list(self.zfs, zfs_type='filesystem',
+                                             properties=['name', 'mounted'],
+                                             recursive=True, raw=True)
+        except ZFSError as e:
+            raise ZCMError(e.message)
+        await run_steps(self.manager.destroy_steps(zfs_list_output, start, report))
+        self.destroy_timing = self.manager.destroy_timing
+        log.info('Destroyed manager %s' % self.zfs)
+
+    def to_dictionary(self):
+        return self.manager.to_dictionary()
@@ -14,19 +14,56 @@
 
 
 import logging
+from datetime import datetime
+from pathlib import Path
 
 log = logging.getLogger(__name__)
 
 
 class Clone:
+    # mountpoint, creation and size can be given as the raw strings of
+    # zfs list -Hp, they are converted the first time they are accessed
+    __slots__ = ('id', 'zfs', 'origin', 'origin_id', '_mountpoint',
+                 '_creation', '_size')
+
     def __init__(self, id, zfs, origin, origin_id, mountpoint, creation, size):
         self.id = id
         self.zfs = zfs
         self.origin = origin
         self.origin_id = origin_id
-        self.mountpoint = mountpoint
-        self.creation = creation
-        self.size = size
+        self._mountpoint = mountpoint
+        self._creation = creation
+        self._size = size
+
+    @property
+    def mountpoint(self):
+        if isinstance(self._mountpoint, str):
+            self._mountpoint = None if self._mountpoint == '-' else Path(self._mountpoint)
+        return self._mountpoint
+
+    @mountpoint.setter
+    def mountpoint(self, mountpoint):
+        self._mountpoint = mountpoint
+
+    @property
+    def creation(self):
+        if isinstance(self._creation, str):
+            self._creation = datetime.fromtimestamp(int(self._creation))
+        return self._creation
+
+    @creation.setter
+    def creation(self, creation):
+        self._creation = creation
+
+    @property
+    def size(self):
+        if isinstance(self._size, str):
+            self._size = int(self._size)
+        return self._size
+
+    @size.setter
+    def size(self, size):
+        self._size = size
 
     def to_dictionary(self):
         return {
@@ -34,7 +71,7 @@ class Clone:
             'zfs': self.zfs,
             'origin': self.origin,
             'origin_id': self.origin_id,
-            'mountpoint': str(self.mountpoint),
+            'mountpoint': str(self._mountpoint),
             'creation': str(self.creation),
-            'size':self.size
+            'size': self.size
         }
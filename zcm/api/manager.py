@@ -12,29 +12,49 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import fnmatch
 import logging
 import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
 
+from zcm import __version__, zcm_config
 from zcm.api.clone import Clone
+from zcm.api.retention import plan_removal, plan_retention
 from zcm.exceptions import ZCMError, ZCMException
 from zcm.lib.helpers import copy_directory, id_generator
-from zcm.lib.zfs import (ZFSError, zfs_clone, zfs_create, zfs_destroy,
-                         zfs_inherit, zfs_list, zfs_mount, zfs_promote,
-                         zfs_rename, zfs_set, zfs_snapshot, zfs_unmount)
+from zcm.lib.stream import StreamError, StreamReader, StreamWriter
+from zcm.lib.zfs import (ZFSError, mount_waves, mount_waves_steps, raise_errors,
+                         run_steps, zfs_cache, zfs_create, zfs_destroy,
+                         zfs_destroy_arguments, zfs_destroy_many, zfs_diff,
+                         zfs_diff_summary, zfs_exists, zfs_get_many, zfs_list,
+                         zfs_list_iter, zfs_many, zfs_mount, zfs_receive,
+                         zfs_rename, zfs_send, zfs_set, zfs_snapshot, zfs_step,
+                         zfs_unmount)
 
 log = logging.getLogger(__name__)
 
+SEND_SNAPSHOT_PREFIX = 'zcm_send_'
+SENT_PROPERTY = 'zfs_clone_manager:sent'
+
+MANAGER_PROPERTIES = ['name', 'zfs_clone_manager:path', 'origin', 'mountpoint',
+                      'creation', 'used']
+
 
 def get_zcm_for_path(path_str):
     path = Path(path_str).absolute()
     if not path.is_dir():
         return None
     absolute_path_str = str(path)
-    zfs_list_output = zfs_list(absolute_path_str, zfs_type='filesystem', properties=[
-                               'name', 'zfs_clone_manager:path', 'mountpoint'])
+    try:
+        zfs_list_output = zfs_list(absolute_path_str, zfs_type='filesystem', properties=[
+                                   'name', 'zfs_clone_manager:path', 'mountpoint'])
+    except ZFSError as e:
+        raise ZCMError(e.message)
     if len(zfs_list_output) != 1:
-        return None
+        return get_unmounted_zcm_for_path(absolute_path_str)
     zfs = zfs_list_output[0]
     if str(zfs['zfs_clone_manager:path']) == absolute_path_str and str(zfs['mountpoint']) == absolute_path_str:
         splitted_name = zfs['name'].split('/')
@@ -44,6 +64,20 @@ def get_zcm_for_path(path_str):
         except ValueError:
             return None
         return name
+    return get_unmounted_zcm_for_path(absolute_path_str)
+
+
+def get_unmounted_zcm_for_path(absolute_path_str):
+    # the active clone is not mounted, like after a failed destroy, the
+    # root is the first filesystem listed with the path
+    try:
+        for zfs in zfs_list_iter(zfs_type='filesystem',
+                                 properties=['name', 'zfs_clone_manager:path'], raw=True):
+            if zfs['zfs_clone_manager:path'] == absolute_path_str:
+                return zfs['name']
+    except ZFSError as e:
+        raise ZCMError(e.message)
+    return None
 
 
 def snapshot_to_origin_id(snapshot):
@@ -58,7 +92,12 @@ def snapshot_to_origin_id(snapshot):
 
 
 class Manager:
-    def __init__(self, zfs_or_path):
+    def __init__(self, zfs_or_path, verify=False, zfs_list_output=None):
+        # verify -> reload from zfs after every change and check the
+        # incrementally updated state against it
+        # zfs_list_output -> already listed raw MANAGER_PROPERTIES of the
+        # manager and its clones, zfs_or_path must be the manager ZFS
+        self.verify_changes = verify
         self.zfs = None
         self.path = None
         self.clones = []
@@ -67,24 +106,80 @@ class Manager:
         self.active_clone = None
         self.next_id = None
         self.size = None
+        self.activation_timing = None
+        self.destroy_timing = None
+        # lookup indexes, rebuilt by update_clone_lists()
+        self.clone_index = {}
+        self.clone_positions = {}
+        self.origin_index = {}
+        self.active_position = None
+        if zfs_list_output is not None:
+            self.zfs = zfs_or_path
+            self.load(zfs_list_output)
+            return
         zfs = get_zcm_for_path(zfs_or_path)
         self.zfs = zfs_or_path if zfs is None else zfs
         self.load()
 
     @staticmethod
     def get_managers():
-        zfs_list_output = zfs_list(
-            properties=['name', 'zfs_clone_manager:path', 'mountpoint'])
-        return [Manager(zfs['name'])
-                for zfs in zfs_list_output
-                if zfs['zfs_clone_manager:path'] is not None and
-                zfs['mountpoint'] == Path(zfs['zfs_clone_manager:path'], '.clones')]
+        return list(Manager.iter_managers())
+
+    @staticmethod
+    def iter_managers():
+        # Implemented as generator, one zfs list for the whole system split
+        # by manager, every manager is yielded as soon as it is listed
+        try:
+            yield from Manager.split_managers(
+                zfs_list_iter(zfs_type='filesystem', properties=MANAGER_PROPERTIES, raw=True))
+        except ZFSError as e:
+            raise ZCMError(e.message)
+
+    @staticmethod
+    def load_many(zfs_or_paths, max_workers=None):
+        # loads the managers of zfs_or_paths concurrently, returns them in the
+        # same order with the ZCMException of the ones that failed in place
+        def load(zfs_or_path):
+            try:
+                return Manager(zfs_or_path)
+            except ZCMException as e:
+                return e
+
+        if len(zfs_or_paths) < 2:
+            return [load(zfs_or_path) for zfs_or_path in zfs_or_paths]
+        with ThreadPoolExecutor(max_workers=max_workers or zcm_config['max_workers'],
+                                thread_name_prefix='zcm-load') as pool:
+            return list(pool.map(load, zfs_or_paths))
+
+    @staticmethod
+    def split_managers(zfs_list_output):
+        # Implemented as generator, raw zfs list output of MANAGER_PROPERTIES
+        # of every filesystem -> Manager objects
+        manager_zfs = None
+        manager_output = None
+        for zfs in zfs_list_output:
+            # clones are listed right after their manager
+            if manager_zfs is not None and zfs['name'].startswith(manager_zfs + '/'):
+                manager_output.append(zfs)
+                continue
+            if manager_zfs is not None:
+                yield Manager(manager_zfs, zfs_list_output=manager_output)
+                manager_zfs = None
+            if zfs['zfs_clone_manager:path'] != '-' and \
+                    zfs['mountpoint'] == str(Path(zfs['zfs_clone_manager:path'], '.clones')):
+                manager_zfs = zfs['name']
+                manager_output = [zfs]
+        if manager_zfs is not None:
+            yield Manager(manager_zfs, zfs_list_output=manager_output)
 
     @staticmethod
     def initialize_manager(zfs_str, path_str, migrate=None):
         path = Path(path_str)
-        zfs_list_output = zfs_list(zfs_str, zfs_type='all', properties=[
-            'name', 'type', 'zfs_clone_manager:path', 'origin', 'mountpoint'], recursive=True)
+        try:
+            zfs_list_output = zfs_list(zfs_str, zfs_type='all', properties=[
+                'name', 'type', 'zfs_clone_manager:path', 'origin', 'mountpoint'], recursive=True)
+        except ZFSError as e:
+            raise ZCMError(e.message)
         if zfs_list_output:
             zfs = zfs_list_output[0]
             if zfs['zfs_clone_manager:path']:
@@ -144,7 +239,7 @@ class Manager:
             log.info('Moved content of path %s to clone' % path_str)
            
 
-    def load(self):
+    def load(self, zfs_list_output=None):
         if not isinstance(self.zfs, str):
             raise ZCMError(
                 'The name property is invalid: ' + str(self.zfs))
@@ -155,21 +250,24 @@ class Manager:
         self.active_clone = None
         self.next_id = None
         self.size = None
-        last_id = 0
-        zfs_list_output = zfs_list(self.zfs, zfs_type='filesystem', properties=[
-            'name', 'zfs_clone_manager:path', 'origin', 'mountpoint',
-            'creation', 'used'], recursive=True)
+        if zfs_list_output is None:
+            try:
+                zfs_list_output = zfs_list(self.zfs, zfs_type='filesystem',
+                                           properties=MANAGER_PROPERTIES, recursive=True,
+                                           raw=True)
+            except ZFSError as e:
+                raise ZCMError(e.message)
         if not zfs_list_output:
             raise ZCMError(
                 'There is no ZCM manager at %s' % self.zfs)
         for zfs in zfs_list_output:
             if self.path is None:
                 self.zfs = zfs['name']
-                if zfs['zfs_clone_manager:path'] is None:
+                if zfs['zfs_clone_manager:path'] == '-':
                     raise ZCMError(
                         'The ZFS %s is not a valid ZCM manager' % zfs['name'])
-                self.path = zfs['zfs_clone_manager:path']
-                self.size = zfs['used']
+                self.path = Path(zfs['zfs_clone_manager:path'])
+                self.size = int(zfs['used'])
             else:
                 splitted_name = zfs['name'].split('/')
                 name = '/'.join(splitted_name[:-1])
@@ -178,27 +276,88 @@ class Manager:
                     raise ZCMError(
                         'The ZFS %s is not a valid ZCM clone' % zfs['name'])
                 try:
-                    last_id = max(last_id, int(id, base=16))
+                    int(id, base=16)
                 except ValueError:
                     raise ZCMError(
                         'The ZFS %s is not a valid ZCM clone' % zfs['name'])
-                origin_id = snapshot_to_origin_id(zfs['origin'])
-                clone = Clone(id, zfs['name'], zfs['origin'], origin_id,
-                              zfs['mountpoint'], zfs['creation'], zfs['used'])
-                if not isinstance(self.path, Path) or not self.path.is_dir():
+                if not self.clones and not self.path.is_dir():
                     raise ZCMError(
-                        'The path property is invalid: ' + self.path)
-                if zfs['mountpoint'] == self.path:
+                        'The path property is invalid: ' + str(self.path))
+                clone = self.make_clone(zfs)
+                if zfs['mountpoint'] == str(self.path):
                     self.active_clone = clone
-                else:
-                    if self.active_clone:
-                        self.newer_clones.append(clone)
-                    else:
-                        self.older_clones.append(clone)
                 self.clones.append(clone)
+        self.update_clone_lists()
+
+    @staticmethod
+    def make_clone(zfs):
+        # zfs -> raw zfs list output, converted lazily by Clone
+        id = zfs['name'].split('/')[-1]
+        origin = None if zfs['origin'] == '-' else zfs['origin']
+        origin_id = snapshot_to_origin_id(origin)
+        return Clone(id, zfs['name'], origin, origin_id,
+                     zfs['mountpoint'], zfs['creation'], zfs['used'])
+
+    def load_clone(self, zfs_name):
+        # lists a single clone, instead of the whole manager
+        try:
+            zfs_list_output = zfs_list(zfs_name, zfs_type='filesystem',
+                                       properties=MANAGER_PROPERTIES, raw=True)
+        except ZFSError as e:
+            raise ZCMError(e.message)
+        if len(zfs_list_output) != 1:
+            raise ZCMError('There is no ZCM clone at %s' % zfs_name)
+        return self.make_clone(zfs_list_output[0])
+
+    def update_clone_lists(self):
+        # recompute the indexes, older_clones, newer_clones and next_id,
+        # clones are sorted by id
+        self.clone_index = {}
+        self.clone_positions = {}
+        self.origin_index = {}
+        for position, clone in enumerate(self.clones):
+            self.clone_index[clone.id] = clone
+            self.clone_positions[clone.id] = position
+            self.origin_index.setdefault(clone.origin_id, []).append(clone)
+        if self.active_clone is None:
+            self.active_position = None
+            self.older_clones = list(self.clones)
+            self.newer_clones = []
+        else:
+            self.active_position = self.clone_positions[self.active_clone.id]
+            self.older_clones = self.clones[:self.active_position]
+            self.newer_clones = self.clones[self.active_position + 1:]
+        last_id = int(self.clones[-1].id, base=16) if self.clones else 0
         self.next_id = format(last_id + 1, '08x')
 
-    def clone(self, max_newer=None, max_total=None, auto_remove=False):
+    def count_older_newer(self, clone):
+        # how many clones would be older and newer if clone was active
+        position = self.clone_positions[clone.id]
+        return position, len(self.clones) - position - 1
+
+    def verify(self):
+        # reload from zfs, returns False if the in memory state was stale
+        zfs_cache.clear()
+        expected = self.to_dictionary()
+        expected_clones = [clone.to_dictionary() for clone in self.clones]
+        self.load()
+        keys = ['id', 'zfs', 'origin', 'origin_id', 'mountpoint']
+        result = all(expected[key] == value
+                     for key, value in self.to_dictionary().items()
+                     if key != 'size') and \
+            [[clone[key] for key in keys] for clone in expected_clones] == \
+            [[clone.to_dictionary()[key] for key in keys] for clone in self.clones]
+        if not result:
+            log.warning('The state of manager %s was out of date' % self.zfs)
+        return result
+
+    def changed(self):
+        self.update_clone_lists()
+        if self.verify_changes:
+            self.verify()
+
+    def check_clone(self, max_newer=None, max_total=None, auto_remove=False):
+        # raises if a clone can not be created, returns its id
         if not self.active_clone:
             raise ZCMError('There is no active clone, activate one first')
         if not auto_remove and max_newer is not None and len(self.newer_clones) >= max_newer:
@@ -207,79 +366,217 @@ class Manager:
         if not auto_remove and max_total is not None and len(self.clones) >= max_total:
             raise ZCMException(
                 'There are already %d clones, can not create another' % len(self.clones))
-        id = self.next_id
-        try:         
-            snapshot = zfs_snapshot(id, self.active_clone.zfs)
-            zfs = zfs_clone(self.zfs + '/' + id, snapshot)
-        except ZFSError as e:
-            raise ZCMError(e.message)            
-        self.load()
-        clone = self.get_clone(id)
-        log.info('Created clone ' + clone.id)
+        return self.next_id
+
+    def clone(self, max_newer=None, max_total=None, auto_remove=False):
+        id = self.check_clone(max_newer, max_total, auto_remove)
+        clone = self.load_clone(run_steps(self.clone_steps(id)))
+        self.added(clone)
         self.auto_remove(max_newer=max_newer, max_total=max_total)
         return clone
 
+    def clone_steps(self, id):
+        # steps of clone(), see zcm.lib.zfs.run_steps(), returns the name of
+        # the new clone
+        snapshot = '%s@%s' % (self.active_clone.zfs, id)
+        zfs = self.zfs + '/' + id
+        try:
+            yield from zfs_step('snapshot', [snapshot])
+            yield from zfs_step('clone', [snapshot, zfs])
+        except ZFSError as e:
+            raise ZCMError(e.message)
+        return zfs
+
+    def added(self, clone):
+        # updates the in memory state after clone was created
+        self.clones.append(clone)
+        self.changed()
+        log.info('Created clone ' + clone.id)
+
+    @staticmethod
+    def clone_many(managers, max_newer=None, max_total=None, auto_remove=False):
+        # clones the active clone of every manager. The snapshots of a pool
+        # are taken by a single zfs snapshot, at the same point in time, then
+        # the clones are created concurrently and listed at once.
+        # Returns the new clones in the same order as managers
+        if len(set(manager.zfs for manager in managers)) != len(managers):
+            raise ZCMError('A manager can not be cloned more than once at a time')
+        ids = [manager.check_clone(max_newer, max_total, auto_remove) for manager in managers]
+        snapshots = ['%s@%s' % (manager.active_clone.zfs, id)
+                     for manager, id in zip(managers, ids)]
+        pools = {}
+        for snapshot in snapshots:
+            pools.setdefault(snapshot.split('/')[0], []).append(snapshot)
+        # the snapshots of every pool are taken or none is: when a pool
+        # fails the snapshots of the other pools are destroyed
+        results = zfs_many([('snapshot', names) for names in pools.values()],
+                           raise_error=False)
+        errors = [result.message for result in results if isinstance(result, ZFSError)]
+        if errors:
+            taken = [snapshot for names, result in zip(pools.values(), results)
+                     if not isinstance(result, ZFSError) for snapshot in names]
+            raise ZCMError(''.join(errors + Manager.destroy_snapshots(taken)))
+        names = [manager.zfs + '/' + id for manager, id in zip(managers, ids)]
+        results = zfs_many([('clone', [snapshot, name])
+                            for snapshot, name in zip(snapshots, names)], raise_error=False)
+        errors = [result.message for result in results if isinstance(result, ZFSError)]
+        created = [name for name, result in zip(names, results)
+                   if not isinstance(result, ZFSError)]
+        errors += Manager.destroy_snapshots(
+            [snapshot for snapshot, result in zip(snapshots, results)
+             if isinstance(result, ZFSError)])
+        clones = {}
+        if created:
+            try:
+                zfs_list_output = zfs_list(created, zfs_type='filesystem',
+                                           properties=MANAGER_PROPERTIES, raw=True)
+            except ZFSError as e:
+                raise ZCMError(e.message)
+            clones = {zfs['name']: Manager.make_clone(zfs) for zfs in zfs_list_output}
+        for manager, name in zip(managers, names):
+            if name in clones:
+                manager.clones.append(clones[name])
+                manager.changed()
+                log.info('Created clone %s of manager %s' % (clones[name].id, manager.zfs))
+        if errors:
+            raise ZCMError(''.join(errors))
+        for manager in managers:
+            manager.auto_remove(max_newer=max_newer, max_total=max_total)
+        return [clones[name] for name in names]
+
+    @staticmethod
+    def destroy_snapshots(snapshots):
+        # destroys the snapshots left by a failed clone, returns the errors
+        if not snapshots:
+            return []
+        try:
+            zfs_destroy_many(snapshots)
+        except ZFSError as e:
+            return [e.message]
+        return []
+
     def auto_remove(self, max_newer=None, max_older=None, max_total=None):
-        while max_older is not None and len(self.older_clones) > max_older:
-            self.remove(self.older_clones[0].id)
-        while max_newer is not None and len(self.newer_clones) > max_newer:
-            self.remove(self.newer_clones[0].id)
-        while max_total is not None and len(self.clones) > max_total:
-            if self.older_clones:
-                self.remove(self.older_clones[0].id)
-            elif self.newer_clones:
-                self.remove(self.newer_clones[0].id)
-            else:
-                raise ZCMError(
-                    'There are no more clones to remove in order to satisfy max limit of ' + max_total)
+        plan = self.plan_retention(max_newer, max_older, max_total)
+        if plan:
+            self.execute_removal(plan)
+
+    def plan_retention(self, max_newer=None, max_older=None, max_total=None,
+                       policy=None, now=None):
+        # RemovalPlan of the clones over the limits, the oldest first, and
+        # of the clones a zcm.api.retention.RetentionPolicy does not keep
+        ids = plan_retention(self.older_clones, self.newer_clones,
+                             self.active_clone, max_newer, max_older, max_total)
+        if policy is not None:
+            ids += policy.select(self.clones, self.active_clone, now)
+        return self.plan_removal(ids)
 
     def get_clone(self, id):
-        for clone in self.clones:
-            if clone.id == id:
-                return clone
-        raise ZCMError('There is no clone with id ' + id)
+        clone = self.clone_index.get(id)
+        if clone is None:
+            raise ZCMError('There is no clone with id ' + id)
+        return clone
 
-    def unmount(self):
+    def snapshot(self, id_or_snapshot):
+        # id_or_snapshot -> a snapshot of this manager or a clone id, for
+        # which its newest snapshot (the origin of its newest child) is used
+        if '@' in id_or_snapshot:
+            filesystem = id_or_snapshot.split('@')[0]
+            if filesystem != self.zfs and not filesystem.startswith(self.zfs + '/'):
+                raise ZCMError('Snapshot %s is not in manager %s' %
+                               (id_or_snapshot, self.zfs))
+            return id_or_snapshot
+        clones = self.find_clones_with_origin(self.get_clone(id_or_snapshot).id)
+        if not clones:
+            raise ZCMError('Clone %s has no snapshots, clone it first' %
+                           id_or_snapshot)
+        return max(clones, key=lambda clone: clone.id).origin
+
+    def diff_arguments(self, id, origin):
+        # id -> clone id or snapshot, origin -> clone id or snapshot, the
+        # origin of the clone if None (every file for the first clone).
+        # Returns the zfs_diff() arguments
+        if '@' in id:
+            zfs = self.snapshot(id)
+            mountpoint = self.mountpoints()[zfs.split('@')[0]]
+            if origin is None:
+                raise ZCMError('The origin of snapshot %s must be given' % id)
+        else:
+            clone = self.get_clone(id)
+            zfs = clone.zfs
+            mountpoint = clone.mountpoint
+            if origin is None:
+                return zfs, clone.origin, mountpoint
+        return zfs, self.snapshot(origin), mountpoint
+
+    def diff(self, id, origin=None, compact=False, workers=None, cache=True):
+        # Implemented as generator, changes of the clone (or snapshot) id since
+        # origin. Diffs between two snapshots are cached by zfs_diff()
+        zfs, origin_snapshot, mountpoint = self.diff_arguments(id, origin)
+        cache_directory = zcm_config['diff_cache_directory'] if cache else None
         try:
-            for clone in self.clones:
-                if clone != self.active_clone:
-                    zfs_unmount(clone.zfs)
-            zfs_unmount(self.zfs)
-            if self.active_clone is not None:
-                zfs_unmount(self.active_clone.zfs)
+            yield from zfs_diff(zfs, origin_snapshot, include_file_types=True,
+                                mountpoint=mountpoint, compact=compact,
+                                workers=workers, cache_directory=cache_directory)
         except ZFSError as e:
-            # at lest one unmount failed, remount all and fail
-            self.mount()
             raise ZCMError(e.message)
 
-    def mount(self):
-        if not self.active_clone:
-            raise ZCMError('There is no active clone, activate one first')
+    def diff_summary(self, id, origin=None, top=10, workers=None, cache=True):
+        # counters of zfs_diff_summary(), without keeping the changes
+        zfs, origin_snapshot, mountpoint = self.diff_arguments(id, origin)
+        cache_directory = zcm_config['diff_cache_directory'] if cache else None
         try:
-            zfs_mount(self.active_clone.zfs)
-            zfs_mount(self.zfs)
-            for clone in self.clones:
-                if clone != self.active_clone:
-                    zfs_mount(clone.zfs)
+            return zfs_diff_summary(zfs, origin_snapshot, mountpoint=mountpoint,
+                                    top=top, workers=workers,
+                                    cache_directory=cache_directory)
         except ZFSError as e:
             raise ZCMError(e.message)
 
-    def activate(self, id, max_newer=None, max_older=None, max_total=None, auto_remove=False):
+    def mountpoints(self, include_active=True):
+        # the active clone at <path>, the root at <path>/.clones and the
+        # rest of the clones inside it
+        mountpoints = {}
+        if self.active_clone is not None and include_active:
+            mountpoints[self.active_clone.zfs] = self.path
+        mountpoints[self.zfs] = Path(self.path, '.clones')
+        for clone in self.clones:
+            if clone != self.active_clone:
+                mountpoints[clone.zfs] = clone.mountpoint
+        return mountpoints
+
+    def unmount(self, include_active=True):
+        run_steps(self.unmount_steps(include_active))
+
+    def unmount_steps(self, include_active=True):
+        # clones first (concurrently), then the root and the active clone
+        mountpoints = self.mountpoints(include_active)
+        waves = mount_waves(mountpoints)
+        waves.reverse()
+        unmounted, error = yield from mount_waves_steps(waves, unmount=True)
+        if error is not None:
+            # at lest one unmount failed, remount the unmounted ones and fail
+            yield from mount_waves_steps(mount_waves(
+                {zfs: mountpoints[zfs] for zfs in unmounted}))
+            raise ZCMError(error.message)
+
+    def mount(self, include_active=True):
+        run_steps(self.mount_steps(include_active))
+
+    def mount_steps(self, include_active=True):
+        # active clone, root and then the rest of the clones (concurrently)
+        if not self.active_clone:
+            raise ZCMError('There is no active clone, activate one first')
+        mounted, error = yield from mount_waves_steps(
+            mount_waves(self.mountpoints(include_active)))
+        if error is not None:
+            raise ZCMError(error.message)
+
+    def check_activation(self, id, max_newer=None, max_older=None, auto_remove=False):
+        # raises if clone id can not be activated, returns it
         next_active = self.get_clone(id)
         if next_active == self.active_clone:
             raise ZCMException('Manager %s already active' % id)
         if not auto_remove and (max_newer is not None or max_older is not None):
-            newer_count = 0
-            older_count = 0
-            has_reach_active = False
-            for clone in self.clones:
-                if clone == next_active:
-                    has_reach_active = True
-                else:
-                    if has_reach_active:
-                        newer_count += 1
-                    else:
-                        older_count += 1
+            older_count, newer_count = self.count_older_newer(next_active)
             if not auto_remove and max_newer is not None and newer_count > max_newer:
                 raise ZCMException(
                     'Command denied, Activating %s violates the maximum number of newer clones (%d/%d)'
@@ -288,61 +585,521 @@ class Manager:
                 raise ZCMException(
                     'Command denied, Activating %s violates the maximum number of older clones (%d/%d)'
                     % (id, older_count, max_older))
+        return next_active
 
-        self.unmount()
+    def activate(self, id, max_newer=None, max_older=None, max_total=None, auto_remove=False):
+        next_active = self.check_activation(id, max_newer, max_older, auto_remove)
+        run_steps(self.activate_steps(next_active))
+        log.info('Activated clone %s, %s was unavailable for %.3f seconds' %
+                 (id, self.path, self.activation_timing['downtime']))
+        self.changed()
+        self.auto_remove(max_newer=max_newer,
+                         max_older=max_older, max_total=max_total)
+        return next_active
+
+    def activate_steps(self, next_active):
+        # steps of activate(), see zcm.lib.zfs.run_steps()
+        previous_active = self.active_clone
+        start = time.perf_counter()
+        # the rest of the clones are nested in <path>, they are unmounted
+        # while <path> is still served by the active clone
+        yield from self.unmount_steps(include_active=False)
         try:
-            if self.active_clone is not None:
-                zfs_inherit(self.active_clone.zfs, 'mountpoint')
-            zfs_set(next_active.zfs, mountpoint=self.path)
+            yield from zfs_step('set', ['mountpoint=' + str(self.path), next_active.zfs])
         except ZFSError as e:
+            yield from self.mount_steps(include_active=False)
             raise ZCMError(e.message)
+        unmounted = time.perf_counter()
+        # <path> is unavailable only while swapping the two clones
+        yield from self.swap_active_steps(previous_active, next_active)
+        swapped = time.perf_counter()
+        try:
+            if previous_active is not None:
+                yield from zfs_step('inherit', ['mountpoint', previous_active.zfs])
+        except ZFSError as e:
+            yield from self.rollback_active_steps(previous_active, next_active)
+            raise ZCMError(e.message)
+        # the in memory state is only changed once every clone is mounted
+        mountpoints = self.mountpoints(include_active=False)
+        del mountpoints[next_active.zfs]
+        if previous_active is not None:
+            mountpoints[previous_active.zfs] = Path(self.path, '.clones', previous_active.id)
+        mounted, error = yield from mount_waves_steps(mount_waves(mountpoints))
+        if error is not None:
+            waves = mount_waves({zfs: mountpoints[zfs] for zfs in mounted})
+            waves.reverse()
+            yield from mount_waves_steps(waves, unmount=True)
+            yield from self.rollback_active_steps(previous_active, next_active)
+            raise ZCMError(error.message)
+        self.set_active(previous_active, next_active)
+        self.activation_timing = {
+            'unmount': unmounted - start,
+            'downtime': swapped - unmounted,
+            'mount': time.perf_counter() - swapped
+        }
+
+    def set_active(self, previous_active, next_active):
+        if previous_active is not None:
+            # inherited from the root, mounted at <path>/.clones
+            previous_active.mountpoint = Path(self.path, '.clones', previous_active.id)
+        next_active.mountpoint = self.path
         self.active_clone = next_active
-        self.mount()
 
-        log.info('Activated clone ' + id)
-        self.load()
-        self.auto_remove(max_newer=max_newer,
-                         max_older=max_older, max_total=max_total)
-        return next_active
+    def swap_active_steps(self, previous_active, next_active):
+        # next_active mountpoint is already set to <path>
+        try:
+            if previous_active is not None:
+                yield from zfs_step('unmount', [previous_active.zfs])
+        except ZFSError as e:
+            yield from self.restore_active_steps(None, next_active)
+            raise ZCMError(e.message)
+        try:
+            yield from zfs_step('mount', [next_active.zfs])
+        except ZFSError as e:
+            yield from self.restore_active_steps(previous_active, next_active)
+            raise ZCMError(e.message)
+
+    def restore_active_steps(self, previous_active, next_active):
+        # undo a failed swap_active_steps(), best effort
+        try:
+            yield from zfs_step('inherit', ['mountpoint', next_active.zfs])
+            if previous_active is not None:
+                yield from zfs_step('mount', [previous_active.zfs])
+            yield from self.mount_steps(include_active=False)
+        except (ZFSError, ZCMError) as e:
+            log.error('Could not restore manager %s: %s' % (self.zfs, e.message))
+
+    def rollback_active_steps(self, previous_active, next_active):
+        # undo swap_active_steps() once next_active is mounted at <path>,
+        # best effort
+        try:
+            yield from zfs_step('unmount', [next_active.zfs])
+            if previous_active is not None:
+                yield from zfs_step('set', ['mountpoint=' + str(self.path),
+                                            previous_active.zfs])
+        except ZFSError as e:
+            log.error('Could not restore manager %s: %s' % (self.zfs, e.message))
+            return
+        yield from self.restore_active_steps(previous_active, next_active)
 
     def find_clones_with_origin(self, id):
-        clones = []
+        return list(self.origin_index.get(id, []))
+
+    def plan_removal(self, ids):
+        # RemovalPlan to remove the clones with ids, see zcm.api.retention
+        for id in ids:
+            if self.get_clone(id) == self.active_clone:
+                raise ZCMError(
+                    'Manager with id %s is active, can not remove' % id)
+        return plan_removal(self.clones, set(ids))
+
+    def execute_removal(self, plan):
+        try:
+            run_steps(self.removal_steps(plan))
+        except ZFSError as e:
+            # part of the plan was done
+            self.load()
+            raise ZCMError(e.message)
+        self.removed(plan)
+
+    def removal_steps(self, plan):
+        # steps of execute_removal(), raises ZFSError when part of the plan
+        # was done
+        for zfs in plan.promotes:
+            yield from zfs_step('promote', [zfs])
+        for wave in plan.waves:
+            raise_errors((yield [('destroy', zfs_destroy_arguments(zfs, recursive=True))
+                                 for zfs in wave]))
+        if plan.snapshots:
+            raise_errors((yield [('destroy', zfs_destroy_arguments(snapshot))
+                                 for snapshot in plan.snapshots]))
+
+    def removed(self, plan):
+        # updates the in memory state after plan was executed
         for clone in self.clones:
-            if clone.origin_id == id:
-                clones.append(clone)
-        return clones
+            if clone.zfs in plan.origins:
+                clone.origin = plan.origins[clone.zfs]
+                clone.origin_id = snapshot_to_origin_id(clone.origin)
+        removed = set(plan.ids)
+        self.clones = [clone for clone in self.clones if clone.id not in removed]
+        self.changed()
+        for id in plan.ids:
+            log.info('Removed clone ' + id)
 
     def remove(self, id):
-        clone = self.get_clone(id)
-        if clone == self.active_clone:
-            raise ZCMError(
-                'Manager with id %s is active, can not remove' % id)
-        clones = self.find_clones_with_origin(id)
-        promoted = None
-        if clones:
-            promoted = clones[-1]
-            zfs_promote(promoted.zfs)
+        self.execute_removal(self.plan_removal([id]))
+
+    def remove_many(self, ids):
+        plan = self.plan_removal(ids)
+        self.execute_removal(plan)
+        return plan
+
+    def match_ids(self, patterns):
+        # patterns -> ids, first-last ranges or globs, returns the matching
+        # clone ids sorted. Ranges and globs skip the active clone
+        ids = set()
+        for pattern in patterns:
+            if pattern in self.clone_index:
+                ids.add(pattern)
+                continue
+            if any(character in pattern for character in '*?['):
+                matches = fnmatch.filter([clone.id for clone in self.clones], pattern)
+            elif '-' in pattern:
+                try:
+                    first, last = [int(id, base=16) for id in pattern.split('-')]
+                except ValueError:
+                    raise ZCMError('Invalid range of clone ids ' + pattern)
+                matches = [clone.id for clone in self.clones
+                           if first <= int(clone.id, base=16) <= last]
+            else:
+                raise ZCMError('There is no clone with id ' + pattern)
+            if self.active_clone is not None and self.active_clone.id in matches:
+                matches.remove(self.active_clone.id)
+            if not matches:
+                raise ZCMError('There are no clones matching ' + pattern)
+            ids.update(matches)
+        return sorted(ids)
+
+    def destroy(self, report=None):
+        # unmounts and destroys the clones concurrently, then the root and
+        # the path. Nothing is undone after a failure, destroying again
+        # resumes from there.
+        # report -> called as report(phase, done, total) after every wave
+        start = time.perf_counter()
         try:
-            zfs_destroy(clone.zfs)
-            if clone.origin:
-                zfs_destroy(clone.origin)
-            if promoted:
-                zfs_destroy('%s@%s' % (promoted.zfs, promoted.id))
-            log.info('Removed clone ' + clone.id)
-            self.load()
+            zfs_list_output = zfs_list(self.zfs, zfs_type='filesystem',
+                                       properties=['name', 'mounted'],
+                                       recursive=True, raw=True)
         except ZFSError as e:
-            raise ZCMError(e.message)            
-        
+            raise ZCMError(e.message)
+        run_steps(self.destroy_steps(zfs_list_output, start, report))
+        log.info('Destroyed manager %s' % self.zfs)
+
+    def destroy_steps(self, zfs_list_output, start, report=None):
+        # steps of destroy() once zfs_list_output was listed at start
+        unmount_waves, destroy_waves = self.destroy_plan(zfs_list_output)
+        yield from self.destroy_phase_steps('unmount', unmount_waves, report)
+        unmounted = time.perf_counter()
+        yield from self.destroy_phase_steps('destroy', destroy_waves, report)
+        destroyed = time.perf_counter()
+        self.destroy_path()
+        self.destroy_timing = {
+            'unmount': unmounted - start,
+            'destroy': destroyed - unmounted,
+            'path': time.perf_counter() - destroyed
+        }
+
+    def destroy_plan(self, zfs_list_output):
+        # zfs_list_output -> raw name and mounted of the manager filesystems
+        # returns the waves of zfs commands that unmount and destroy them
+        mounted = set(zfs['name'] for zfs in zfs_list_output if zfs['mounted'] == 'yes')
+        mountpoints = self.mountpoints()
+        waves = mount_waves({zfs: mountpoint for zfs, mountpoint in mountpoints.items()
+                             if zfs in mounted})
+        waves.reverse()
+        unmount_waves = [[('unmount', [zfs]) for zfs in wave] for wave in waves]
+        # the clones of a snapshot go before the clone that has it
+        waves = plan_removal(self.clones, set(self.clone_index)).waves
+        waves.append([self.zfs])
+        destroy_waves = [[('destroy', zfs_destroy_arguments(zfs, recursive=True))
+                          for zfs in wave] for wave in waves]
+        return unmount_waves, destroy_waves
 
-    def destroy(self):
+    def destroy_path(self):
         try:
-            self.unmount()
-            zfs_destroy(self.zfs, recursive=True)
-            self.path.rmdir()
-        except ZFSError as e:
-            raise ZCMError(e.message)            
+            if self.path.exists():
+                self.path.rmdir()
         except OSError as e:
-            raise ZCMError('Could not destroy path ' + self.path)
+            raise ZCMError('Could not destroy path %s: %s' % (self.path, e.strerror))
+
+    def destroy_phase_steps(self, phase, waves, report):
+        # runs every wave of zfs commands concurrently, one after the other
+        total = sum(len(wave) for wave in waves)
+        done = 0
+        for wave in waves:
+            done = self.destroy_progress(phase, (yield wave), done, total, report)
+
+    def destroy_progress(self, phase, results, done, total, report):
+        # results -> of a wave of destroy_phase_steps(), returns the commands done
+        errors = [result.message for result in results if isinstance(result, ZFSError)]
+        done += len(results) - len(errors)
+        if report is not None:
+            report(phase, done, total)
+        if errors:
+            raise ZCMError('%sCould not %s %s, destroy it again to resume' %
+                           (''.join(errors), phase, self.zfs))
+        return done
+
+    def list_snapshots(self):
+        # returns {filesystem: [snapshot, ...]} with the snapshots of the
+        # manager, from the oldest to the newest
+        try:
+            zfs_list_output = zfs_list(self.zfs, zfs_type='snapshot',
+                                       properties=['name'], recursive=True, raw=True)
+        except ZFSError as e:
+            raise ZCMError(e.message)
+        snapshots = {}
+        for zfs in zfs_list_output:
+            snapshots.setdefault(zfs['name'].split('@')[0], []).append(zfs['name'])
+        return snapshots
+
+    def sent_snapshots(self, snapshots):
+        # returns {zfs: snapshot} with the last snapshot that was sent of the
+        # root and every clone. zfs_clone_manager:sent holds the relative name
+        # of the snapshot, values inherited from the root or snapshots
+        # that came with a promotion do not count
+        names = [self.zfs] + [clone.zfs for clone in self.clones]
+        try:
+            values = zfs_get_many(names, [SENT_PROPERTY])
+        except ZFSError as e:
+            raise ZCMError(e.message)
+        sent = {}
+        for zfs, properties in values.items():
+            value = properties[SENT_PROPERTY]
+            if isinstance(value, str) and value.startswith(self.relative_name(zfs) + '@') and \
+                    self.zfs + value in snapshots.get(zfs, []):
+                sent[zfs] = self.zfs + value
+        return sent
+
+    def send_plan(self, snapshot_name, incremental=False, since=None):
+        # returns [(zfs, first_snapshot, last_snapshot), ...], the zfs sends
+        # that replicate the root and the clones up to their snapshot_name
+        # snapshot, every origin is sent before the clones of it.
+        # incremental -> from the last snapshot sent, where there is one
+        # since -> from the snapshots with that name instead
+        snapshots = self.list_snapshots()
+        if since is not None:
+            sent_snapshots = {zfs: '%s@%s' % (zfs, since) for zfs, names in snapshots.items()
+                              if '%s@%s' % (zfs, since) in names}
+        else:
+            sent_snapshots = self.sent_snapshots(snapshots) if incremental else {}
+        root_snapshot = '%s@%s' % (self.zfs, snapshot_name)
+        plan = [(self.zfs, sent_snapshots.get(self.zfs), root_snapshot)]
+        sent = set()
+        pending = list(self.clones)
+        while pending:
+            ready = [clone for clone in pending
+                     if clone.origin is None or clone.origin.split('@')[0] in sent]
+            if not ready:
+                raise ZCMError('Could not order the clones of %s by origin' % self.zfs)
+            for clone in ready:
+                last = '%s@%s' % (clone.zfs, snapshot_name)
+                if clone.zfs in sent_snapshots:
+                    plan.append((clone.zfs, sent_snapshots[clone.zfs], last))
+                elif clone.origin is not None:
+                    plan.append((clone.zfs, clone.origin, last))
+                else:
+                    first = snapshots[clone.zfs][0]
+                    plan.append((clone.zfs, None, first))
+                    if first != last:
+                        plan.append((clone.zfs, first, last))
+                sent.add(clone.zfs)
+                pending.remove(clone)
+        return plan
+
+    def relative_name(self, zfs_name):
+        # rpool/manager/00000001@00000002 -> /00000001@00000002
+        return zfs_name[len(self.zfs):]
+
+    def destroy_send_snapshots(self, keep=()):
+        # destroys the snapshots taken by send(), but the ones named in keep
+        snapshots = [snapshot for names in self.list_snapshots().values()
+                     for snapshot in names
+                     if snapshot.split('@')[1].startswith(SEND_SNAPSHOT_PREFIX) and
+                     snapshot.split('@')[1] not in keep]
+        try:
+            zfs_many([('destroy', [snapshot]) for snapshot in snapshots])
+        except ZFSError as e:
+            raise ZCMError(e.message)
+
+    def send(self, output, compression=None, progress=None, incremental=False, since=None):
+        # streams the whole manager to the binary file object output, see
+        # zcm.lib.stream. A new snapshot of the root and clones is sent and
+        # kept in zfs_clone_manager:sent. The sender can not know if a stream
+        # was received, so the snapshots of the last
+        # zcm_config['send_snapshots'] streams are kept, a receiver that
+        # missed some syncs --since its received_snapshot()
+        # incremental -> only the changes since the last snapshot sent
+        # since -> only the changes since the send snapshot with that name
+        if since is not None:
+            incremental = True
+            if not zfs_exists('%s@%s' % (self.zfs, since)):
+                raise ZCMError('There is no snapshot %s of manager %s, destroy the received '
+                               'manager and receive a whole zcm send' % (since, self.zfs))
+        snapshot_name = SEND_SNAPSHOT_PREFIX + datetime.now().strftime('%Y%m%d%H%M%S%f')
+        try:
+            zfs_snapshot(snapshot_name, self.zfs, recursive=True)
+        except ZFSError as e:
+            raise ZCMError(e.message)
+        try:
+            plan = self.send_plan(snapshot_name, incremental, since)
+            writer = StreamWriter(output, compression, progress)
+            writer.begin({
+                'type': 'manager',
+                'version': __version__,
+                'zfs': self.zfs,
+                'path': str(self.path),
+                'clones': [clone.id for clone in self.clones],
+                'active_clone': self.active_clone.id if self.active_clone else None,
+                'snapshot': snapshot_name,
+                'incremental': incremental
+            })
+            writer.end()
+            for zfs, first_snapshot, last_snapshot in plan:
+                writer.begin({
+                    'type': 'dataset',
+                    'name': self.relative_name(zfs),
+                    'from': None if first_snapshot is None else self.relative_name(first_snapshot),
+                    'to': self.relative_name(last_snapshot)
+                })
+                zfs_send(last_snapshot, writer, first_snapshot)
+                writer.end()
+            writer.close()
+        except (ZFSError, StreamError, ZCMError) as e:
+            try:
+                zfs_destroy('%s@%s' % (self.zfs, snapshot_name), recursive=True)
+            except ZFSError as destroy_error:
+                log.error('Could not destroy snapshot %s: %s' %
+                          (snapshot_name, destroy_error.message))
+            raise ZCMError(e.message)
+        # a clone without origin can be sent in two parts, the last one counts
+        sent = {zfs: last_snapshot for zfs, first_snapshot, last_snapshot in plan}
+        try:
+            zfs_many([('set', ['%s=%s' % (SENT_PROPERTY, self.relative_name(last_snapshot)), zfs])
+                      for zfs, last_snapshot in sent.items()])
+        except ZFSError as e:
+            raise ZCMError(e.message)
+        self.destroy_send_snapshots(
+            keep=self.send_snapshot_names()[-zcm_config['send_snapshots']:])
+        log.info('Sent manager %s%s' % (self.zfs, ' changes' if incremental else ''))
+
+    def send_snapshot_names(self):
+        # names of the snapshots taken by send() of the root, oldest first
+        return [snapshot.split('@')[1] for snapshot in self.list_snapshots().get(self.zfs, [])
+                if snapshot.split('@')[1].startswith(SEND_SNAPSHOT_PREFIX)]
+
+    def received_snapshot(self):
+        # name of the snapshot of the last stream received, None if there is
+        # none. It is the one to sync --since when a stream was lost
+        names = self.send_snapshot_names()
+        return names[-1] if names else None
+
+    @staticmethod
+    def receive(zfs_str, path_str, input, progress=None):
+        # rebuilds a manager sent by Manager.send() from the binary file
+        # object input at zfs_str, with its active clone at path_str, or
+        # updates it with an incremental stream
+        try:
+            reader = StreamReader(input, progress)
+            header = reader.read_header()
+        except StreamError as e:
+            raise ZCMError(e.message)
+        if header is None or header.get('type') != 'manager':
+            raise ZCMError('The stream does not start with a ZCM manager')
+        if header['incremental'] and zfs_exists(zfs_str):
+            manager = Manager(zfs_str)
+            if manager.path != Path(path_str):
+                raise ZCMError('Manager %s is at path %s, not at %s' %
+                               (zfs_str, manager.path, path_str))
+            manager.receive_changes(header, reader)
+            return manager
+        path = Path(path_str)
+        if path.exists():
+            raise ZCMError('Path %s already exists, will not receive a manager' % path_str)
+        if zfs_exists(zfs_str):
+            raise ZCMError('ZFS %s already exists, will not receive a manager' % zfs_str)
+        try:
+            parent = zfs_str.rsplit('/', 1)[0]
+            if '/' in zfs_str and not zfs_exists(parent) and \
+                    zfs_create(parent, recursive=True) is None:
+                raise ZCMError('Can not create the parents of ZFS %s' % zfs_str)
+            while True:
+                dataset = reader.read_header()
+                if dataset is None:
+                    break
+                if dataset['from'] is not None and dataset['from'].startswith(dataset['name'] + '@'):
+                    if not zfs_exists(zfs_str + dataset['name']):
+                        raise ZCMError('The stream has only the changes since %s, '
+                                       'receive the whole manager first' % dataset['from'])
+                zfs_receive(zfs_str + dataset['name'], reader, unmounted=True)
+            active_clone = header['active_clone']
+            if active_clone is not None:
+                zfs_set('%s/%s' % (zfs_str, active_clone), mountpoint=path)
+                zfs_mount('%s/%s' % (zfs_str, active_clone))
+            zfs_set(zfs_str, mountpoint=Path(path, '.clones'), zcm_path=path_str)
+        except (ZFSError, StreamError) as e:
+            raise ZCMError(e.message)
+        manager = Manager(zfs_str)
+        if manager.active_clone is not None:
+            manager.mount(include_active=False)
+        manager.destroy_send_snapshots(keep=[header['snapshot']])
+        log.info('Received manager %s at path %s' % (zfs_str, path_str))
+        return manager
+
+    def receive_changes(self, header, reader):
+        # applies an incremental stream of send() read up to its first
+        # dataset, then activates and removes clones like the sender did
+        try:
+            dataset = reader.read_header()
+        except StreamError as e:
+            raise ZCMError(e.message)
+        # the root is sent first, a stream was lost if its base is missing
+        if dataset is not None and dataset['from'] is not None and \
+                not zfs_exists(self.zfs + dataset['from']):
+            received = self.received_snapshot()
+            if received is None:
+                raise ZCMError('Manager %s has no snapshot to apply the changes since %s, '
+                               'destroy it and receive a whole zcm send' %
+                               (self.zfs, dataset['from']))
+            raise ZCMError('The stream has the changes since %s, but the last one received by '
+                           'manager %s is %s, run zcm sync --since %s on the sender' %
+                           (dataset['from'], self.zfs, received, received))
+        self.unmount()
+        try:
+            while dataset is not None:
+                # the datasets that exist are rolled back to the last
+                # snapshot received, if they were changed
+                id = dataset['name'].lstrip('/')
+                exists = not id or id in self.clone_index
+                zfs_receive(self.zfs + dataset['name'], reader, unmounted=True,
+                            force=exists)
+                dataset = reader.read_header()
+        except (ZFSError, StreamError) as e:
+            raise ZCMError(e.message)
+        finally:
+            self.load()
+            self.mount()
+        if header['active_clone'] is not None and \
+                header['active_clone'] != self.active_clone.id:
+            self.activate(header['active_clone'])
+        for clone in list(self.clones):
+            if clone.id not in header['clones']:
+                self.remove(clone.id)
+        self.destroy_send_snapshots(keep=[header['snapshot']])
+        log.info('Received changes of manager %s' % self.zfs)
+
+    def to_zfs_list_output(self):
+        # the raw zfs list output of MANAGER_PROPERTIES that loads this
+        # manager, from the in memory state
+        path = str(self.path)
+        output = [{
+            'name': self.zfs,
+            'zfs_clone_manager:path': path,
+            'origin': '-',
+            'mountpoint': str(Path(self.path, '.clones')),
+            'creation': '-',
+            'used': str(self.size)
+        }]
+        for clone in self.clones:
+            output.append({
+                'name': clone.zfs,
+                'zfs_clone_manager:path': path,
+                'origin': clone.origin or '-',
+                'mountpoint': '-' if clone.mountpoint is None else str(clone.mountpoint),
+                'creation': str(int(clone.creation.timestamp())),
+                'used': str(clone.size)
+            })
+        return output
 
     def to_dictionary(self):
         return {
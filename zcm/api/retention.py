@@ -0,0 +1,237 @@
+# Copyright 2021, Guillermo Adrián Molina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Plans the removal of several clones at once. Removing a clone that has
+# clones of its own needs a zfs promote of one of them first, the plan
+# promotes only the clones that lead to a clone that is kept, then destroys
+# the removed clones in waves that can run concurrently.
+#
+# Origin snapshots are named after the id of the clone created from them,
+# so their names sort like their creation, which is the order zfs promote
+# uses to move snapshots.
+#
+# The clones to remove come from the max_newer, max_older and max_total
+# limits (plan_retention) or from a RetentionPolicy.
+
+import logging
+from datetime import datetime
+
+from zcm.exceptions import ZCMError
+
+log = logging.getLogger(__name__)
+
+# clone.creation -> period it belongs to, for the thinning rules
+PERIODS = {
+    'hourly': lambda creation: creation.strftime('%Y-%m-%d %H'),
+    'daily': lambda creation: creation.strftime('%Y-%m-%d'),
+    'weekly': lambda creation: creation.strftime('%G-%V')
+}
+
+
+def snapshot_name(snapshot):
+    return snapshot.split('@')[1]
+
+
+def snapshot_filesystem(snapshot):
+    return snapshot.split('@')[0]
+
+
+class RemovalPlan:
+    # ids       clones to remove
+    # promotes  clones to promote, in this order
+    # waves     [[clone, ...], ...], every wave is destroyed concurrently
+    #           after the previous one, clones of a snapshot go first
+    # snapshots origin snapshots left in the kept clones, destroyed last
+    # origins   {zfs: origin} of the kept clones whose origin changes
+    def __init__(self, ids, promotes, waves, snapshots, origins):
+        self.ids = ids
+        self.promotes = promotes
+        self.waves = waves
+        self.snapshots = snapshots
+        self.origins = origins
+
+    def __len__(self):
+        return len(self.ids)
+
+    def to_dictionary(self):
+        return {
+            'remove': self.ids,
+            'promote': self.promotes,
+            'destroy': self.waves,
+            'destroy_snapshots': self.snapshots
+        }
+
+    def describe(self):
+        # lines of a dry run report
+        lines = ['Remove %d clones: %s' % (len(self.ids), ' '.join(self.ids))]
+        lines += ['Promote %s' % zfs for zfs in self.promotes]
+        lines += ['Destroy %s' % ' '.join(wave) for wave in self.waves]
+        if self.snapshots:
+            lines.append('Destroy %s' % ' '.join(self.snapshots))
+        return lines
+
+
+def plan_removal(clones, ids):
+    # clones -> Clone list of a manager, ids -> ids of the clones to remove
+    removed = {clone.zfs for clone in clones if clone.id in ids}
+    origins = {clone.zfs: clone.origin for clone in clones}
+    children = {clone.zfs: set() for clone in clones}
+    for zfs, origin in origins.items():
+        if origin is not None and snapshot_filesystem(origin) in children:
+            children[snapshot_filesystem(origin)].add(zfs)
+
+    def keeps(zfs):
+        # True if zfs or any clone of it, at any depth, is kept
+        pending = [zfs]
+        while pending:
+            current = pending.pop()
+            if current not in removed:
+                return True
+            pending.extend(children[current])
+        return False
+
+    def move(zfs, source, target):
+        # the origin snapshot of zfs moves from source to target
+        origins[zfs] = '%s@%s' % (target, snapshot_name(origins[zfs]))
+        children[source].discard(zfs)
+        children[target].add(zfs)
+
+    promotes = []
+    for zfs in sorted(removed):
+        candidates = [child for child in children[zfs] if keeps(child)]
+        if not candidates:
+            continue
+        # like zfs promote, the snapshots up to the origin of the promoted
+        # clone move to it, with their clones, and it takes the origin
+        promoted = max(candidates, key=lambda child: snapshot_name(origins[child]))
+        promoted_origin = snapshot_name(origins[promoted])
+        for child in list(children[zfs]):
+            if child != promoted and snapshot_name(origins[child]) <= promoted_origin:
+                move(child, zfs, promoted)
+        origin = origins[zfs]
+        if origin is not None and snapshot_filesystem(origin) in children:
+            children[snapshot_filesystem(origin)].discard(zfs)
+            children[snapshot_filesystem(origin)].add(promoted)
+        children[zfs].discard(promoted)
+        children[promoted].add(zfs)
+        origins[zfs] = '%s@%s' % (promoted, promoted_origin)
+        origins[promoted] = origin
+        promotes.append(promoted)
+
+    waves = []
+    pending = set(removed)
+    while pending:
+        wave = sorted(zfs for zfs in pending if not children[zfs] & pending)
+        waves.append(wave)
+        pending.difference_update(wave)
+
+    # the origins of the removed clones, unless they go with a removed
+    # clone or a kept clone shares them
+    kept_origins = {origins[zfs] for zfs in origins if zfs not in removed}
+    snapshots = sorted({origins[zfs] for zfs in removed
+                        if origins[zfs] is not None and
+                        snapshot_filesystem(origins[zfs]) not in removed and
+                        origins[zfs] not in kept_origins})
+    changed = {clone.zfs: origins[clone.zfs] for clone in clones
+               if clone.zfs not in removed and origins[clone.zfs] != clone.origin}
+    return RemovalPlan([clone.id for clone in clones if clone.id in ids],
+                       promotes, waves, snapshots, changed)
+
+
+def plan_retention(older_clones, newer_clones, active_clone, max_newer=None,
+                   max_older=None, max_total=None):
+    # ids of the oldest older and newer clones over the limits, like removing
+    # them one by one: older first, then newer, then any to reach max_total
+    older = [clone.id for clone in older_clones]
+    newer = [clone.id for clone in newer_clones]
+    ids = []
+    if max_older is not None and len(older) > max_older:
+        ids += older[:len(older) - max_older]
+        older = older[len(older) - max_older:]
+    if max_newer is not None and len(newer) > max_newer:
+        ids += newer[:len(newer) - max_newer]
+        newer = newer[len(newer) - max_newer:]
+    if max_total is not None:
+        excess = len(older) + len(newer) + (active_clone is not None) - max_total
+        for clones in [older, newer]:
+            count = max(0, min(excess, len(clones)))
+            ids += clones[:count]
+            excess -= count
+        if excess > 0:
+            raise ZCMError('There are no more clones to remove in order to '
+                           'satisfy max limit of %d' % max_total)
+    return ids
+
+
+class RetentionPolicy:
+    # a clone is kept if any of the keep rules keeps it, with no keep rules
+    # every clone is kept. Then the oldest clones are removed until the
+    # used space of the rest is under max_used. The active clone is kept.
+    #   keep_last    the newest keep_last clones
+    #   keep_within  the clones newer than now - keep_within, a timedelta
+    #   keep_hourly, keep_daily, keep_weekly
+    #                the newest clone of each of the last periods with clones
+    #   max_used     bytes, the sum of the used property of the clones
+    def __init__(self, keep_last=None, keep_within=None, keep_hourly=None,
+                 keep_daily=None, keep_weekly=None, max_used=None):
+        self.keep_last = keep_last
+        self.keep_within = keep_within
+        self.periods = {'hourly': keep_hourly, 'daily': keep_daily,
+                        'weekly': keep_weekly}
+        self.max_used = max_used
+
+    def has_keep_rules(self):
+        return self.keep_last is not None or self.keep_within is not None or \
+            any(count is not None for count in self.periods.values())
+
+    def keeps(self, clones, now):
+        # clones -> newest first, yields the clones kept by the keep rules
+        periods = {period: set() for period, count in self.periods.items()
+                   if count is not None}
+        for position, clone in enumerate(clones):
+            kept = self.keep_last is not None and position < self.keep_last
+            kept = kept or (self.keep_within is not None and
+                            now - clone.creation <= self.keep_within)
+            for period, seen in periods.items():
+                key = PERIODS[period](clone.creation)
+                if key not in seen and len(seen) < self.periods[period]:
+                    seen.add(key)
+                    kept = True
+            if kept:
+                yield clone
+
+    def select(self, clones, active_clone, now=None):
+        # ids of the clones to remove, in the order of clones
+        if now is None:
+            now = datetime.now()
+        newest_first = sorted(clones, key=lambda clone: (clone.creation, clone.id),
+                              reverse=True)
+        if self.has_keep_rules():
+            kept = set(clone.id for clone in self.keeps(newest_first, now))
+        else:
+            kept = set(clone.id for clone in clones)
+        if active_clone is not None:
+            kept.add(active_clone.id)
+        if self.max_used is not None:
+            used = sum(clone.size for clone in clones if clone.id in kept)
+            for clone in reversed(newest_first):
+                if used <= self.max_used:
+                    break
+                if clone.id in kept and clone is not active_clone:
+                    kept.discard(clone.id)
+                    used -= clone.size
+            if used > self.max_used:
+                log.warning('The clones that are left use %d bytes, over the budget of %d' %
+                            (used, self.max_used))
+        return [clone.id for clone in clones if clone.id not in kept]
@@ -22,6 +22,7 @@ from zcm.lib.helpers import check_one_or_more, check_positive
 class Activate:
     name = 'activate'
     aliases = []
+    uses_daemon = True
 
     @staticmethod
     def init_parser(parent_subparsers):
@@ -51,8 +52,15 @@ class Activate:
                             help='clone id to activate')
 
     def __init__(self, options):
-        manager = Manager(options.path)
-        manager.activate(options.id, options.max_newer,
-                                 options.max_older, options.max_total, options.auto_remove)
+        if getattr(options, 'client', None) is not None:
+            options.client.request('activate', path=options.path, id=options.id,
+                                   max_newer=options.max_newer,
+                                   max_older=options.max_older,
+                                   max_total=options.max_total,
+                                   auto_remove=options.auto_remove)
+        else:
+            manager = Manager(options.path)
+            manager.activate(options.id, options.max_newer,
+                             options.max_older, options.max_total, options.auto_remove)
         if not options.quiet:
             print('Activated clone ' + options.id)
@@ -17,12 +17,15 @@ import argparse
 import json
 
 from zcm.api.manager import Manager
+from zcm.cli.list import load_managers
+from zcm.exceptions import ZCMError
 from zcm.lib.helpers import check_one_or_more
 
 
 class Clone:
     name = 'clone'
     aliases = []
+    uses_daemon = True
 
     @staticmethod
     def init_parser(parent_subparsers):
@@ -45,17 +48,56 @@ class Clone:
         parser.add_argument('-a', '--auto-remove',
                             action='store_true',
                             help='Remove clones if maximum limits excedeed')
+        parser.add_argument('-A', '--all',
+                            action='store_true',
+                            help='Clone every ZCM, snapshotting the ones in a pool at once')
         parser.add_argument('path',
+                            nargs='*',
                             metavar='filesystem|path',
-                            help='zfs filesystem or path of ZCM')
+                            help='zfs filesystem or path of ZCM, several ones are '
+                            'snapshotted at once')
 
     def __init__(self, options):
-        manager = Manager(options.path)
-        clone = manager.clone(
-            options.max_newer, options.max_total, options.auto_remove)
+        if options.all or len(options.path) > 1:
+            Clone.clone_many(options)
+            return
+        if not options.path:
+            raise ZCMError('A ZCM filesystem or path, or --all, is required')
+        options.path = options.path[0]
+        if getattr(options, 'client', None) is not None:
+            clone = options.client.request('clone', path=options.path,
+                                           max_newer=options.max_newer,
+                                           max_total=options.max_total,
+                                           auto_remove=options.auto_remove)
+        else:
+            manager = Manager(options.path)
+            clone = manager.clone(
+                options.max_newer, options.max_total, options.auto_remove).to_dictionary()
         if not options.quiet:
             if options.json:
-                print(json.dumps(clone.to_dictionary(), indent=4))
+                print(json.dumps(clone, indent=4))
             else:
                 print('Created clone %s at path %s' %
-                    (clone.id, clone.mountpoint))
+                    (clone['id'], clone['mountpoint']))
+
+    @staticmethod
+    def clone_many(options):
+        if options.all:
+            managers = Manager.get_managers()
+        else:
+            managers, errors = load_managers(options.path)
+            if errors:
+                raise ZCMError('\n'.join(error.message for error in errors))
+        try:
+            clones = Manager.clone_many(managers, options.max_newer, options.max_total,
+                                        options.auto_remove)
+        finally:
+            # zcmd does not know about these clones
+            if getattr(options, 'client', None) is not None:
+                options.client.request('refresh')
+        if not options.quiet:
+            if options.json:
+                print(json.dumps([clone.to_dictionary() for clone in clones], indent=4))
+            else:
+                for clone in clones:
+                    print('Created clone %s at path %s' % (clone.id, clone.mountpoint))
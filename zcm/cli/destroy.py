@@ -14,6 +14,7 @@
 
 
 import argparse
+import sys
 
 from zcm.api.manager import Manager
 
@@ -44,6 +45,9 @@ class Destroy:
         parser.add_argument('-F', '--force',
                             help='Force destroy without confirmation',
                             action='store_true')
+        parser.add_argument('-p', '--progress',
+                            help='Report the progress to the standard error',
+                            action='store_true')
         parser.add_argument('path',
                             metavar='filesystem|path',
                             nargs='+',
@@ -53,6 +57,14 @@ class Destroy:
         managers = [ Manager(path) for path in options.path ]
         for manager in managers:
             if are_you_sure(options.force, manager):
-                manager.destroy()
+                report = None
+                if options.progress:
+                    report = lambda phase, done, total: print(
+                        '%s: %s %d/%d' % (manager.zfs, phase, done, total), file=sys.stderr)
+                manager.destroy(report)
+                if options.progress:
+                    print('%s: %s' % (manager.zfs, ', '.join(
+                        '%s %.1fs' % item for item in manager.destroy_timing.items())),
+                        file=sys.stderr)
                 if not options.quiet:
                     print('Destroyed ZCM %s' % manager.zfs)
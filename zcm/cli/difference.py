@@ -16,8 +16,8 @@
 import argparse
 
 from zcm.api.manager import Manager
-from zcm.lib.print import print_table
-from zcm.lib.zfs import zfs_diff
+from zcm.lib.helpers import check_positive
+from zcm.lib.print import print_info, print_table
 
 
 class Difference:
@@ -32,7 +32,7 @@ class Difference:
                                               aliases=Difference.aliases,
                                               formatter_class=argparse.ArgumentDefaultsHelpFormatter,
                                               description='Gives a high-level description of the differences between\
-                                                  a clone and its origin',
+                                                  a clone and its origin, or between two clones or snapshots',
                                               help='Differencies between a clone and its origin')
         parser.add_argument('-T', '--no-trunc',
                             help='Don\'t truncate output',
@@ -45,18 +45,51 @@ class Difference:
                                 Enter 0 to avoid pagination',
                             type=int,
                             default=25)
+        parser.add_argument('-w', '--workers',
+                            help='Parse the zfs diff output in <workers> processes. Enter 0 to parse it in zcm',
+                            type=int,
+                            default=0)
+        parser.add_argument('-o', '--origin',
+                            help='Clone id or snapshot to compare with, a clone id stands for its newest snapshot.\
+                                By default the origin of the clone')
+        parser.add_argument('-C', '--no-cache',
+                            help='Don\'t use the cached differences between two snapshots',
+                            action='store_true')
+        parser.add_argument('-s', '--summary',
+                            help='Only show the count of changes by change type, file type and directory',
+                            action='store_true')
+        parser.add_argument('-n', '--top',
+                            help='With --summary, show the <top> directories with more changes',
+                            type=check_positive,
+                            default=10)
         parser.add_argument('path',
                             metavar='filesystem|path',
                             help='zfs filesystem or path of ZCM')
         parser.add_argument('id',
                             nargs='?',
-                            help='clone id',
+                            help='clone id or snapshot',
                             default='active')
 
     def __init__(self, options):
         manager = Manager(options.path)
         id = manager.active_clone.id if options.id == 'active' else options.id
-        clone = manager.get_clone(id)
-        table = zfs_diff(clone.zfs, clone.origin, include_file_types=True)
+        if options.summary:
+            summary = manager.diff_summary(id, origin=options.origin,
+                                           top=options.top, workers=options.workers,
+                                           cache=(not options.no_cache))
+            data = {'Total changes': summary['total']}
+            data.update(summary['changes'])
+            for file_type, count in summary['file_types'].items():
+                data['File type ' + file_type] = count
+            print_info(data)
+            table = [{'directory': directory, 'changes': count}
+                     for directory, count in summary['directories']]
+            if table:
+                print()
+                print_table(table, header=(not options.no_header), truncate=(
+                    not options.no_trunc), page_size=0)
+            return
+        table = manager.diff(id, origin=options.origin, workers=options.workers,
+                             cache=(not options.no_cache))
         print_table(table, header=(not options.no_header), truncate=(
             not options.no_trunc), page_size=options.page_size)
@@ -15,12 +15,15 @@
 import argparse
 
 from zcm.api import Manager
+from zcm.cli.list import load_managers
+from zcm.exceptions import ZCMError
 from zcm.lib.print import format_bytes, print_info, print_table
 
 
 class Information:
     name = 'information'
     aliases = ['info']
+    uses_daemon = True
 
     @staticmethod
     def init_parser(parent_subparsers):
@@ -41,8 +44,11 @@ class Information:
 
     def __init__(self, options):
         managers = []
-        if options.path:
-            managers = [ Manager(path) for path in options.path ]
+        errors = []
+        if getattr(options, 'client', None) is not None:
+            managers = options.client.managers(options.path)
+        elif options.path:
+            managers, errors = load_managers(options.path)
         else:
             managers = Manager.get_managers()
         if options.table:
@@ -77,3 +83,5 @@ class Information:
                 }
                 print_info(data)
                 print()
+        if errors:
+            raise ZCMError('\n'.join(error.message for error in errors))
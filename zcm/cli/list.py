@@ -13,15 +13,30 @@
 # limitations under the License.
 
 import argparse
-import json
 
 from zcm.api.manager import Manager
-from zcm.lib.print import format_bytes, print_table
+from zcm.exceptions import ZCMError, ZCMException
+from zcm.lib.print import (format_bytes, print_json_lines, print_json_list,
+                           print_table)
+
+
+def load_managers(paths):
+    # returns the managers of paths, loaded concurrently, and the errors of
+    # the ones that could not be loaded
+    managers = []
+    errors = []
+    for manager in Manager.load_many(paths):
+        if isinstance(manager, ZCMException):
+            errors.append(manager)
+        else:
+            managers.append(manager)
+    return managers, errors
 
 
 class List:
     name = 'list'
     aliases = ['ls']
+    uses_daemon = True
 
     @staticmethod
     def init_parser(parent_subparsers):
@@ -35,6 +50,9 @@ class List:
         parser.add_argument('-j', '--json',
                             action='store_true',
                             help='Output a JSON object')
+        parser.add_argument('-J', '--json-lines',
+                            action='store_true',
+                            help='Output a JSON object per clone and line')
         parser.add_argument('-T', '--no-trunc',
                             help='Don\'t truncate output',
                             action='store_true')
@@ -52,30 +70,33 @@ class List:
                             help='zfs filesystem or path to show')
 
     def __init__(self, options):
-        table = []
-        managers = []
-        if options.path:
-            managers = [Manager(path) for path in options.path]
+        # managers, clones and rows are generated while they are printed
+        errors = []
+        if getattr(options, 'client', None) is not None:
+            managers = options.client.managers(options.path)
+        elif options.path:
+            managers, errors = load_managers(options.path)
         else:
-            managers = Manager.get_managers()
-        if options.json:
-            clones = []
-            for manager in managers:
-                for clone in manager.clones:
-                    clones.append(clone.to_dictionary())
-            print(json.dumps(clones, indent=4))
+            managers = Manager.iter_managers()
+        if options.json or options.json_lines:
+            clones = (clone.to_dictionary()
+                      for manager in managers for clone in manager.clones)
+            if options.json_lines:
+                print_json_lines(clones)
+            else:
+                print_json_list(clones)
         else:
-            for manager in managers:
-                for clone in manager.clones:
-                    table.append({
-                        'manager': manager.zfs,
-                        'a': '*' if manager.active_clone == clone else ' ',
-                        'id': clone.id,
-                        'clone': clone.zfs,
-                        'mountpoint': str(clone.mountpoint),
-                        'origin': clone.origin_id if clone.origin_id else '',
-                        'date': clone.creation,
-                        'size': format_bytes(clone.size)
-                    })
+            table = ({
+                'manager': manager.zfs,
+                'a': '*' if manager.active_clone == clone else ' ',
+                'id': clone.id,
+                'clone': clone.zfs,
+                'mountpoint': str(clone.mountpoint),
+                'origin': clone.origin_id if clone.origin_id else '',
+                'date': clone.creation,
+                'size': format_bytes(clone.size)
+            } for manager in managers for clone in manager.clones)
             print_table(table, header=(not options.no_header), truncate=(
                 not options.no_trunc), page_size=options.page_size)
+        if errors:
+            raise ZCMError('\n'.join(error.message for error in errors))
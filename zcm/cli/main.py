@@ -15,16 +15,9 @@
 
 import argparse
 import logging
+import sys
 
 from zcm import __version__
-from zcm.cli.activate import Activate
-from zcm.cli.clone import Clone
-from zcm.cli.destroy import Destroy
-from zcm.cli.difference import Difference
-from zcm.cli.information import Information
-from zcm.cli.initialize import Initialize
-from zcm.cli.list import List
-from zcm.cli.remove import Remove
 from zcm.exceptions import ZCMException
 
 log = logging.getLogger(__name__)
@@ -49,8 +42,63 @@ class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter,
     pass
 
 
+class LazyCommand:
+    # name, aliases and help of a command, the module that implements it is
+    # only imported when the command is run
+    def __init__(self, name, aliases, help, module, class_name):
+        self.name = name
+        self.aliases = aliases
+        self.help = help
+        self.module = module
+        self.class_name = class_name
+
+    def is_named(self, name):
+        return name == self.name or name in self.aliases
+
+    def load(self):
+        # __import__() instead of importlib, python -X importtime only
+        # reports the imports made through it
+        return getattr(__import__(self.module, fromlist=[self.class_name]), self.class_name)
+
+
+def select_command(commands, arguments):
+    # the command is the first argument named like one, but the value of
+    # -l/--log-level (info is a command alias too)
+    skip = False
+    for argument in arguments:
+        if skip:
+            skip = False
+            continue
+        if argument == '-l' or (len(argument) > 2 and '--log-level'.startswith(argument)):
+            skip = True
+            continue
+        for command in commands:
+            if command.is_named(argument):
+                return command
+    return None
+
+
 class CLI:
-    commands = [Initialize, Information, List, Clone, Activate, Difference, Remove, Destroy]
+    commands = [
+        LazyCommand('initialize', ['init'], 'Init ZCM on specified ZFS',
+                    'zcm.cli.initialize', 'Initialize'),
+        LazyCommand('information', ['info'], 'Show ZCM information',
+                    'zcm.cli.information', 'Information'),
+        LazyCommand('list', ['ls'], 'List clones', 'zcm.cli.list', 'List'),
+        LazyCommand('clone', [], 'Create a new clone', 'zcm.cli.clone', 'Clone'),
+        LazyCommand('activate', [], 'activate an clone', 'zcm.cli.activate', 'Activate'),
+        LazyCommand('difference', ['diff'], 'Differencies between a clone and its origin',
+                    'zcm.cli.difference', 'Difference'),
+        LazyCommand('remove', ['rm'], 'Remove one or more clones', 'zcm.cli.remove', 'Remove'),
+        LazyCommand('prune', [], 'Remove the clones over the retention limits',
+                    'zcm.cli.prune', 'Prune'),
+        LazyCommand('destroy', [], 'Remove all ZCM metadata (filesystems, clones, snapshots '
+                    'and directories) associated with path', 'zcm.cli.destroy', 'Destroy'),
+        LazyCommand('send', [], 'Stream a manager', 'zcm.cli.send', 'Send'),
+        LazyCommand('sync', [], 'Stream the changes of a manager', 'zcm.cli.sync', 'Sync'),
+        LazyCommand('receive', ['recv'], 'Rebuild a manager from a stream',
+                    'zcm.cli.receive', 'Receive')
+    ]
 
     def __init__(self):
         parser = argparse.ArgumentParser(
@@ -78,14 +126,24 @@ class CLI:
         parser.add_argument('-q', '--quiet',
                             help='Enable quiet mode',
                             action='store_true')
+        parser.add_argument('-N', '--no-daemon',
+                            help='Do not use zcmd even if it is running',
+                            action='store_true')
 
         subparsers = parser.add_subparsers(
             dest='command',
             metavar='COMMAND',
             required=True)
 
+        # only the command that runs is imported and gets its arguments,
+        # the rest are listed in the help
+        selected = select_command(CLI.commands, sys.argv[1:])
         for command in CLI.commands:
-            command.init_parser(subparsers)
+            if command is selected:
+                command.load().init_parser(subparsers)
+            else:
+                subparsers.add_parser(command.name, aliases=command.aliases,
+                                      help=command.help)
 
         options = parser.parse_args()
 
@@ -97,15 +155,24 @@ class CLI:
             log.info("Waiting for IDE to attach...")
             debugpy.wait_for_client()
 
+        # list, info, clone and activate are served by zcmd when it runs,
+        # it reloads its managers after any other command
+        command = next(command for command in CLI.commands
+                       if command.is_named(options.command)).load()
+        from zcm.daemon.client import connect
+        options.client = None if options.no_daemon else connect()
         try:
-            for command in self.commands:
-                if options.command == command.name or options.command in command.aliases:
-                    command(options)
-                    break
+            command(options)
+            if options.client is not None and \
+                    not getattr(command, 'uses_daemon', False):
+                options.client.request('refresh')
         except ZCMException as e:
             log.error(e.message)
             print(e.message)
             exit(-1)
+        finally:
+            if options.client is not None:
+                options.client.close()
 
 
 def main():
@@ -0,0 +1,98 @@
+# Copyright 2021, Guillermo Adrián Molina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+
+from zcm.api.manager import Manager
+from zcm.api.retention import RetentionPolicy
+from zcm.lib.helpers import (check_duration, check_one_or_more,
+                             check_positive, check_size)
+
+
+class Prune:
+    name = 'prune'
+    aliases = []
+
+    @staticmethod
+    def init_parser(parent_subparsers):
+        parent_parser = argparse.ArgumentParser(add_help=False)
+        parser = parent_subparsers.add_parser(Prune.name,
+                                              parents=[parent_parser],
+                                              aliases=Prune.aliases,
+                                              formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                              description='Remove the oldest clones over the maximum limits\
+                                                  and the clones no keep rule keeps, all at once',
+                                              help='Remove the clones over the retention limits')
+        parser.add_argument('-m', '--max-newer',
+                            type=check_positive,
+                            help='Keep at most <max-newer> newer clones')
+        parser.add_argument('-M', '--max-older',
+                            type=check_positive,
+                            help='Keep at most <max-older> older clones')
+        parser.add_argument('-t', '--max-total',
+                            type=check_one_or_more,
+                            help='Keep at most <max-total> clones')
+        parser.add_argument('-k', '--keep-last',
+                            type=check_one_or_more,
+                            help='Keep the newest <keep-last> clones')
+        parser.add_argument('-w', '--keep-within',
+                            type=check_duration,
+                            help='Keep the clones created within <keep-within>, like 12h, 30d or 2w')
+        parser.add_argument('-H', '--keep-hourly',
+                            type=check_one_or_more,
+                            help='Keep the newest clone of each of the last <keep-hourly> hours')
+        parser.add_argument('-d', '--keep-daily',
+                            type=check_one_or_more,
+                            help='Keep the newest clone of each of the last <keep-daily> days')
+        parser.add_argument('-W', '--keep-weekly',
+                            type=check_one_or_more,
+                            help='Keep the newest clone of each of the last <keep-weekly> weeks')
+        parser.add_argument('-u', '--max-used',
+                            type=check_size,
+                            help='Remove the oldest clones until they use less than <max-used>, like 10G')
+        parser.add_argument('-n', '--dry-run',
+                            help='Print what would be done, do not remove anything',
+                            action='store_true')
+        parser.add_argument('-F', '--force',
+                            help='Remove the clones without confirmation',
+                            action='store_true')
+        parser.add_argument('path',
+                            metavar='filesystem|path',
+                            help='zfs filesystem or path of ZCM')
+
+    def __init__(self, options):
+        manager = Manager(options.path)
+        policy = RetentionPolicy(options.keep_last, options.keep_within,
+                                 options.keep_hourly, options.keep_daily,
+                                 options.keep_weekly, options.max_used)
+        plan = manager.plan_retention(options.max_newer, options.max_older,
+                                      options.max_total, policy)
+        if not plan:
+            if not options.quiet:
+                print('There are no clones to remove')
+            return
+        if options.dry_run:
+            for line in plan.describe():
+                print(line)
+            return
+        if not options.force:
+            print('WARNING!!!!!!!!')
+            print('All the filesystems, snapshots and directories associated with clones %s will be permanently deleted.' %
+                  ', '.join(plan.ids))
+            print('This operation is not reversible.')
+            if input('Do you want to proceed? (yes/NO) ') != 'yes':
+                return
+        manager.execute_removal(plan)
+        if not options.quiet:
+            print('Removed clones ' + ' '.join(plan.ids))
@@ -0,0 +1,62 @@
+# Copyright 2021, Guillermo Adrián Molina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import sys
+
+from zcm.api.manager import Manager
+from zcm.lib.print import format_bytes, print_progress
+from zcm.lib.stream import Progress
+
+
+class Receive:
+    name = 'receive'
+    aliases = ['recv']
+
+    @staticmethod
+    def init_parser(parent_subparsers):
+        parent_parser = argparse.ArgumentParser(add_help=False)
+        parser = parent_subparsers.add_parser(Receive.name,
+                                              parents=[parent_parser],
+                                              aliases=Receive.aliases,
+                                              formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                              description='Rebuild a manager from a stream made by zcm send',
+                                              help='Rebuild a manager from a stream')
+        parser.add_argument('-i', '--input',
+                            help='Read the stream from <input> instead of the standard input')
+        parser.add_argument('-p', '--progress',
+                            help='Report the progress to the standard error',
+                            action='store_true')
+        parser.add_argument('zfs',
+                            metavar='filesystem',
+                            help='root ZFS filesystem for manager')
+        parser.add_argument('path',
+                            help='path to use for active clone')
+
+    def __init__(self, options):
+        progress = Progress()
+        if options.progress:
+            progress.report = lambda progress: print_progress(options.zfs, progress)
+        if options.input is None:
+            manager = Manager.receive(options.zfs, options.path, sys.stdin.buffer,
+                                      progress)
+        else:
+            with open(options.input, 'rb') as input:
+                manager = Manager.receive(options.zfs, options.path, input, progress)
+        if options.progress:
+            print('Received %s in %.1fs' % (format_bytes(progress.total),
+                                             progress.total_elapsed), file=sys.stderr)
+        if not options.quiet:
+            print('ZCM received ZFS %s at path %s with %d clones' %
+                  (manager.zfs, manager.path, len(manager.clones)))
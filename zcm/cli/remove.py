@@ -18,11 +18,15 @@ import argparse
 from zcm.api.manager import Manager
 
 
-def are_you_sure(force, id):
+def are_you_sure(force, ids):
     if force:
         return True
     print('WARNING!!!!!!!!')
-    print('All the filesystems, snapshots and directories associated with clone %s will be permanently deleted.' % id)
+    if len(ids) == 1:
+        print('All the filesystems, snapshots and directories associated with clone %s will be permanently deleted.' % ids[0])
+    else:
+        print('All the filesystems, snapshots and directories associated with %d clones (%s) will be permanently deleted.' %
+              (len(ids), ', '.join(ids)))
     print('This operation is not reversible.')
     answer = input('Do you want to proceed? (yes/NO) ')
     return answer == 'yes'
@@ -39,22 +43,31 @@ class Remove:
                                               parents=[parent_parser],
                                               aliases=Remove.aliases,
                                               formatter_class=argparse.ArgumentDefaultsHelpFormatter,
-                                              description='Remove one or more clones',
+                                              description='Remove one or more clones, all at once',
                                               help='Remove one or more clones')
         parser.add_argument('-F', '--force',
                             help='Force remove clone without confirmation',
                             action='store_true')
+        parser.add_argument('-n', '--dry-run',
+                            help='Print what would be done, do not remove anything',
+                            action='store_true')
         parser.add_argument('path',
                             metavar='filesystem|path',
                             help='zfs filesystem or path of ZCM')
         parser.add_argument('id',
                             nargs='+',
-                            help='ID of the clone to remove')
+                            help='ID of the clone to remove, a range like 00000001-0000000a \
+                                or a glob like "0000000*", ranges and globs skip the active clone')
 
     def __init__(self, options):
         manager = Manager(options.path)
-        for id in options.id:
-            if are_you_sure(options.force, id):
-                manager.remove(id)
-                if not options.quiet:
+        plan = manager.plan_removal(manager.match_ids(options.id))
+        if options.dry_run:
+            for line in plan.describe():
+                print(line)
+            return
+        if are_you_sure(options.force, plan.ids):
+            manager.execute_removal(plan)
+            if not options.quiet:
+                for id in plan.ids:
                     print('Removed clone ' + id)
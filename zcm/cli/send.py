@@ -0,0 +1,68 @@
+# Copyright 2021, Guillermo Adrián Molina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import sys
+
+from zcm.api.manager import Manager
+from zcm.exceptions import ZCMError
+from zcm.lib.print import format_bytes, print_progress
+from zcm.lib.stream import COMPRESSIONS, Progress
+
+
+class Send:
+    name = 'send'
+    aliases = []
+
+    @staticmethod
+    def init_parser(parent_subparsers):
+        parent_parser = argparse.ArgumentParser(add_help=False)
+        parser = parent_subparsers.add_parser(Send.name,
+                                              parents=[parent_parser],
+                                              aliases=Send.aliases,
+                                              formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                              description='Stream the root and every clone of a manager,\
+                                                  to be rebuilt with zcm receive',
+                                              help='Stream a manager')
+        Send.add_arguments(parser)
+
+    @staticmethod
+    def add_arguments(parser):
+        parser.add_argument('-o', '--output',
+                            help='Write the stream to <output> instead of the standard output')
+        parser.add_argument('-c', '--compress',
+                            choices=list(COMPRESSIONS),
+                            help='Compress the stream')
+        parser.add_argument('-p', '--progress',
+                            help='Report the progress to the standard error',
+                            action='store_true')
+        parser.add_argument('path',
+                            metavar='filesystem|path',
+                            help='zfs filesystem or path of ZCM')
+
+    def __init__(self, options, incremental=False, since=None):
+        manager = Manager(options.path)
+        if options.output is None and sys.stdout.isatty():
+            raise ZCMError('Will not write a stream to a terminal, use --output')
+        progress = Progress()
+        if options.progress:
+            progress.report = lambda progress: print_progress(manager.zfs, progress)
+        if options.output is None:
+            manager.send(sys.stdout.buffer, options.compress, progress, incremental, since)
+        else:
+            with open(options.output, 'wb') as output:
+                manager.send(output, options.compress, progress, incremental, since)
+        if options.progress:
+            print('Sent %s in %.1fs' % (format_bytes(progress.total),
+                                         progress.total_elapsed), file=sys.stderr)
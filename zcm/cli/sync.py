@@ -0,0 +1,40 @@
+# Copyright 2021, Guillermo Adrián Molina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+
+from zcm.cli.send import Send
+
+
+class Sync:
+    name = 'sync'
+    aliases = []
+
+    @staticmethod
+    def init_parser(parent_subparsers):
+        parent_parser = argparse.ArgumentParser(add_help=False)
+        parser = parent_subparsers.add_parser(Sync.name,
+                                              parents=[parent_parser],
+                                              aliases=Sync.aliases,
+                                              formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                              description='Stream the changes of a manager since its last\
+                                                  zcm send or zcm sync, to be applied with zcm receive',
+                                              help='Stream the changes of a manager')
+        parser.add_argument('-s', '--since',
+                            help='Send the changes since the zcm_send_ snapshot <since> instead of\
+                                the last one sent, the one zcm receive reports when a stream was lost')
+        Send.add_arguments(parser)
+
+    def __init__(self, options):
+        Send(options, incremental=True, since=options.since)
@@ -0,0 +1,93 @@
+# Copyright 2021, Guillermo Adrián Molina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Client of zcmd, see zcm.daemon.server for the protocol
+
+import json
+import logging
+import os
+import socket
+from pathlib import Path
+
+from zcm import zcm_config
+from zcm.api.manager import MANAGER_PROPERTIES, Manager
+from zcm.exceptions import ZCMError, ZCMException
+
+log = logging.getLogger(__name__)
+
+
+def resolve_path(path):
+    # zcmd runs in another directory, directories are sent as absolute
+    # paths like get_zcm_for_path() resolves them, zfs names as they are
+    if Path(path).is_dir():
+        return str(Path(path).absolute())
+    return path
+
+
+class Client:
+    def __init__(self, socket_path=None):
+        if socket_path is None:
+            socket_path = zcm_config['daemon_socket']
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.socket.connect(socket_path)
+        except OSError:
+            self.socket.close()
+            raise
+        self.file = self.socket.makefile('rwb')
+
+    def request(self, command, **arguments):
+        # returns the result of command, raises what zcmd raised
+        if arguments.get('path') is not None:
+            arguments['path'] = resolve_path(arguments['path'])
+        if arguments.get('paths'):
+            arguments['paths'] = [resolve_path(path) for path in arguments['paths']]
+        arguments['command'] = command
+        try:
+            self.file.write(json.dumps(arguments).encode('utf-8') + b'\n')
+            self.file.flush()
+            line = self.file.readline()
+        except OSError as e:
+            raise ZCMError('Could not talk to zcmd: %s' % e.strerror)
+        if not line:
+            raise ZCMError('zcmd closed the connection')
+        response = json.loads(line.decode('utf-8'))
+        if 'error' in response:
+            if response.get('fatal', True):
+                raise ZCMError(response['error'])
+            raise ZCMException(response['error'])
+        return response['result']
+
+    def managers(self, paths=None):
+        # Manager objects loaded from the state of zcmd, without zfs calls
+        return [Manager(rows[0][0], zfs_list_output=[dict(zip(MANAGER_PROPERTIES, row))
+                                                      for row in rows])
+                for rows in self.request('managers', paths=paths or [])]
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+
+def connect(socket_path=None):
+    # returns a Client if zcmd is running, None if not
+    if socket_path is None:
+        socket_path = zcm_config['daemon_socket']
+    if not os.path.exists(socket_path):
+        return None
+    try:
+        return Client(socket_path)
+    except OSError as e:
+        log.warning('Not using zcmd at %s: %s' % (socket_path, e.strerror))
+        return None
@@ -0,0 +1,65 @@
+# Copyright 2021, Guillermo Adrián Molina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import logging
+import signal
+
+from zcm import __version__, zcm_config
+from zcm.cli.main import set_log_level
+from zcm.daemon.server import Daemon
+from zcm.exceptions import ZCMException
+
+log = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Keep the ZCM managers in memory and serve zcm list, info, clone and\
+            activate over a Unix socket')
+    parser.add_argument('-V', '--version',
+                        help='Print version information and quit',
+                        action='version',
+                        version='%(prog)s version ' + __version__)
+    parser.add_argument('-l', '--log-level',
+                        help='Set the logging level ("debug"|"info"|"warn"|"error"|"fatal")',
+                        choices=['debug', 'info', 'warn', 'error', 'critical', 'none'],
+                        metavar='LOG_LEVEL',
+                        default='info')
+    parser.add_argument('-s', '--socket',
+                        help='Path of the Unix socket',
+                        default=zcm_config['daemon_socket'])
+    parser.add_argument('-r', '--refresh-interval',
+                        help='Reload the managers every <refresh-interval> seconds',
+                        type=float,
+                        default=zcm_config['daemon_refresh_interval'])
+    options = parser.parse_args()
+    set_log_level(options.log_level)
+    daemon = Daemon(options.socket, options.refresh_interval)
+    # the threads of the daemon inherit the mask, only sigwait() gets them
+    signal.pthread_sigmask(signal.SIG_BLOCK, [signal.SIGINT, signal.SIGTERM])
+    try:
+        daemon.start()
+    except (ZCMException, OSError) as e:
+        log.error(getattr(e, 'message', None) or str(e))
+        exit(-1)
+    try:
+        signal.sigwait([signal.SIGINT, signal.SIGTERM])
+    finally:
+        daemon.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+# Copyright 2021, Guillermo Adrián Molina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# zcmd keeps every manager in memory and serves them over a Unix socket.
+# The protocol is a JSON object per line in both directions:
+#   request   {"command": <command>, <argument>: <value>, ...}
+#   response  {"result": <result>} or {"error": <message>, "fatal": <bool>}
+# Commands:
+#   managers  paths -> [rows, ...], the raw zfs list rows of MANAGER_PROPERTIES
+#             of every manager, or only of paths (zfs filesystems or paths)
+#   clone     path, max_newer, max_total, auto_remove -> clone dictionary
+#   activate  path, id, max_newer, max_older, max_total, auto_remove -> id
+#   refresh   reloads every manager from a single zfs list
+#   ping      -> zcm version
+# The managers are reloaded every zcm_config['daemon_refresh_interval']
+# seconds, when a path is not known and when a client asks for it.
+
+import json
+import logging
+import os
+import socketserver
+import threading
+
+from zcm import __version__, zcm_config
+from zcm.api.manager import MANAGER_PROPERTIES, Manager
+from zcm.exceptions import ZCMError, ZCMException
+
+log = logging.getLogger(__name__)
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode('utf-8'))
+            except ValueError:
+                response = {'error': 'Invalid request', 'fatal': True}
+            else:
+                response = self.server.daemon.handle(request)
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class Daemon:
+    def __init__(self, socket_path=None, refresh_interval=None):
+        self.socket_path = socket_path or zcm_config['daemon_socket']
+        self.refresh_interval = refresh_interval or zcm_config['daemon_refresh_interval']
+        self.lock = threading.RLock()
+        self.managers = {}
+        self.paths = {}
+        self.server = None
+        self.stopped = threading.Event()
+        self.commands = {
+            'managers': self.get_managers,
+            'clone': self.clone,
+            'activate': self.activate,
+            'refresh': self.refresh,
+            'ping': lambda: __version__
+        }
+
+    def refresh(self):
+        # under the lock, a change is never published half done
+        with self.lock:
+            managers = Manager.get_managers()
+            self.managers = {manager.zfs: manager for manager in managers}
+            self.paths = {str(manager.path): manager for manager in managers}
+        log.debug('Refreshed %d managers' % len(managers))
+
+    def find(self, path):
+        # path -> zfs filesystem or absolute path of a manager, the clients
+        # send paths already resolved
+        with self.lock:
+            manager = self.managers.get(path) or self.paths.get(path)
+            if manager is None:
+                self.refresh()
+                manager = self.managers.get(path) or self.paths.get(path)
+        if manager is None:
+            raise ZCMError('There is no ZCM manager at %s' % path)
+        return manager
+
+    def forget(self, manager):
+        with self.lock:
+            self.managers.pop(manager.zfs, None)
+            self.paths.pop(str(manager.path), None)
+
+    def change(self, path, operation):
+        # runs operation(manager) on the manager reloaded from zfs, it could
+        # have been changed without zcmd. After a failure the manager is
+        # reloaded again, or forgotten if that fails too
+        with self.lock:
+            manager = self.find(path)
+            try:
+                manager.load()
+            except ZCMException:
+                self.forget(manager)
+                raise
+            try:
+                return operation(manager)
+            except Exception:
+                try:
+                    manager.load()
+                except ZCMException:
+                    self.forget(manager)
+                raise
+
+    def get_managers(self, paths=[]):
+        if paths:
+            managers = [self.find(path) for path in paths]
+        else:
+            with self.lock:
+                managers = sorted(self.managers.values(), key=lambda manager: manager.zfs)
+        with self.lock:
+            return [[[zfs[name] for name in MANAGER_PROPERTIES]
+                     for zfs in manager.to_zfs_list_output()] for manager in managers]
+
+    def clone(self, path, max_newer=None, max_total=None, auto_remove=False):
+        return self.change(path, lambda manager: manager.clone(
+            max_newer, max_total, auto_remove).to_dictionary())
+
+    def activate(self, path, id, max_newer=None, max_older=None, max_total=None,
+                 auto_remove=False):
+        return self.change(path, lambda manager: manager.activate(
+            id, max_newer, max_older, max_total, auto_remove).id)
+
+    def handle(self, request):
+        if not isinstance(request, dict):
+            return {'error': 'Invalid request, it must be a JSON object', 'fatal': True}
+        command = self.commands.get(request.pop('command', None))
+        if command is None:
+            return {'error': 'Unknown command', 'fatal': True}
+        try:
+            return {'result': command(**request)}
+        except ZCMError as e:
+            return {'error': e.message, 'fatal': True}
+        except ZCMException as e:
+            return {'error': e.message, 'fatal': False}
+        except TypeError as e:
+            return {'error': 'Invalid request: %s' % e, 'fatal': True}
+        except Exception as e:
+            log.exception('Request %s failed' % request)
+            return {'error': 'zcmd failed: %s' % e, 'fatal': True}
+
+    def refresh_loop(self):
+        while not self.stopped.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except ZCMException as e:
+                log.error('Could not refresh the managers: %s' % e.message)
+
+    def start(self):
+        # listens in background threads, returns once the socket is ready
+        self.refresh()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self.server = Server(self.socket_path, Handler)
+        self.server.daemon = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        threading.Thread(target=self.refresh_loop, daemon=True).start()
+        log.info('zcmd listening at %s' % self.socket_path)
+
+    def stop(self):
+        self.stopped.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
@@ -0,0 +1,180 @@
+# Copyright 2020, Guillermo Adrián Molina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# asyncio variant of the zfs commands of zcm.lib.zfs, for event loops that
+# run many managers at once. Commands run with asyncio.create_subprocess_exec
+# and are accounted like the ones of zcm.lib.executor. A cancelled command
+# (like by asyncio.wait_for()) kills its zfs process before propagating.
+# Arguments, parsing, zfs_cache and the steps of the operations (see
+# zcm.lib.zfs.run_steps()) are shared with zcm.lib.zfs.
+
+import asyncio
+import logging
+import subprocess
+import time
+
+from zcm import zcm_config
+from zcm.lib.executor import ExecutorStats
+from zcm.lib.zfs import (ZFSError, _check, check_many, get_cmd, invalidate,
+                         is_missing_error, mount_waves_steps, zfs_cache,
+                         zfs_get_arguments, zfs_get_parse, zfs_list_arguments,
+                         zfs_list_check)
+
+log = logging.getLogger(__name__)
+
+
+class AsyncExecutor:
+    # max_workers -> zfs processes running at once per run_many() call
+    # timeout -> seconds before a zfs process is killed and reported as
+    # failed, None waits forever
+    def __init__(self, max_workers=None, timeout=None):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.stats = ExecutorStats()
+
+    async def run(self, cmd):
+        # returns a subprocess.CompletedProcess with text stdout and stderr
+        start = time.perf_counter()
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        except OSError:
+            self.stats.record(cmd, time.perf_counter() - start, -1)
+            raise
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), self.timeout)
+        except BaseException as e:
+            # timed out or cancelled, zfs is not left running
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            self.stats.record(cmd, time.perf_counter() - start, -1)
+            if isinstance(e, asyncio.TimeoutError):
+                # failed like any other zfs command, so steps can undo it
+                return subprocess.CompletedProcess(
+                    cmd, -1, '', '%s timed out after %s seconds\n' % (' '.join(cmd), self.timeout))
+            raise
+        self.stats.record(cmd, time.perf_counter() - start, process.returncode)
+        return subprocess.CompletedProcess(cmd, process.returncode,
+                                           stdout.decode('utf-8'), stderr.decode('utf-8'))
+
+    async def run_many(self, cmds):
+        # results are returned in the same order as cmds
+        semaphore = asyncio.Semaphore(self.max_workers or zcm_config['max_workers'])
+
+        async def run(cmd):
+            async with semaphore:
+                return await self.run(cmd)
+
+        return await asyncio.gather(*[run(cmd) for cmd in cmds])
+
+
+_executor = None
+
+
+def get_async_executor():
+    global _executor
+    if _executor is None:
+        _executor = AsyncExecutor()
+    return _executor
+
+
+def set_async_executor(executor):
+    # returns the previous executor, so it can be restored
+    global _executor
+    previous = _executor
+    _executor = executor
+    return previous
+
+
+async def run_query(command, arguments):
+    # zcm.lib.zfs.run_query() without blocking
+    if not zfs_cache.enabled:
+        return await get_async_executor().run(get_cmd(command, arguments, None))
+    key = (command,) + tuple(arguments)
+    process = zfs_cache.get(key)
+    if process is None:
+        process = await get_async_executor().run(get_cmd(command, arguments, None))
+        if process.returncode == 0 or is_missing_error(process.stderr):
+            zfs_cache.put(key, process)
+    return process
+
+
+async def zfs(command, arguments=None, options=None):
+    cmd = get_cmd(command, arguments, options)
+    try:
+        return _check(await get_async_executor().run(cmd))
+    finally:
+        invalidate([command])
+
+
+async def zfs_many(commands, raise_error=True):
+    # commands -> [(command, arguments), ...], run concurrently, see
+    # zcm.lib.zfs.zfs_many()
+    cmds = [get_cmd(command, arguments, None)
+            for command, arguments in commands]
+    try:
+        processes = await get_async_executor().run_many(cmds)
+    finally:
+        invalidate([command for command, arguments in commands])
+    return check_many(processes, raise_error)
+
+
+async def run_steps(steps):
+    # runs the steps of an operation, see zcm.lib.zfs.run_steps(). When it
+    # is cancelled the commands that were running (their zfs processes are
+    # killed) are sent to the steps as failed, so the steps undo what they
+    # did like after any other failure, then the cancellation propagates. A
+    # second cancellation while undoing is not handled
+    cancelled = None
+    try:
+        commands = next(steps)
+        while True:
+            try:
+                results = await zfs_many(commands, raise_error=False)
+            except asyncio.CancelledError as e:
+                if cancelled is not None:
+                    raise
+                cancelled = e
+                results = [ZFSError('%s cancelled\n' % ' '.join(get_cmd(command, arguments, None)))
+                           for command, arguments in commands]
+            commands = steps.send(results)
+    except StopIteration as e:
+        if cancelled is not None:
+            raise cancelled
+        return e.value
+    except Exception:
+        if cancelled is not None:
+            raise cancelled
+        raise
+
+
+async def zfs_list(zfs_name=None, zfs_type=None, recursive=False,
+                   properties=['name', 'used', 'avail', 'refer', 'mountpoint'], raw=False):
+    # returns [] if zfs_name does not exist, raises ZFSError on any other error
+    arguments = zfs_list_arguments(zfs_name, zfs_type, recursive, properties)
+    return zfs_list_check(await run_query('list', arguments), properties, raw)
+
+
+async def zfs_get_many(zfs_names, property_names, ignore_missing=False):
+    # returns {zfs_name: {property_name: value}} from a single zfs get
+    if not zfs_names:
+        return {}
+    return zfs_get_parse(await run_query('get', zfs_get_arguments(zfs_names, property_names)),
+                         ignore_missing)
+
+
+async def zfs_mount_waves(waves, unmount=False):
+    # see zcm.lib.zfs.zfs_mount_waves()
+    return await run_steps(mount_waves_steps(waves, unmount))
@@ -0,0 +1,132 @@
+# Copyright 2021, Guillermo Adrián Molina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from zcm import zcm_config
+
+log = logging.getLogger(__name__)
+
+
+class ExecutorStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.spawns = 0
+            self.failures = 0
+            self.total_time = 0.0
+            self.max_time = 0.0
+            self.commands = {}
+
+    def record(self, cmd, elapsed=None, returncode=0):
+        # cmd -> ['/usr/sbin/zfs', 'list', '-Hp', ...], cmd[1] is the zfs command
+        command = cmd[1] if len(cmd) > 1 else cmd[0]
+        with self._lock:
+            self.spawns += 1
+            self.commands[command] = self.commands.get(command, 0) + 1
+            if returncode != 0:
+                self.failures += 1
+            if elapsed is not None:
+                self.total_time += elapsed
+                self.max_time = max(self.max_time, elapsed)
+
+    @property
+    def average_time(self):
+        if self.spawns == 0:
+            return 0.0
+        return self.total_time / self.spawns
+
+    def to_dictionary(self):
+        with self._lock:
+            return {
+                'spawns': self.spawns,
+                'failures': self.failures,
+                'total_time': self.total_time,
+                'average_time': self.average_time,
+                'max_time': self.max_time,
+                'commands': dict(self.commands)
+            }
+
+
+class Executor:
+    # zfs has no persistent command channel, every command is a process.
+    # The executor accounts for them and runs independent commands
+    # concurrently on a reusable pool of worker threads.
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers
+        self.stats = ExecutorStats()
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    @property
+    def pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                max_workers = self.max_workers or zcm_config['max_workers']
+                self._pool = ThreadPoolExecutor(max_workers=max_workers,
+                                                thread_name_prefix='zcm')
+            return self._pool
+
+    def run(self, cmd):
+        start = time.perf_counter()
+        try:
+            process = subprocess.run(cmd, capture_output=True, text=True)
+        except OSError:
+            self.stats.record(cmd, time.perf_counter() - start, -1)
+            raise
+        self.stats.record(cmd, time.perf_counter() - start, process.returncode)
+        return process
+
+    def run_many(self, cmds):
+        # results are returned in the same order as cmds
+        if len(cmds) < 2:
+            return [self.run(cmd) for cmd in cmds]
+        return list(self.pool.map(self.run, cmds))
+
+    def popen(self, cmd, stdin=None, stdout=None, stderr=None, bufsize=-1):
+        # streaming commands are counted, but their latency is up to the caller
+        self.stats.record(cmd)
+        return subprocess.Popen(cmd, stdin=stdin, stdout=stdout, stderr=stderr,
+                                bufsize=bufsize)
+
+    def shutdown(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = Executor()
+    return _executor
+
+
+def set_executor(executor):
+    # returns the previous executor, so it can be restored
+    global _executor
+    previous = _executor
+    _executor = executor
+    return previous
@@ -17,6 +17,7 @@ import logging
 import random
 import string
 import subprocess
+from datetime import timedelta
 
 log = logging.getLogger(__name__)
 
@@ -33,6 +34,34 @@ def check_one_or_more(value):
     return check_positive(value, 1)
 
 
+DURATION_UNITS = {'m': 'minutes', 'h': 'hours', 'd': 'days', 'w': 'weeks'}
+SIZE_UNITS = {'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40, 'P': 2**50}
+
+
+def check_duration(value):
+    # 90m, 12h, 30d, 2w -> timedelta
+    try:
+        return timedelta(**{DURATION_UNITS[value[-1]]: check_positive(value[:-1])})
+    except (KeyError, ValueError, IndexError):
+        raise argparse.ArgumentTypeError(
+            "%s is an invalid duration, use <number>m|h|d|w" % value)
+
+
+def check_size(value):
+    # 512, 100K, 10G -> bytes, in powers of 1024 like zfs
+    try:
+        if value[-1].upper() in SIZE_UNITS:
+            size = int(float(value[:-1]) * SIZE_UNITS[value[-1].upper()])
+        else:
+            size = int(value)
+        if size < 0:
+            raise ValueError(value)
+        return size
+    except (ValueError, IndexError):
+        raise argparse.ArgumentTypeError(
+            "%s is an invalid size, use <number>[K|M|G|T|P]" % value)
+
+
 # https://stackoverflow.com/questions/2257441/random-string-generation-with-upper-case-letters-and-digits
 def id_generator(size=10, chars=string.ascii_uppercase + string.digits):
     return ''.join(random.choice(chars) for _ in range(size))
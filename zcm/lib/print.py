@@ -12,6 +12,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
+import sys
 from collections import deque
 from itertools import islice
 
@@ -20,6 +22,9 @@ from zcm import zcm_config
 # TODO: use from prettytable import PrettyTable ?
 
 def print_table(table, header=True, truncate=True, separation=2, identation=0, page_size=25):
+    # table can be a generator, with pagination only one page is kept in
+    # memory. Without it the whole table is one page, so that the columns
+    # are aligned across every row
     if page_size <= 0:
         page_size = None
     i = iter(table)
@@ -37,6 +42,22 @@ def print_table(table, header=True, truncate=True, separation=2, identation=0, p
             return
 
 
+def print_json_list(items):
+    # same output as print(json.dumps(list(items), indent=4)), one item at a time
+    first_item = True
+    for item in items:
+        lines = json.dumps(item, indent=4).split('\n')
+        print(('[' if first_item else ',') + '\n' +
+              '\n'.join('    ' + line for line in lines), end='')
+        first_item = False
+    print('[]' if first_item else '\n]')
+
+
+def print_json_lines(items):
+    for item in items:
+        print(json.dumps(item))
+
+
 def print_table_page(page, header=True, truncate=True, separation=2, identation=0):
     MAX_COLUMN_LENGTH = zcm_config['max_column_length']
     if len(page) == 0:
@@ -96,3 +117,11 @@ def format_bytes(size):
 def print_info(data):
     for key, value in data.items():
         print('%s: %s' % (key, value))
+
+
+def print_progress(zfs, progress):
+    # zcm.lib.stream.Progress of a dataset of the manager zfs, to stderr
+    state = 'done' if progress.finished else '...'
+    print('%s: %s in %.1fs (%s/s) %s' % (zfs + progress.name, format_bytes(progress.bytes),
+                                          progress.elapsed, format_bytes(progress.rate), state),
+          file=sys.stderr)
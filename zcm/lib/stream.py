@@ -0,0 +1,242 @@
+# Copyright 2021, Guillermo Adrián Molina
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# ZCM streams hold several zfs send streams in one file or pipe. A stream
+# is MAGIC followed by frames of a type byte and a 4 bytes length:
+#   H  header, a JSON object
+#   D  data of the last header (a chunk of a zfs send stream)
+#   E  end of the data of the last header
+#   F  end of the stream
+# The whole stream can be compressed with gzip, bz2 or xz.
+
+import json
+import logging
+import struct
+import time
+
+from zcm import zcm_config
+
+log = logging.getLogger(__name__)
+
+MAGIC = b'ZCMSTREAM1\n'
+FRAME = struct.Struct('>cI')
+
+
+# the compression modules are imported when a stream needs them
+def open_gzip(file, mode):
+    import gzip
+    return gzip.GzipFile(fileobj=file, mode=mode)
+
+
+def open_bz2(file, mode):
+    import bz2
+    return bz2.BZ2File(file, mode)
+
+
+def open_xz(file, mode):
+    import lzma
+    return lzma.LZMAFile(file, mode)
+
+
+COMPRESSIONS = {
+    'gzip': (b'\x1f\x8b', open_gzip),
+    'bz2': (b'BZh', open_bz2),
+    'xz': (b'\xfd7zXZ\x00', open_xz)
+}
+
+
+class StreamError(Exception):
+    def __init__(self, message="Stream Error"):
+        super().__init__()
+        self.message = message
+
+
+def copy_stream(source, target, buffer_size=None):
+    # copies source.read() to target.write() in blocks, returns the size
+    if buffer_size is None:
+        buffer_size = zcm_config['stream_buffer_size']
+    size = 0
+    while True:
+        block = source.read(buffer_size)
+        if not block:
+            return size
+        target.write(block)
+        size += len(block)
+
+
+class Progress:
+    # bytes and throughput of a stream, per dataset and in total. report is
+    # called with the progress at most every interval seconds while a dataset
+    # is transferred and once at its end
+    def __init__(self, report=None, interval=1.0):
+        self.report = report
+        self.interval = interval
+        self.start_time = time.perf_counter()
+        self.total = 0
+        self.datasets = []
+        self.name = None
+        self.bytes = 0
+        self.dataset_start_time = None
+        self.last_report = None
+        self.finished = False
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.dataset_start_time
+
+    @property
+    def total_elapsed(self):
+        return time.perf_counter() - self.start_time
+
+    @property
+    def rate(self):
+        elapsed = self.elapsed
+        return self.bytes / elapsed if elapsed > 0 else 0.0
+
+    def begin(self, name):
+        self.name = name
+        self.bytes = 0
+        self.dataset_start_time = time.perf_counter()
+        self.last_report = self.dataset_start_time
+        self.finished = False
+
+    def update(self, size):
+        self.bytes += size
+        self.total += size
+        if self.report is not None and \
+                time.perf_counter() - self.last_report >= self.interval:
+            self.last_report = time.perf_counter()
+            self.report(self)
+
+    def end(self):
+        # ends the current dataset, if any
+        if self.name is None or self.finished:
+            return
+        self.datasets.append((self.name, self.bytes, self.elapsed))
+        self.finished = True
+        if self.report is not None:
+            self.report(self)
+
+
+class StreamWriter:
+    # output -> binary file object, compression -> None or a COMPRESSIONS key
+    def __init__(self, output, compression=None, progress=None):
+        self.output = output
+        self.file = output
+        if compression is not None:
+            if compression not in COMPRESSIONS:
+                raise StreamError('Unknown compression ' + compression)
+            self.file = COMPRESSIONS[compression][1](output, 'wb')
+        self.progress = progress
+        self.file.write(MAGIC)
+
+    def write_frame(self, frame_type, data=b''):
+        self.file.write(FRAME.pack(frame_type, len(data)))
+        if data:
+            self.file.write(data)
+
+    def begin(self, header):
+        # header -> dictionary, the data written until end() belongs to it,
+        # progress is kept for the headers with a name
+        self.write_frame(b'H', json.dumps(header).encode('utf-8'))
+        if self.progress is not None and 'name' in header:
+            self.progress.begin(header['name'])
+
+    def write(self, data):
+        self.write_frame(b'D', data)
+        if self.progress is not None:
+            self.progress.update(len(data))
+
+    def end(self):
+        self.write_frame(b'E')
+        if self.progress is not None:
+            self.progress.end()
+
+    def close(self):
+        self.write_frame(b'F')
+        if self.file is not self.output:
+            self.file.close()
+        self.output.flush()
+
+
+class StreamReader:
+    # input -> buffered binary file object, the compression is detected
+    def __init__(self, input, progress=None):
+        if not hasattr(input, 'peek'):
+            raise StreamError('The stream must be a buffered binary file')
+        self.file = input
+        start = input.peek(len(MAGIC))[:len(MAGIC)]
+        for magic, open_compressed in COMPRESSIONS.values():
+            if start.startswith(magic):
+                self.file = open_compressed(input, 'rb')
+                break
+        if self.read_exactly(len(MAGIC)) != MAGIC:
+            raise StreamError('Not a ZCM stream')
+        self.progress = progress
+        self.data_left = 0
+        self.in_data = False
+
+    def read_exactly(self, size):
+        data = self.file.read(size)
+        while len(data) < size:
+            block = self.file.read(size - len(data))
+            if not block:
+                raise StreamError('The ZCM stream is truncated')
+            data += block
+        return data
+
+    def read_frame_header(self):
+        return FRAME.unpack(self.read_exactly(FRAME.size))
+
+    def read_header(self):
+        # returns the next header, None at the end of the stream
+        if self.in_data:
+            self.skip()
+        frame_type, size = self.read_frame_header()
+        if frame_type == b'F':
+            return None
+        if frame_type != b'H':
+            raise StreamError('Unexpected frame %s in ZCM stream' % frame_type)
+        header = json.loads(self.read_exactly(size).decode('utf-8'))
+        self.in_data = True
+        self.data_left = 0
+        if self.progress is not None and 'name' in header:
+            self.progress.begin(header['name'])
+        return header
+
+    def read(self, size=-1):
+        # data of the last header, b'' once it ends
+        if not self.in_data:
+            return b''
+        while self.data_left == 0:
+            frame_type, frame_size = self.read_frame_header()
+            if frame_type == b'E':
+                self.in_data = False
+                if self.progress is not None:
+                    self.progress.end()
+                return b''
+            if frame_type != b'D':
+                raise StreamError('Unexpected frame %s in ZCM stream' % frame_type)
+            self.data_left = frame_size
+        if size is None or size < 0 or size > self.data_left:
+            size = self.data_left
+        data = self.read_exactly(size)
+        self.data_left -= size
+        if self.progress is not None:
+            self.progress.update(size)
+        return data
+
+    def skip(self):
+        while self.read(zcm_config['stream_buffer_size']):
+            pass
@@ -15,10 +15,18 @@
 
 import io
 import logging
+import os
 import pathlib
 import subprocess
+import threading
+import time
+from collections import Counter, OrderedDict, deque
 from datetime import datetime
 
+from zcm import zcm_config
+from zcm.lib.executor import get_executor
+from zcm.lib.stream import copy_stream
+
 log = logging.getLogger(__name__)
 
 
@@ -29,7 +37,7 @@ class ZFSError(Exception):
 
 
 def get_cmd(command,  arguments, options):
-    cmd = ['/usr/sbin/zfs', command]
+    cmd = [zcm_config['zfs_command'], command]
     if options is not None:
         for option in options:
             cmd += ['-o', option]
@@ -39,14 +47,12 @@ def get_cmd(command,  arguments, options):
     return cmd
 
 
-def _zfs(command,  arguments=None, options=None, stdout=None):
+def _zfs(command,  arguments=None, options=None, stdout=None, stderr=None):
     cmd = get_cmd(command, arguments, options)
-    return subprocess.Popen(cmd, stdout=stdout)
+    return get_executor().popen(cmd, stdout=stdout, stderr=stderr)
 
 
-def zfs(command,  arguments=None, options=None):
-    cmd = get_cmd(command, arguments, options)
-    process = subprocess.run(cmd, capture_output=True, text=True)
+def _check(process):
     if process.stdout:
         for line in iter(process.stdout.splitlines()):
             log.info(line)
@@ -61,6 +67,142 @@ def zfs(command,  arguments=None, options=None):
     return process.stdout
 
 
+# zfs commands that change nothing, any other one clears the cache
+QUERY_COMMANDS = {'list', 'get', 'diff', 'send'}
+
+
+class ZFSCache:
+    # process local cache of the output of zfs list and zfs get, keyed by
+    # their arguments. Entries expire after zcm_config['zfs_cache_ttl']
+    # seconds (0 disables the cache) and the least recently used ones are
+    # evicted past zcm_config['zfs_cache_size']
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return zcm_config['zfs_cache_ttl'] > 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > zcm_config['zfs_cache_ttl']:
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > zcm_config['zfs_cache_size']:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def to_dictionary(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self.entries)
+        }
+
+
+zfs_cache = ZFSCache()
+
+
+def run_query(command, arguments):
+    # runs zfs list or zfs get through zfs_cache, only successful runs or
+    # runs that failed because a dataset does not exist are cached
+    if not zfs_cache.enabled:
+        return get_executor().run(get_cmd(command, arguments, None))
+    key = (command,) + tuple(arguments)
+    process = zfs_cache.get(key)
+    if process is None:
+        process = get_executor().run(get_cmd(command, arguments, None))
+        if process.returncode == 0 or is_missing_error(process.stderr):
+            zfs_cache.put(key, process)
+    return process
+
+
+def invalidate(commands):
+    if any(command not in QUERY_COMMANDS for command in commands):
+        zfs_cache.clear()
+
+
+def zfs(command,  arguments=None, options=None):
+    cmd = get_cmd(command, arguments, options)
+    try:
+        return _check(get_executor().run(cmd))
+    finally:
+        invalidate([command])
+
+
+def zfs_many(commands, raise_error=True):
+    # commands -> [(command, arguments), ...], run concurrently
+    # returns the list of stdouts, raises ZFSError when any of them failed
+    # or, if not raise_error, returns the ZFSError in place of its stdout
+    cmds = [get_cmd(command, arguments, None)
+            for command, arguments in commands]
+    try:
+        processes = get_executor().run_many(cmds)
+    finally:
+        invalidate([command for command, arguments in commands])
+    return check_many(processes, raise_error)
+
+
+def check_many(processes, raise_error=True):
+    # the stdouts of processes, or their ZFSError, see zfs_many()
+    result = []
+    for process in processes:
+        try:
+            result.append(_check(process))
+        except ZFSError as e:
+            result.append(e)
+    if raise_error:
+        raise_errors(result)
+    return result
+
+
+def raise_errors(results):
+    # results -> of zfs_many(raise_error=False), raises a ZFSError with
+    # every error in them
+    errors = [result.message for result in results if isinstance(result, ZFSError)]
+    if errors:
+        raise ZFSError(''.join(errors))
+    return results
+
+
+def zfs_step(command, arguments):
+    # a step of a single zfs command, returns its stdout or raises ZFSError
+    results = yield [(command, arguments)]
+    return raise_errors(results)[0]
+
+
+def run_steps(steps):
+    # steps -> generator that yields lists of (command, arguments) and is
+    # sent the result of running each of them with zfs_many(), concurrently
+    # and with the ZFSError in place of the stdout of the failed commands.
+    # Returns what the generator returns. The operations of Manager are
+    # written as steps, so zcm.lib.async_zfs runs the same ones
+    try:
+        commands = next(steps)
+        while True:
+            commands = steps.send(zfs_many(commands, raise_error=False))
+    except StopIteration as e:
+        return e.value
+
+
 def zfs_create(zfs_name, parent=None, mountpoint=None, compression=None, recursive=False, zcm_path=None):
     filesystem = zfs_name
     if parent is None:
@@ -71,12 +213,13 @@ def zfs_create(zfs_name, parent=None, mountpoint=None, compression=None, recursi
         filesystem = '%s/%s' % (parent, zfs_name)
 
     if recursive:
-        zfs_path = ''
-        is_zpool = True
+        zfs_paths = []
         for zfs_fs in parent.split('/'):
-            zfs_path += '/' if zfs_path else ''
-            zfs_path += zfs_fs
-            if not zfs_is_filesystem(zfs_path):
+            zfs_paths.append(zfs_paths[-1] + '/' + zfs_fs if zfs_paths else zfs_fs)
+        types = zfs_get_many(zfs_paths, ['type'], ignore_missing=True)
+        is_zpool = True
+        for zfs_path in zfs_paths:
+            if types.get(zfs_path, {}).get('type') != 'filesystem':
                 if is_zpool:
                     return None
                 zfs('create', [zfs_path])
@@ -128,36 +271,99 @@ def zfs_inherit(zfs_name, property_name):
     return zfs('inherit', [property_name, zfs_name])
 
 
-def value_convert(property_name, value):
-    if value == 'on':
-        return True
-    if value == 'off':
-        return False
-    if value == '-':
-        return None
-    if property_name in ['mountpoint', 'zfs_clone_manager:path']:
-        return pathlib.Path(value)
-    if property_name in ['creation', 'st_ctim', 'mtime', 'atime', 'crtime']:
-        try:
-            return datetime.fromtimestamp(float(value))
-        except ValueError:
-            pass
+SPECIAL_VALUES = {'on': True, 'off': False, '-': None}
+
+
+def convert_number(value):
+    # on, off and - are not numbers either, so they are checked last
     try:
         return int(value)
     except ValueError:
-        return value
+        return SPECIAL_VALUES.get(value, value)
+
+
+def convert_path(value):
+    if value in SPECIAL_VALUES:
+        return SPECIAL_VALUES[value]
+    return pathlib.Path(value)
+
+
+def convert_date(value):
+    if value in SPECIAL_VALUES:
+        return SPECIAL_VALUES[value]
+    try:
+        return datetime.fromtimestamp(float(value))
+    except ValueError:
+        return convert_number(value)
+
+
+# property_name -> converter, any other property uses convert_number()
+CONVERTERS = {
+    'mountpoint': convert_path,
+    'zfs_clone_manager:path': convert_path,
+    'creation': convert_date,
+    'st_ctim': convert_date,
+    'mtime': convert_date,
+    'atime': convert_date,
+    'crtime': convert_date
+}
+
+
+def get_converters(property_names):
+    return [CONVERTERS.get(property_name, convert_number)
+            for property_name in property_names]
+
+
+def value_convert(property_name, value):
+    return CONVERTERS.get(property_name, convert_number)(value)
+
+
+def is_missing_error(stderr):
+    # True if zfs only complained about datasets that do not exist
+    lines = stderr.splitlines()
+    return bool(lines) and all(line.endswith(('dataset does not exist',
+                                              'not a ZFS filesystem'))
+                               for line in lines)
+
+
+def zfs_get_many(zfs_names, property_names, ignore_missing=False):
+    # returns {zfs_name: {property_name: value}} from a single zfs get,
+    # zfs_names that do not exist are left out if ignore_missing
+    if not zfs_names:
+        return {}
+    return zfs_get_parse(run_query('get', zfs_get_arguments(zfs_names, property_names)),
+                         ignore_missing)
+
+
+def zfs_get_arguments(zfs_names, property_names):
+    return ['-Hp', '-o', 'name,property,value',
+            ','.join(property_names)] + [str(name) for name in zfs_names]
+
+
+def zfs_get_parse(process, ignore_missing=False):
+    # process -> of zfs get, returns {zfs_name: {property_name: value}}
+    if process.returncode != 0:
+        if not ignore_missing or not is_missing_error(process.stderr):
+            raise ZFSError(process.stderr)
+    values = {}
+    for line in process.stdout.splitlines():
+        if not line:
+            continue
+        name, property_name, value = line.split('\t', 2)
+        values.setdefault(name, {})[property_name] = value_convert(
+            property_name, value)
+    return values
 
 
 def zfs_get(zfs_name, property_name):
+    # with property_name 'all' returns {property_name: value}
+    values = zfs_get_many([zfs_name], [property_name])
+    if not values:
+        raise ZFSError('Could not get %s of %s' % (property_name, zfs_name))
+    properties = next(iter(values.values()))
     if property_name == 'all':
-        raise NotImplementedError()
-    cmd = ['/usr/sbin/zfs', 'get', '-Hp', property_name, zfs_name]
-    with open('/dev/null', 'w') as dev_null:
-        log.debug('Running command: "' + ' '.join(cmd) + '"')
-        output = subprocess.check_output(cmd, stderr=dev_null)
-        value = output.decode('utf-8').split('\t')[2]
-        return value_convert(property_name, value)
-    return None
+        return properties
+    return properties[property_name]
 
 
 def zfs_snapshot(zfs_name, filesystem, recursive=False):
@@ -170,58 +376,168 @@ def zfs_snapshot(zfs_name, filesystem, recursive=False):
     return snapshot
 
 
-def zfs_destroy(zfs_name, recursive=False, synchronous=True):
+def zfs_destroy_arguments(zfs_name, recursive=False, synchronous=True):
     arguments = []
     if recursive:
         arguments.append('-r')
     if synchronous:
         arguments.append('-s')
     arguments.append(zfs_name)
-    return zfs('destroy', arguments)
+    return arguments
+
+
+def zfs_destroy(zfs_name, recursive=False, synchronous=True):
+    return zfs('destroy', zfs_destroy_arguments(zfs_name, recursive, synchronous))
+
+
+def zfs_destroy_many(zfs_names, recursive=False, synchronous=True):
+    # destroys independent datasets concurrently
+    return zfs_many([('destroy', zfs_destroy_arguments(zfs_name, recursive, synchronous))
+                     for zfs_name in zfs_names])
 
 
 def zfs_promote(zfs_name):
     return zfs('promote', [zfs_name])
 
 
-def zfs_send(last_snapshot, target_file_path, first_snapshot=None, recursive=False):
+def zfs_send(last_snapshot, target, first_snapshot=None, recursive=False):
+    # streams zfs send into target, a file path or a binary file object,
+    # returns the size of the stream, raises ZFSError if zfs send fails
+    # first_snapshot -> incremental stream with every snapshot in between
+    if not hasattr(target, 'write'):
+        with open(target, 'wb') as target_file:
+            return zfs_send(last_snapshot, target_file, first_snapshot, recursive)
     arguments = []
     if recursive:
         arguments.append('-R')
     if first_snapshot is not None:
         arguments += ['-I', first_snapshot]
     arguments.append(last_snapshot)
-    with open(target_file_path, 'wb') as target_file:
-        return _zfs('send', arguments, stdout=target_file)
-
-
-def zfs_list(zfs_name=None, zfs_type=None, recursive=False,
-             properties=['name', 'used', 'avail', 'refer', 'mountpoint']):
-    cmd = ['/usr/sbin/zfs', 'list', '-Hp']
+    buffer_size = zcm_config['stream_buffer_size']
+    process = get_executor().popen(get_cmd('send', arguments, None),
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                   bufsize=buffer_size)
+    completed = False
+    try:
+        size = copy_stream(process.stdout, target, buffer_size)
+        completed = True
+    finally:
+        if not completed:
+            process.kill()
+        process.stdout.close()
+        stderr = process.stderr.read().decode('utf-8')
+        process.stderr.close()
+        returncode = process.wait()
+    if returncode != 0:
+        raise ZFSError(stderr)
+    return size
+
+
+def zfs_receive(zfs_name, source, unmounted=False, force=False):
+    # feeds source, a file path or a binary file object, to zfs receive,
+    # returns the size of the stream, raises ZFSError if zfs receive fails
+    if not hasattr(source, 'read'):
+        with open(source, 'rb') as source_file:
+            return zfs_receive(zfs_name, source_file, unmounted, force)
+    arguments = []
+    if unmounted:
+        arguments.append('-u')
+    if force:
+        arguments.append('-F')
+    arguments.append(zfs_name)
+    buffer_size = zcm_config['stream_buffer_size']
+    process = get_executor().popen(get_cmd('receive', arguments, None),
+                                   stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.PIPE, bufsize=buffer_size)
+    size = 0
+    try:
+        size = copy_stream(source, process.stdin, buffer_size)
+        process.stdin.close()
+    except BrokenPipeError:
+        # zfs receive failed, its error is more useful than this one
+        pass
+    finally:
+        stderr = process.stderr.read().decode('utf-8')
+        process.stderr.close()
+        returncode = process.wait()
+        invalidate(['receive'])
+    if returncode != 0:
+        raise ZFSError(stderr)
+    return size
+
+
+def zfs_list_arguments(zfs_name, zfs_type, recursive, properties):
+    arguments = ['-Hp']
     if recursive:
-        cmd.append('-r')
+        arguments.append('-r')
     if zfs_type is not None and zfs_type in ['all', 'filesystem',
                                              'snapshot', 'volume']:
-        cmd += ['-t', zfs_type]
+        arguments += ['-t', zfs_type]
     if properties is not None:
-        cmd += ['-o', ','.join(properties)]
+        arguments += ['-o', ','.join(properties)]
     if zfs_name is not None:
-        cmd.append(zfs_name)
+        # a zfs name or a list of them
+        if isinstance(zfs_name, (list, tuple)):
+            arguments += zfs_name
+        else:
+            arguments.append(zfs_name)
+    return arguments
+
+
+def zfs_list_parse(lines, properties, raw=False):
+    # Implemented as generator, lines of zfs list -Hp output -> dictionaries
+    # raw -> keep the values as printed, without conversion
+    converters = None if raw else get_converters(properties)
+    for line in lines:
+        line = line.rstrip('\n')
+        if not line:
+            continue
+        values = line.split('\t')
+        if raw:
+            yield dict(zip(properties, values))
+        else:
+            yield {property_name: convert(value) for property_name, convert, value
+                   in zip(properties, converters, values)}
+
+
+def zfs_list_iter(zfs_name=None, zfs_type=None, recursive=False,
+                  properties=['name', 'used', 'avail', 'refer', 'mountpoint'], raw=False):
+    # Implemented as generator, yields every dataset while zfs list prints them
+    # raises ZFSError if zfs list fails
+    arguments = zfs_list_arguments(zfs_name, zfs_type, recursive, properties)
+    process = _zfs('list', arguments, stdout=subprocess.PIPE,
+                   stderr=subprocess.PIPE)
+    completed = False
     try:
-        with open('/dev/null', 'w') as dev_null:
-            filesystems = []
-            log.debug('Running command: "' + ' '.join(cmd) + '"')
-            output = subprocess.check_output(cmd, stderr=dev_null)
-            for line in output.decode('utf-8').strip().split('\n'):
-                values = line.split('\t')
-                filesystem = {}
-                for property_name, value in zip(properties, values):
-                    filesystem[property_name] = value_convert(
-                        property_name, value)
-                filesystems.append(filesystem)
-            return filesystems
-    except:
-        return []
+        yield from zfs_list_parse(
+            io.TextIOWrapper(process.stdout, encoding='utf-8'), properties, raw)
+        completed = True
+    finally:
+        if not completed:
+            process.kill()
+        stderr = process.stderr.read().decode('utf-8')
+        process.stdout.close()
+        process.stderr.close()
+        returncode = process.wait()
+    if returncode != 0:
+        raise ZFSError(stderr)
+
+
+def zfs_list(zfs_name=None, zfs_type=None, recursive=False,
+             properties=['name', 'used', 'avail', 'refer', 'mountpoint'], raw=False):
+    # returns [] if zfs_name does not exist, raises ZFSError on any other error
+    # raw -> keep the values as printed by zfs list -Hp, without conversion
+    arguments = zfs_list_arguments(zfs_name, zfs_type, recursive, properties)
+    return zfs_list_check(run_query('list', arguments), properties, raw)
+
+
+def zfs_list_check(process, properties, raw=False):
+    # process -> of zfs list, [] if the dataset does not exist
+    if process.returncode != 0:
+        if is_missing_error(process.stderr):
+            return []
+        raise ZFSError(process.stderr)
+    return list(zfs_list_parse(process.stdout.splitlines(), properties, raw))
 
 
 def zfs_exists(zfs_name):
@@ -229,39 +545,212 @@ def zfs_exists(zfs_name):
     return len(filesystems) == 1
 
 
-def zfs_is_filesystem(zfs_name):
+def zfs_get_types(zfs_names):
+    # returns {zfs_name: type} of the zfs_names that exist
     try:
-        return zfs_get(zfs_name, 'type') == 'filesystem'
-    except:
-        return False
+        values = zfs_get_many(zfs_names, ['type'], ignore_missing=True)
+    except ZFSError:
+        return {}
+    return {name: properties['type'] for name, properties in values.items()}
+
+
+def zfs_is_filesystem(zfs_name):
+    return list(zfs_get_types([zfs_name]).values()) == ['filesystem']
 
 
 def zfs_is_snapshot(zfs_name):
+    return list(zfs_get_types([zfs_name]).values()) == ['snapshot']
+
+
+DIFF_FILE_TYPES = {
+    'F': 'file',
+    '/': 'directory',
+    'B': 'device',
+    '>': 'door',
+    '|': 'fifo',
+    '@': 'link',
+    'P': 'portal',
+    '=': 'socket'
+}
+
+DIFF_CHANGE_TYPES = {
+    '+': 'Added',
+    '-': 'Removed',
+    'M': 'Modified',
+    'R': 'Renamed'
+}
+
+
+def zfs_diff_parse(lines, prefix=None, include_file_types=False):
+    # lines of zfs diff -H -t [-F] output -> compact records
+    # (date, change, file_type, file), all of them strings: date as printed
+    # by zfs, file relative to prefix (the mountpoint) and file_type None
+    # without include_file_types. Module level so it can run in a worker.
+    # Renamed files only keep the new path.
+    change_types = DIFF_CHANGE_TYPES
+    file_types = DIFF_FILE_TYPES
+    if prefix is not None:
+        prefix = prefix.rstrip('/') + '/'
+    records = []
+    for line in lines:
+        columns = line.rstrip('\n').split('\t')
+        if len(columns) < 3:
+            continue
+        file = columns[-1]
+        if prefix is not None:
+            file = zfs_diff_relative(file, prefix)
+        records.append((columns[0], change_types[columns[1]],
+                        file_types[columns[2]] if include_file_types else None,
+                        file))
+    return records
+
+
+def zfs_diff_relative(file, prefix):
+    # file printed by zfs diff relative to prefix, a directory ending in /
+    if file.startswith(prefix):
+        return file[len(prefix):]
+    if file + '/' == prefix:
+        return '.'
+    raise ValueError('%s is not in %s' % (file, prefix))
+
+
+def zfs_diff_chunks(lines, chunk_size):
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def zfs_diff_parse_chunks(chunks, prefix, include_file_types, workers):
+    # Implemented as generator, yields the parsed chunks in order, with
+    # workers > 1 they are parsed in a process pool, at most 2 * workers
+    # chunks at a time
+    if workers is None or workers < 2:
+        for chunk in chunks:
+            yield zfs_diff_parse(chunk, prefix, include_file_types)
+        return
+    # multiprocessing is only imported by the commands that use it
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        try:
+            for chunk in chunks:
+                pending.append(pool.submit(
+                    zfs_diff_parse, chunk, prefix, include_file_types))
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def zfs_diff_cache_file(cache_directory, origin_snapshot, snapshot, arguments):
+    # snapshots are immutable, so the output of zfs diff between two of them
+    # is cached by their guids (names can be renamed or reused) and options.
+    # The paths are kept relative to the mountpoint, which changes when a
+    # clone is activated. Returns the cache file and the mountpoint of the
+    # filesystem of snapshot
+    filesystem = snapshot.split('@')[0]
+    values = zfs_get_many([origin_snapshot, snapshot, filesystem], ['guid', 'mountpoint'])
+    if len(values) != 3:
+        raise ZFSError('Could not get the guids of %s and %s' %
+                       (origin_snapshot, snapshot))
+    options = ''.join(argument[1:] for argument in arguments
+                      if argument.startswith('-'))
+    cache_file = pathlib.Path(cache_directory, '%s-%s-%s-relative.diff' % (
+        values[origin_snapshot]['guid'], values[snapshot]['guid'], options))
+    return cache_file, values[filesystem]['mountpoint']
+
+
+def zfs_diff_cached_lines(cache_file):
+    # Implemented as generator, yields the lines of a cache file written by
+    # zfs_diff_lines(), with the paths relative to the mountpoint
+    log.debug('Reading zfs diff output from ' + str(cache_file))
+    with open(cache_file, encoding='utf-8') as lines:
+        # the least recently used files are the first evicted
+        os.utime(lines.fileno())
+        yield from lines
+
+
+def zfs_diff_cache_prune(cache_directory, max_size):
+    # removes the least recently used cache files until the ones left take
+    # at most max_size bytes
+    files = []
+    for entry in os.scandir(cache_directory):
+        if entry.name.endswith('.diff') and entry.is_file():
+            stat = entry.stat()
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for mtime, size, path in files)
+    for mtime, size, path in sorted(files):
+        if total <= max_size:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def zfs_diff_lines(arguments, cache_file=None, prefix=None):
+    # Implemented as generator, yields the lines printed by zfs diff,
+    # raises ZFSError if zfs diff fails. With cache_file, they are written
+    # to it with the paths relative to prefix once zfs diff succeeds, and
+    # the cache is pruned to zcm_config['diff_cache_size'] bytes
+    if prefix is not None:
+        prefix = prefix.rstrip('/') + '/'
+    process = _zfs('diff', arguments, stdout=subprocess.PIPE,
+                   stderr=subprocess.PIPE)
+    lines = io.TextIOWrapper(process.stdout, encoding='utf-8')
+    cache = None
+    if cache_file is not None:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        temporary_file = cache_file.with_name(
+            '.%s.%d' % (cache_file.name, os.getpid()))
+        cache = open(temporary_file, 'w', encoding='utf-8')
+    completed = False
     try:
-        return zfs_get(zfs_name, 'type') == 'snapshot'
-    except:
-        return False
-
-
-def zfs_diff(zfs_name, origin_snapshot=None, include_file_types=False, recursive=False):
-    # Implemented as generator, in case it is too big
-    file_types = {
-        'F': 'file',
-        '/': 'directory',
-        'B': 'device',
-        '>': 'door',
-        '|': 'fifo',
-        '@': 'link',
-        'P': 'portal',
-        '=': 'socket'
-    }
-    change_types = {
-        '+': 'Added',
-        '-': 'Removed',
-        'M': 'Modified',
-        'R': 'Renamed'
-    }
-
+        for line in lines:
+            if cache is not None:
+                columns = line.rstrip('\n').split('\t')
+                if prefix is not None and len(columns) >= 3:
+                    columns[-1] = zfs_diff_relative(columns[-1], prefix)
+                cache.write('\t'.join(columns) + '\n')
+            yield line
+        completed = True
+    finally:
+        if not completed:
+            process.kill()
+        stderr = process.stderr.read().decode('utf-8')
+        lines.close()
+        process.stderr.close()
+        returncode = process.wait()
+        if cache is not None:
+            cache.close()
+            if completed and returncode == 0:
+                os.replace(temporary_file, cache_file)
+                zfs_diff_cache_prune(cache_file.parent, zcm_config['diff_cache_size'])
+            else:
+                os.unlink(temporary_file)
+    if returncode != 0:
+        raise ZFSError(stderr)
+
+
+def zfs_diff(zfs_name, origin_snapshot=None, include_file_types=False, recursive=False,
+             mountpoint=None, compact=False, workers=None, chunk_size=None,
+             cache_directory=None):
+    # Implemented as generator, in case it is too big, raises ZFSError if
+    # zfs diff fails. The output is parsed in chunks of chunk_size lines (default
+    # zcm_config['diff_chunk_size']), in a pool of workers processes if given.
+    # compact -> yields the (date, change, file_type, file) string tuples of
+    # zfs_diff_parse() instead of dictionaries with datetime and Path values
+    # cache_directory -> where the output of zfs diff between two snapshots is
+    # kept, see zfs_diff_cache_file()
     arguments = ['-H', '-t']
     if include_file_types:
         arguments.append('-F')
@@ -272,23 +761,70 @@ def zfs_diff(zfs_name, origin_snapshot=None, include_file_types=False, recursive
     else:
         arguments.append(origin_snapshot)
     arguments.append(zfs_name)
-    mountpoint = None
-    if not '@' in zfs_name:
-        mountpoint = zfs_get(zfs_name, 'mountpoint')
-    process = _zfs('diff', arguments, stdout=subprocess.PIPE)
-    for line in io.TextIOWrapper(process.stdout, encoding="utf-8"):
-        records = line.strip().split('\t')
-        data = {}
-        file = pathlib.Path(records[-1])
-        if mountpoint is not None:
-            data['mountpoint'] = mountpoint
-            file = file.relative_to(mountpoint)
-        data['date'] = value_convert('st_ctim', records[0])
-        data['change'] = change_types[records[1]]
-        data['file'] = file
-        if include_file_types:
-            data['file_type'] = file_types[records[2]]
-        yield data
+    cache_file = None
+    if cache_directory and origin_snapshot is not None and '@' in zfs_name:
+        cache_file, filesystem_mountpoint = zfs_diff_cache_file(
+            cache_directory, origin_snapshot, zfs_name, arguments)
+        if mountpoint is None:
+            mountpoint = filesystem_mountpoint
+    # mountpoint -> of the filesystem, the files of a snapshot are printed
+    # under its .zfs/snapshot directory. Either way they are made relative
+    if mountpoint is None:
+        mountpoint = zfs_get(zfs_name.split('@')[0], 'mountpoint')
+    prefix = str(mountpoint)
+    if '@' in zfs_name:
+        prefix = str(pathlib.Path(mountpoint, '.zfs', 'snapshot', zfs_name.split('@')[1]))
+    if chunk_size is None:
+        chunk_size = zcm_config['diff_chunk_size']
+    if cache_file is not None and cache_file.is_file():
+        lines = zfs_diff_cached_lines(cache_file)
+        prefix = None
+    else:
+        lines = zfs_diff_lines(arguments, cache_file, prefix)
+    try:
+        for records in zfs_diff_parse_chunks(zfs_diff_chunks(lines, chunk_size),
+                                             prefix, include_file_types, workers):
+            if compact:
+                yield from records
+                continue
+            for date, change, file_type, file in records:
+                data = {'mountpoint': mountpoint}
+                data['date'] = convert_date(date)
+                data['change'] = change
+                data['file'] = pathlib.Path(file)
+                if include_file_types:
+                    data['file_type'] = file_type
+                yield data
+    finally:
+        lines.close()
+
+
+def zfs_diff_summary(zfs_name, origin_snapshot=None, recursive=False, mountpoint=None,
+                     top=10, workers=None, cache_directory=None):
+    # folds zfs_diff() compact records into counters, only the counters are
+    # kept in memory. Returns {'total': n, 'changes': {change: n},
+    # 'file_types': {file_type: n}, 'directories': [(directory, n), ...]}
+    # with the top directories (first component of the path, '.' for the
+    # entries of the mountpoint itself) that had more changes
+    changes = Counter()
+    file_types = Counter()
+    directories = Counter()
+    for date, change, file_type, file in zfs_diff(zfs_name, origin_snapshot,
+                                                  include_file_types=True,
+                                                  recursive=recursive,
+                                                  mountpoint=mountpoint,
+                                                  compact=True, workers=workers,
+                                                  cache_directory=cache_directory):
+        changes[change] += 1
+        file_types[file_type] += 1
+        directory, separator, rest = file.lstrip('/').partition('/')
+        directories[directory if separator else '.'] += 1
+    return {
+        'total': sum(changes.values()),
+        'changes': dict(changes.most_common()),
+        'file_types': dict(file_types.most_common()),
+        'directories': directories.most_common(top)
+    }
 
 
 def zfs_rename(original_zfs_name, new_zfs_name):
@@ -300,5 +836,42 @@ def zfs_mount(zfs_name):
     return zfs('mount', [zfs_name])
 
 
+def mount_waves(mountpoints):
+    # mountpoints -> {zfs_name: mountpoint}
+    # returns lists of zfs names that can be mounted at the same time,
+    # every mountpoint comes in a later list than the ones it is nested in
+    paths = set(pathlib.Path(mountpoint) for mountpoint in mountpoints.values())
+    waves = {}
+    for zfs_name, mountpoint in mountpoints.items():
+        parents = pathlib.Path(mountpoint).parents
+        depth = sum(1 for parent in parents if parent in paths)
+        waves.setdefault(depth, []).append(zfs_name)
+    return [waves[depth] for depth in sorted(waves)]
+
+
+def zfs_mount_waves(waves, unmount=False):
+    # mounts (or unmounts) every wave concurrently, one wave after the other
+    # returns the zfs names that were mounted and the ZFSError that stopped
+    # the process, or None
+    return run_steps(mount_waves_steps(waves, unmount))
+
+
+def mount_waves_steps(waves, unmount=False):
+    # steps of zfs_mount_waves(), see run_steps()
+    command = 'unmount' if unmount else 'mount'
+    done = []
+    for wave in waves:
+        results = yield [(command, [zfs_name]) for zfs_name in wave]
+        errors = []
+        for zfs_name, result in zip(wave, results):
+            if isinstance(result, ZFSError):
+                errors.append(result.message)
+            else:
+                done.append(zfs_name)
+        if errors:
+            return done, ZFSError(''.join(errors))
+    return done, None
+
+
 def zfs_unmount(zfs_name):
     return zfs('unmount', [zfs_name])